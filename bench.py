@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Benchmark of the skill primitives and scripted episodes of the LABOR Agent
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from robot_session import configure_session
+from episode_metrics import metrics
+
+"""
+Benchmark structure:
+bench -- run the scripted self_run chain of every task type `repeats` times
+bench -- time every arm skill of the chains by the primitive that executed it, plus a final reset
+bench -- report p50/p95 latency, sim calls and success rate, optionally as JSON
+bench -- compare against an earlier JSON report
+"""
+
+# Which nicol_controller primitive a labor_control command runs, as in execute_command.
+COMMAND_PRIMITIVES = {
+    'move_to': 'move_single_to_pose',
+    'move_above': 'move_single_to_pose',
+    'push_to': 'push_to',
+    'pour_out': 'flip_down',
+    'hold_up': 'hold_up_single',
+    'release': 'release',
+    'reset': 'reset',
+}
+
+def primitive_name(command, para):
+    if command == 'move_and_grasp':
+        return 'top_grasp' if para.get('obj_name') in ('Apple', 'Banana') else 'side_grasp'
+    return COMMAND_PRIMITIVES.get(command)
+
+def stats(samples):
+    latencies = [sample['latency'] for sample in samples]
+    return {
+        'n': len(samples),
+        'p50': round(float(np.percentile(latencies, 50)), 4),
+        'p95': round(float(np.percentile(latencies, 95)), 4),
+        'mean': round(float(np.mean(latencies)), 4),
+        'sim_calls': round(float(np.mean([sample['sim_calls'] for sample in samples])), 1),
+        'success_rate': round(float(np.mean([sample['success'] for sample in samples])), 3),
+    }
+
+def run_bench(args):
+    configure_session(port=args.port, scene=args.scene, backend=args.backend)
+    # The modules connect on first use, so import them after the session is configured.
+    import llm_coordinator
+    from main import reset_task
+    from skill_worker import LocalSkillWorker, get_worker
+    from tasks import create_task, TASKS
+    from scenarios import Scenarios
+    scenarios = Scenarios(args.scenario_file) if args.scenario_file else None
+    # In-process skills are already part of the coordinator's own sim count.
+    local_skills = isinstance(get_worker('left'), LocalSkillWorker)
+    control = llm_coordinator.LABORControlTool()
+    primitives, episodes = {}, {}
+    for task_name in args.tasks:
+        task = create_task(task_name, scenarios)
+        for type_index, task_type in enumerate(TASKS[task_name].task_types):
+            for repeat in range(args.repeats):
+                reset_task(task_name, task, type_index, repeat if scenarios is not None else None)
+                llm_coordinator.reset_global()
+                metrics.reset()
+                start = time.perf_counter()
+                try:
+                    task.self_run()
+                    success = bool(task.check_success())
+                except Exception as e:
+                    print(f"{task_name}/{task_type} raised:", e)
+                    success = False
+                latency = time.perf_counter() - start
+                summary = metrics.summary()
+                sim_calls = summary.get('sim_calls', 0) + (0 if local_skills else summary.get('skill_sim_calls', 0))
+                episodes.setdefault(f"{task_name}/{task_type}", []).append({'latency': latency, 'sim_calls': sim_calls, 'success': success})
+                control._run('reset', {}, 'reset', {})
+                steps = zip(llm_coordinator.LEFT_COMMANDS, llm_coordinator.LEFT_PARA, llm_coordinator.LEFT_SKILL_RESULTS,
+                            llm_coordinator.RIGHT_COMMANDS, llm_coordinator.RIGHT_PARA, llm_coordinator.RIGHT_SKILL_RESULTS)
+                for left_command, left_para, left_record, right_command, right_para, right_record in steps:
+                    # Both hands to the serve point is one coordinator-side motion, see LABORControlTool.
+                    if left_command == right_command == 'move_to' and left_para == right_para and left_para.get('obj_name') == 'serve_point':
+                        arms = [('move_both_to_poses', left_record)]
+                    else:
+                        arms = [(primitive_name(left_command, left_para), left_record), (primitive_name(right_command, right_para), right_record)]
+                    for name, record in arms:
+                        if name is not None:
+                            primitives.setdefault(name, []).append({'latency': record['duration'], 'sim_calls': record['sim_calls'],
+                                                                    'success': 'failed' not in str(record['message'])})
+                for records in (llm_coordinator.LEFT_COMMANDS, llm_coordinator.RIGHT_COMMANDS, llm_coordinator.LEFT_PARA, llm_coordinator.RIGHT_PARA,
+                                llm_coordinator.LEFT_ACTION_FEEDBACK, llm_coordinator.RIGHT_ACTION_FEEDBACK,
+                                llm_coordinator.LEFT_SKILL_RESULTS, llm_coordinator.RIGHT_SKILL_RESULTS):
+                    records.clear()
+    return {
+        'backend': args.backend or 'default',
+        'repeats': args.repeats,
+        'primitives': {name: stats(samples) for name, samples in sorted(primitives.items())},
+        'episodes': {name: stats(samples) for name, samples in sorted(episodes.items())},
+    }
+
+def print_report(report, baseline=None):
+    for group in ('primitives', 'episodes'):
+        print(f"\n{group:<34} {'n':>4} {'p50 [s]':>9} {'p95 [s]':>9} {'sim calls':>10} {'success':>8}" + ('  p50 vs baseline' if baseline else ''))
+        for name, row in report[group].items():
+            line = f"{name:<34} {row['n']:>4} {row['p50']:>9.3f} {row['p95']:>9.3f} {row['sim_calls']:>10.1f} {row['success_rate']:>8.2f}"
+            base = (baseline or {}).get(group, {}).get(name)
+            if base and base['p50'] > 0:
+                line += f"  {row['p50'] / base['p50']:>6.2f}x"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Parameters")
+    parser.add_argument('--tasks', type=str, nargs='+', default=['ServeWater', 'ServeFruit'], choices=['ServeWater', 'ServeFruit'], help="Which tasks to run")
+    parser.add_argument('--repeats', type=int, default=3, help="How often every task type is run")
+    parser.add_argument('--backend', type=str, default=None, choices=['coppelia', 'offline'], help="Simulator backend (default: LABOR_BACKEND or coppelia)")
+    parser.add_argument('--port', type=int, default=None, help="ZMQ port of the simulator (default: LABOR_SIM_PORT or the API default)")
+    parser.add_argument('--scene', type=str, default=None, help="Scene file of the simulator (default: LABOR_SCENE or ./nicol.ttt)")
+    parser.add_argument('--scenario_file', type=str, default=None, help="Take the object layouts from this scenario file, one per repeat")
+    parser.add_argument('--output', type=str, default=None, help="Write the report as JSON to this file")
+    parser.add_argument('--compare', type=str, default=None, help="Earlier JSON report to compare the p50 latencies with")
+    args = parser.parse_args()
+    report = run_bench(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('\nReport written to', args.output)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Parallel evaluation campaigns over several CoppeliaSim instances
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from recorder import merge_records, record_name
+
+path = os.path.dirname(os.path.abspath(__file__))
+
+"""
+Campaign structure:
+campaign -- (optionally) launch one headless simulator per ZMQ port
+campaign -- run main.py once per simulator, each on its own shard of the episodes
+campaign -- merge the shard records by task index
+"""
+
+def main(args):
+    sims, shards = [], []
+    for shard in range(args.num_sims):
+        port = args.base_port + shard
+        if args.sim_command:
+            sims.append(subprocess.Popen(shlex.split(args.sim_command.format(port=port)), cwd=path,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    if sims:
+        time.sleep(args.sim_startup)
+    for shard in range(args.num_sims):
+        command = [sys.executable, os.path.join(path, 'main.py'),
+                   f'--task_name={args.task_name}', f'--num_tasks={args.num_tasks}', f'--model_name={args.model_name}',
+                   f'--record_format={args.record_format}', f'--shard={shard}', f'--num_shards={args.num_sims}']
+        command += [f'--llm_cache={args.llm_cache}', f'--llm_cache_file={args.llm_cache_file}', f'--llm_cache_size={args.llm_cache_size}',
+                    f'--planner_attempts={args.planner_attempts}']
+        if args.scenario_file:
+            command.append(f'--scenario_file={args.scenario_file}')
+        if args.backend:
+            command.append(f'--backend={args.backend}')
+        if args.llm_base_url:
+            command.append(f'--llm_base_url={args.llm_base_url}')
+        if args.skill_timeout:
+            command += ['--skill_timeout'] + args.skill_timeout
+        command += [flag for flag, used in (('--use_labor', args.use_labor), ('--use_llm', args.use_llm), ('--resume', args.resume),
+                                                 ('--llm_stream', args.llm_stream), ('--plan_steps', args.plan_steps)) if used]
+        # Each shard and its two skill workers talk to their own simulator.
+        env = dict(os.environ, LABOR_SIM_PORT=str(args.base_port + shard))
+        shards.append(subprocess.Popen(command, cwd=path, env=env, stdout=subprocess.DEVNULL))
+    failed = [shard for shard, proc in enumerate(shards) if proc.wait() != 0]
+    for sim_proc in sims:
+        sim_proc.terminate()
+    if failed:
+        print('The shards', failed, 'did not finish, see their logs.')
+    if args.use_llm:
+        shard_files = [record_name(args.task_name, args.model_name, args.use_labor, args.num_tasks, shard) + '.' + args.record_format
+                       for shard in range(args.num_sims)]
+        record_file = record_name(args.task_name, args.model_name, args.use_labor, args.num_tasks) + '.' + args.record_format
+        print('Records merged into', merge_records(shard_files, record_file, args.record_format))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Campaign Parameters")
+    parser.add_argument('--use_labor', action='store_true', default=False, help="Wether to use labor or not")
+    parser.add_argument('--use_llm', action='store_true', default=False, help="Wether to use LLM or not")
+    parser.add_argument('--task_name', type=str, default="ServeFruit", help="Which task to run")
+    parser.add_argument('--num_tasks', type=int, default=10, help="How many tasks to run")
+    parser.add_argument('--model_name', type=str, default="gpt-4o", help="Which model to use")
+    parser.add_argument('--record_format', type=str, default="csv", choices=['csv', 'jsonl'], help="File format of the episode records")
+    parser.add_argument('--resume', action='store_true', default=False, help="Skip episodes already in the shard record files")
+    parser.add_argument('--llm_cache', type=str, default='off', choices=['off', 'record', 'replay'], help="LLM response cache mode shared by all shards")
+    parser.add_argument('--llm_cache_file', type=str, default='./logs/llm_cache.sqlite', help="SQLite file of the LLM response cache")
+    parser.add_argument('--llm_cache_size', type=int, default=10000, help="How many LLM responses the cache keeps at most")
+    parser.add_argument('--scenario_file', type=str, default=None, help="Scenario file with the object layouts, shared by all shards")
+    parser.add_argument('--backend', type=str, default=None, choices=['coppelia', 'offline'], help="Simulator backend of every shard (default: LABOR_BACKEND or coppelia)")
+    parser.add_argument('--llm_base_url', type=str, default=None, help="OpenAI-compatible chat endpoint of every shard, e.g. a local mock server")
+    parser.add_argument('--llm_stream', action='store_true', default=False, help="Start skills while the LLM reply is still streaming")
+    parser.add_argument('--plan_steps', action='store_true', default=False, help="Let the LLM send several bimanual steps per call")
+    parser.add_argument('--planner_attempts', type=int, default=3, help="How often the planner is run for an episode in which it sent no labor_control step")
+    parser.add_argument('--skill_timeout', type=str, nargs='*', default=[], help="Skill deadlines passed to every shard, as command=seconds")
+    parser.add_argument('--num_sims', type=int, default=2, help="How many simulators to run in parallel")
+    parser.add_argument('--base_port', type=int, default=23000, help="ZMQ port of the first simulator, the others follow")
+    parser.add_argument('--sim_command', type=str, default=None,
+                        help="Command that starts a headless simulator on {port}, e.g. 'coppeliaSim.sh -h -GzmqRemoteApi.rpcPort={port} nicol.ttt'")
+    parser.add_argument('--sim_startup', type=float, default=10, help="Seconds to wait for launched simulators to come up")
+    args = parser.parse_args()
+    main(args)
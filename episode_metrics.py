@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Per-episode timing and token metrics for the LABOR Agent
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class EpisodeMetrics():
+    """
+    Accumulates spans (count and wall-clock seconds per name) and plain counters
+    for the current episode. One instance per process, `metrics` below; the
+    planner reports to it through its callbacks, the coordinator, the skill
+    workers and the instrumented sim through span() and add().
+
+    Span names in use: episode, reset, planner_run, llm, tool.<name>,
+    skill.<command>, worker_start, sim, settle, ik, monitor.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.times = defaultdict(float)
+            self.counts = defaultdict(int)
+            self.values = defaultdict(float)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            self.times[name] += seconds
+            self.counts[name] += count
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.values[name] += value
+
+    # Planner callbacks
+    def on_llm_end(self, latency, usage=None, cached=False):
+        self.add('llm', latency)
+        if cached:
+            self.count('llm_cached')
+        if usage:
+            self.count('prompt_tokens', usage.get('prompt_tokens') or 0)
+            self.count('completion_tokens', usage.get('completion_tokens') or 0)
+
+    def on_tool_end(self, name, latency):
+        self.add('tool.' + name, latency)
+
+    def add_skill(self, command, record):
+        """Account one arm's skill record returned by a worker."""
+        self.add('skill.' + command, record.get('duration', 0.0))
+        self.count('skill_sim_calls', record.get('sim_calls', 0))
+        self.count('skill_sim_time', record.get('sim_time', 0.0))
+        self.count('settle_steps', record.get('settle_steps', 0))
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for name in sorted(self.times):
+                summary[name + '_time'] = round(self.times[name], 3)
+                summary[name + '_calls'] = self.counts[name]
+            for name in sorted(self.values):
+                summary[name] = round(self.values[name], 3)
+            return summary
+
+
+metrics = EpisodeMetrics()
+
+
+class InstrumentedSim():
+    """Wraps the sim API so every remote call is counted as a 'sim' span."""
+    def __init__(self, sim, episode_metrics=metrics):
+        self._sim = sim
+        self._metrics = episode_metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._sim, name)
+        if not callable(attribute):
+            return attribute
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._metrics.add('sim', time.perf_counter() - start)
+        # Later lookups of the same function skip __getattr__.
+        self.__dict__[name] = timed
+        return timed
+
+
+def metrics_table(episodes):
+    """Total and per-episode mean of every metric over a list of summaries."""
+    names = sorted({name for episode in episodes for name in episode})
+    if not names:
+        return 'No episode metrics.'
+    width = max(len(name) for name in names)
+    lines = [f"{'metric':<{width}}  {'total':>12}  {'mean':>12}", '-' * (width + 28)]
+    for name in names:
+        values = [episode.get(name, 0) for episode in episodes]
+        lines.append(f"{name:<{width}}  {sum(values):>12.3f}  {sum(values) / len(episodes):>12.3f}")
+    return '\n'.join(lines)
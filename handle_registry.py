@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Object-handle and alias cache shared by the skills of the LABOR Agent
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+
+ALIAS_VARIANTS = ('', '_respondable', '_top', '_left', '_right')
+
+
+class HandleRegistry():
+    """
+    Caches sim.getObject and sim.getObjectAlias results, including names that
+    do not exist in the scene, so each name costs at most one remote call until
+    the scene changes. Call invalidate() after sim.loadModel / sim.removeModel;
+    the version counter lets other processes notice the change.
+
+    Several task models can be in the scene at once (see TaskModels in
+    tasks.py) and share names such as serve_point. With a scope, names are
+    looked up inside the active model first, and objects of parked models are
+    never returned. state() carries version, scope and parked models to the
+    skill workers.
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.handles = {}
+        self.aliases = {}
+        self.version = 0
+        self.scope = None
+        self.parked = []
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, name):
+        """Handle of '/name', or None if there is no such object."""
+        if name in self.handles:
+            self.hits += 1
+            return self.handles[name]
+        self.misses += 1
+        handle = None
+        if self.scope is not None:
+            handle = self._lookup('/' + self.scope + '/' + name)
+        if handle is None:
+            handle = self._lookup('/' + name)
+            if handle is not None and any(self._lookup('/' + root + '/' + name) == handle for root in self.parked):
+                handle = None
+        self.handles[name] = handle
+        return handle
+
+    def _lookup(self, path):
+        try:
+            return self.sim.getObject(path)
+        except Exception:
+            return None
+
+    def get(self, name):
+        handle = self.find(name)
+        if handle is None:
+            raise ValueError(f"The object {name} is not in the scene.")
+        return handle
+
+    def alias(self, handle):
+        """Object alias of a handle without the '_respondable' suffix."""
+        if handle in self.aliases:
+            self.hits += 1
+            return self.aliases[handle]
+        self.misses += 1
+        alias = self.sim.getObjectAlias(handle, -1).replace('_respondable', '')
+        self.aliases[handle] = alias
+        return alias
+
+    def position(self, name):
+        return self.sim.getObjectPosition(self.get(name), self.sim.handle_world)
+
+    def preload(self, names):
+        """Resolve the task objects with all their scene variants in one go."""
+        for name in names:
+            for variant in ALIAS_VARIANTS:
+                self.find(name + variant)
+            self.find('Origin_' + name)
+
+    def set_scope(self, scope, parked=()):
+        """Resolve names inside the model `scope` and hide the objects of the `parked` models."""
+        self.scope = scope
+        self.parked = list(parked)
+        self.invalidate()
+
+    def invalidate(self, version=None):
+        self.handles.clear()
+        self.aliases.clear()
+        self.version = self.version + 1 if version is None else version
+
+    def state(self):
+        return [self.version, self.scope, self.parked]
+
+    def sync(self, state):
+        if state is None:
+            return
+        version, scope, parked = state
+        if version != self.version or scope != self.scope or list(parked) != self.parked:
+            self.scope = scope
+            self.parked = list(parked)
+            self.invalidate(version)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'cached': len(self.handles)}
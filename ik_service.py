@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Batched inverse kinematics for the arms of NICOL Bimanual Robot
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from episode_metrics import metrics
+from robot_session import get_session
+
+"""
+IK service structure:
+solve      -- look every target pose up in a cache of recent solutions, quantized to `resolution`
+solve      -- solve all misses of a call in one vectorized pytorch_kinematics pass on the CPU
+solve      -- warm-start from the last solution of this arm, plus a few random seeds
+solve      -- poses without a converged solution come back as None, for the pose-target fallback
+solve_path -- waypoints of one motion, seeded from the arm's current joints in one batch, uncached
+solve_path -- if a joint jumps between waypoints, each waypoint is re-seeded from the one before
+solve_path -- a path that still jumps or misses a waypoint comes back as None, for pose targets
+frames     -- goals are given in the world frame and moved into the frame of the chain's root link
+"""
+
+# End-effector links of the NICOL arm chains, as in the CycleIK robot config.
+EEF_LINKS = {'left': 'l_laser', 'right': 'r_laser'}
+# Joints per arm, as taken by set_joint_position.
+ARM_JOINTS = 8
+# Largest joint move (rad) allowed between consecutive waypoints of a path: a fixed
+# part plus a part per meter the end effector travels; anything more is a branch flip.
+MAX_JOINT_STEP = 0.35
+MAX_JOINT_STEP_PER_METER = 6.0
+
+
+def default_urdf():
+    # CycleIK ships the NICOL URDF it was trained on.
+    import cycleik_pytorch
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(cycleik_pytorch.__file__))), 'assets', 'urdf', 'NICOL.urdf')
+
+
+class IKService():
+    """
+    Solves batches of end-effector poses (positions with one orientation, in
+    the x, y, z, w order NicolPose takes it) for one arm. The solver is built on first use;
+    if pytorch_kinematics, torch or the URDF are missing, every pose is
+    returned as None and the skills keep sending pose targets.
+    """
+    def __init__(self, side, urdf_file=None, cache_size=512, resolution=1e-3, max_iterations=50, random_seeds=3):
+        self.side = side
+        self.urdf_file = urdf_file or os.environ.get('LABOR_NICOL_URDF')
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.resolution = resolution
+        self.max_iterations = max_iterations
+        self.random_seeds = random_seeds
+        self.last = None
+        self.base = None
+        self.base_known = False
+        self.chain = None
+        self.available = True
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def _build(self):
+        try:
+            import torch
+            import pytorch_kinematics as pk
+            self.urdf_file = self.urdf_file or default_urdf()
+            with open(self.urdf_file, 'rb') as f:
+                chain = pk.build_serial_chain_from_urdf(f.read(), EEF_LINKS[self.side])
+            if len(chain.get_joint_parameter_names()) != ARM_JOINTS:
+                raise ValueError(f"the chain to {EEF_LINKS[self.side]} has {len(chain.get_joint_parameter_names())} joints, not {ARM_JOINTS}")
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Batched IK is not available for the {self.side} arm, using pose targets:", e)
+            self.available = False
+            return None
+        self.torch, self.pk = torch, pk
+        self.chain = chain.to(dtype=torch.float32, device='cpu')
+        self.limits = torch.tensor(self.chain.get_joint_limits(), dtype=torch.float32)
+        return self.chain
+
+    def key(self, position, orientation):
+        return tuple(np.round(np.asarray(list(position) + list(orientation), dtype=float) / self.resolution).astype(int))
+
+    def ready(self):
+        """Whether the solver can be used, building it on first call."""
+        return self.available and (self.chain is not None or self._build() is not None)
+
+    def solve(self, positions, orientation, cache=True):
+        """
+        Joint positions (list) or None for every position, reached with
+        `orientation` (xyzw). With cache=False (e.g. for bulk queries) the
+        cache and the warm start are neither used nor updated.
+        """
+        if not self.ready():
+            return [None] * len(positions)
+        if not cache:
+            with metrics.span('ik'):
+                return self._solve_batch(positions, orientation)
+        keys = [self.key(position, orientation) for position in positions]
+        missing = [i for i, key in enumerate(keys) if key not in self.cache]
+        self.hits += len(positions) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            with metrics.span('ik'):
+                solutions = self._solve_batch([positions[i] for i in missing], orientation)
+            self.batches += 1
+            for i, solution in zip(missing, solutions):
+                self.cache[keys[i]] = solution
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        results = []
+        for key in keys:
+            self.cache.move_to_end(key)
+            results.append(self.cache[key])
+        converged = [result for result in results if result is not None]
+        if converged:
+            self.last = converged[-1]
+        return results
+
+    def solve_path(self, positions, orientation):
+        """
+        Joint positions for the consecutive waypoints of one motion, or None if
+        they cannot be followed on one IK branch of the redundant arm. The
+        whole path is solved in one batch seeded with the arm's current joints;
+        if a waypoint is missing or a joint jumps, the waypoints are solved
+        again one by one, each seeded with the solution of the one before.
+        """
+        if not self.ready() or not positions:
+            return None
+        start = self.current_joints()
+        if start is None:
+            start = self.last
+        with metrics.span('ik'):
+            path = self._solve_batch(positions, orientation, seed=start)
+            self.batches += 1
+            if not self.continuous(start, positions, orientation, path):
+                path, previous = [], start
+                for position in positions:
+                    solution = self._solve_batch([position], orientation, seed=previous)[0]
+                    self.batches += 1
+                    if solution is None:
+                        break
+                    path.append(solution)
+                    previous = solution
+                if not self.continuous(start, positions, orientation, path):
+                    return None
+        self.last = path[-1]
+        return path
+
+    def continuous(self, start, positions, orientation, path):
+        """Whether every waypoint has a solution and no joint moves further than MAX_JOINT_STEP allows on the way."""
+        if len(path) != len(positions) or None in path:
+            return False
+        points, _ = self.to_base(positions, orientation)
+        if start is not None:
+            points, path = [self.reach(start)] + points, [start] + path
+        for i in range(1, len(path)):
+            allowed = MAX_JOINT_STEP + MAX_JOINT_STEP_PER_METER * np.linalg.norm(np.subtract(points[i], points[i - 1]))
+            if np.abs(np.subtract(path[i], path[i - 1])).max() > allowed:
+                return False
+        return True
+
+    def reach(self, joints):
+        """Position of the end effector at `joints`, in the frame of the chain's root link."""
+        matrix = self.chain.forward_kinematics(self.torch.tensor([joints], dtype=self.torch.float32)).get_matrix()
+        return matrix[0, :3, 3].tolist()
+
+    def current_joints(self):
+        """The arm's joint positions in the scene, in chain order, or None if its joints are not found there."""
+        session = get_session()
+        if not session.connected:
+            return None
+        joints = [session.handles.find(name) for name in self.chain.get_joint_parameter_names()]
+        if None in joints:
+            return None
+        return [session.sim.getJointPosition(joint) for joint in joints]
+
+    def base_pose(self):
+        """
+        World pose (x, y, z, qx, qy, qz, qw) of the chain's root link in the
+        scene; None while not connected, or if the link is not in the scene,
+        in which case the URDF base is taken to be the world frame.
+        """
+        if self.base_known:
+            return self.base
+        session = get_session()
+        if not session.connected:
+            return None
+        root = self.chain._root.link.name
+        handle = session.handles.find(root)
+        if handle is None:
+            print(f"The base link {root} of the {self.side} arm is not in the scene, so the IK solves in the world frame.")
+        else:
+            self.base = list(session.sim.getObjectPose(handle, session.sim.handle_world))
+        self.base_known = True
+        return self.base
+
+    def to_base(self, positions, orientation):
+        """World-frame goals in the frame of the chain's root link, which is the frame the IK solves in."""
+        base = self.base_pose()
+        if base is None:
+            return positions, list(orientation)[:4]
+        inverse = Rotation.from_quat(base[3:7]).inv()
+        positions = inverse.apply(np.asarray(positions, dtype=float) - np.asarray(base[:3], dtype=float)).tolist()
+        return positions, (inverse * Rotation.from_quat(list(orientation)[:4])).as_quat().tolist()
+
+    def _solve_batch(self, positions, orientation, seed=None):
+        torch, pk = self.torch, self.pk
+        low, high = self.limits
+        seeds = low + (high - low) * torch.rand(self.random_seeds, len(low))
+        seed = self.last if seed is None else seed
+        if seed is not None:
+            seeds = torch.cat([torch.tensor([seed], dtype=torch.float32), seeds])
+        positions, orientation = self.to_base(positions, orientation)
+        x, y, z, w = orientation
+        goal = pk.Transform3d(pos=torch.tensor(positions, dtype=torch.float32),
+                              rot=torch.tensor([[w, x, y, z]] * len(positions), dtype=torch.float32))
+        ik = pk.PseudoInverseIK(self.chain, max_iterations=self.max_iterations, retry_configs=seeds, joint_limits=self.limits.T,
+                                early_stopping_any_converged=True, early_stopping_no_improvement='all')
+        solution = ik.solve(goal)
+        results = []
+        for i in range(len(positions)):
+            converged = solution.converged[i].nonzero()
+            if len(converged) == 0:
+                results.append(None)
+            else:
+                # The first converged seed, which is the given seed (or the warm start) whenever that one converged.
+                results.append(solution.solutions[i, int(converged[0])].tolist())
+        return results
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'batches': self.batches}
+
+
+_services = {}
+
+def get_ik(side):
+    """The IK service of one arm; the offline arms take pose targets directly, so they get none."""
+    if side not in _services:
+        service = IKService(side)
+        if get_session().backend == 'offline':
+            service.available = False
+        _services[side] = service
+    return _services[side]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Persistent chat-completion cache for the LABOR Agent planners
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_MODES = ('off', 'record', 'replay')
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+class ResponseCache():
+    """
+    Content-addressed SQLite store of chat completions. A key is the hash of the
+    model, temperature, messages and tool schemas of a request, so a repeated
+    request is answered without calling the API. A retry of the same request
+    (attempt > 0) has a key of its own, so it is not answered with the reply
+    that made the retry necessary.
+
+    record: answer hits from the cache, call the model on a miss and store it.
+    replay: answer hits from the cache, raise CacheMiss on a miss; no API calls.
+
+    At most max_entries responses are kept, the least recently used are evicted.
+    The file can be shared by the shards of a campaign.
+    """
+    def __init__(self, cache_file, mode='record', max_entries=10000):
+        if mode not in CACHE_MODES[1:]:
+            raise ValueError(f"Unknown cache mode {mode}, choose from {CACHE_MODES[1:]}.")
+        self.cache_file = cache_file
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        if os.path.dirname(cache_file):
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # The asyncio planner requests completions on worker threads, one at a time per cache.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, last_used REAL)")
+        self.db.commit()
+
+    @staticmethod
+    def key(model, temperature, messages, tools=None, attempt=0):
+        request = [model, temperature, messages, tools] + ([attempt] if attempt else [])
+        request = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            if self.mode == 'replay':
+                raise CacheMiss(f"No recorded LLM response for request {key[:12]} in replay mode.")
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        return row[0]
+
+    def put(self, key, model, response):
+        with self.lock:
+            self._put(key, model, response)
+
+    def _put(self, key, model, response):
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, model, response, time.time()))
+        count = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                            (count - self.max_entries,))
+        self.db.commit()
+
+    def stats(self):
+        return {'mode': self.mode, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.db.close()
+
@@ -5,38 +5,35 @@ Author: Kun Chu (kun.chu@uni-hamburg.de)
 Copyright 2024, Planet Earth
 """
 
-from langchain.agents import AgentType, initialize_agent
-from langchain_openai import ChatOpenAI
-from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
-from typing import Type, Dict
+from typing import Type, Dict, List, Literal
+import asyncio
 import time
 import numpy as np
-import re
-import subprocess
-import json
+from skill_worker import dispatch_both_async
+from planner import PlannerTool, ToolPlanner
+from episode_metrics import metrics
 
 # #### The main LLM-based controller
-from nicol_api.nicol_env import NicolFactory
-from nicol_api.base import NicolPose
-from coppeliasim_zmqremoteapi_client import *
+from robot_session import SessionAttribute, get_session
+from trajectory import DualArmTrajectory
+from ik_service import get_ik
+from reachability import command_reach, out_of_reach, reachable
 
 
 ############################ Initialize ######################################
-nicol = NicolFactory().create_nicol('coppelia', scene="./nicol.ttt", start_scene=False, talker=False)
-head  = nicol.head()    # 3D-Printed head structure
-left  = nicol.left()    # Left OpenManipulator + RH8D
-right = nicol.right()   # Right OpenManipulator + RH8D
-sim = nicol.nicol_adapter.sim
-left_sensor = sim.getObject('/l_sensor')
-left_attachpoint = sim.getObject('/l_palm_attachPoint')
-right_sensor = sim.getObject('/r_sensor')
-right_attachpoint = sim.getObject('/r_palm_attachPoint')
-print("\n"*30, "#"*114, '\n', "#"*114, '\n', 'The simulation starts!')
+# The simulator connects on first use; see robot_session.py for port, scene and backend.
+nicol = SessionAttribute('nicol')
+head  = SessionAttribute('head')     # 3D-Printed head structure
+left  = SessionAttribute('left')     # Left OpenManipulator + RH8D
+right = SessionAttribute('right')    # Right OpenManipulator + RH8D
+sim = SessionAttribute('sim')
+handles = SessionAttribute('handles')
+scene = SessionAttribute('scene')
+NicolPose = SessionAttribute('NicolPose')
 RIGHT_FINGER_STAT, RIGHT_HAND_STAT = 'Open', 'Vertical'
 LEFT_FINGER_STAT, LEFT_HAND_STAT = 'Open', 'Vertical'
 
-import math
 def reset_global():
     global RIGHT_FINGER_STAT
     global LEFT_FINGER_STAT
@@ -46,68 +43,28 @@ def reset_global():
     LEFT_HAND_STAT = RIGHT_HAND_STAT = 'Vertical'
 
 def move_both_to_poses(obj_name:str):
-    handle = sim.getObject('/'+obj_name)
-    new_pose = sim.getObjectPosition(handle, sim.handle_world)
-    left_pose = left.get_eef_pose().position.as_list()
-    right_pose = right.get_eef_pose().position.as_list()
+    new_pose = scene.position(obj_name)
+    snapshot = scene.snapshot()
+    left_pose, left_ori = snapshot['left_eef']
+    right_pose, right_ori = snapshot['right_eef']
     mid_point = [(left_pose[i]+right_pose[i])/2 for i in range(0,3)]
     left_pose_target = [(left_pose[i]+ new_pose[i]-mid_point[i]) for i in range(0, 3)]
     right_pose_target = [(right_pose[i]+ new_pose[i]-mid_point[i]) for i in range(0, 3)]
-    left_ori = left.get_eef_pose().orientation
-    left_ori = [left_ori.x, left_ori.y, left_ori.z, left_ori.w]
-    right_ori = right.get_eef_pose().orientation
-    right_ori = [right_ori.x, right_ori.y, right_ori.z, right_ori.w]
-    steps = 0
-    right_step_pose = left_pose
-    left_step_pose = left_pose
-    step_length = 0.065
-    steps = 0
-    for i in range(0, 3):
-        if math.floor((left_pose_target[i]-left_pose[i])/step_length) > steps:
-            steps = math.floor((left_pose_target[i]-left_pose[i])/step_length)
     head.set_pose_target(NicolPose([new_pose[0], new_pose[1], new_pose[2]+0.5], [0,0,0,0]))
-    for i in range(steps):
-        right_step_pose = [min(right_pose_target[0], right_pose[0]+i*step_length), min(right_pose_target[1], right_pose[1]+i*step_length), min(right_pose_target[2], right_pose[2]+i*step_length)]
-        left_step_pose = [min(left_pose_target[0], left_pose[0]+i*step_length), min(left_pose_target[1], left_pose[1]+i*step_length), min(left_pose_target[2], left_pose[2]+i*step_length)]
-        nicol.set_pose_target_for_both_arms(NicolPose(left_step_pose, left_ori), NicolPose(right_step_pose,right_ori))
-        nicol.set_pose_target_for_both_arms(NicolPose(left_step_pose, left_ori), NicolPose(right_step_pose,right_ori))
-    nicol.set_pose_target_for_both_arms(NicolPose(left_pose_target, left_ori), NicolPose(right_pose_target,right_ori))
-    nicol.set_pose_target_for_both_arms(NicolPose(left_pose_target, left_ori), NicolPose(right_pose_target,right_ori))
+    # One synchronized path for both hands; the offline arms jump, so their waypoints are not paced.
+    trajectory = DualArmTrajectory(left_pose, left_pose_target, right_pose, right_pose_target)
+    trajectory.execute(nicol, NicolPose, left_ori, right_ori, realtime=get_session().backend != 'offline',
+                       arms=(left, right), ik=(get_ik('left'), get_ik('right')))
     result = f"The NICOL robot's both hands have moved simultaneously to the new positon where the {obj_name} is at the middle point of two hands. "
     return result
 
-# Filter results from the stdouts
-##############################################################################
-def extract_parts(side, text):
-    # Pattern to match the sentence
-    sentence_pattern = r"RIGHT_RESULT: (.*?)\. RIGHT_HAND:" if side == "right" else r"LEFT_RESULT: (.*?)\. LEFT_HAND:"
-    # Pattern to match the RIGHT_HAND value
-    hand_pattern = r"RIGHT_HAND: (\w+)" if side == "right" else r"LEFT_HAND: (\w+)"
-    # Pattern to match the RIGHT_FINGER value
-    finger_pattern = r"RIGHT_FINGER: (\w+)" if side == "right" else r"LEFT_FINGER: (\w+)"
-
-    # Extract the sentence
-    sentence_match = re.search(sentence_pattern, text)
-    sentence = sentence_match.group(1) if sentence_match else None
-
-    # Extract the RIGHT_HAND value
-    hand_match = re.search(hand_pattern, text)
-    hand = hand_match.group(1) if hand_match else None
-
-    # Extract the RIGHT_FINGER value
-    finger_match = re.search(finger_pattern, text)
-    finger = finger_match.group(1) if finger_match else None
-
-    return sentence, hand, finger
-##############################################################################
-
 # Get Arm Pose
 ##############################################################################
 class GetArmStateInput(BaseModel):
     """input for get_both_arm_poses"""
     empty: Dict = Field(description="empty dict", examples=[{}])
         
-class GetArmStateTool(BaseTool):
+class GetArmStateTool(PlannerTool):
     name = "get_both_arm_poses"
     description = """
         Useful for when you want to know the current pose of the robot. No parameter needed from input.
@@ -120,17 +77,21 @@ class GetArmStateTool(BaseTool):
         and the right hand's finger state ['right_finger_status']"""
     # args_schema: Type[BaseModel] = GetArmStateInput
     def _run(self, empty=None):
-        left_palm_pos = left.get_eef_pose().position.as_list()
-        right_palm_pos = right.get_eef_pose().position.as_list()
+        snapshot = scene.snapshot()
+        left_palm_pos = snapshot['left_eef'][0]
+        right_palm_pos = snapshot['right_eef'][0]
         result_dict = {
             'left_hand_pose': [round(left_palm_pos[0],3), round(left_palm_pos[1],3), round(left_palm_pos[2]-0.86,3)],
-            'right_hand_pose': [round(right_palm_pos[0],3), round(right_palm_pos[1],3), round(left_palm_pos[2]-0.86,3)],
+            'right_hand_pose': [round(right_palm_pos[0],3), round(right_palm_pos[1],3), round(right_palm_pos[2]-0.86,3)],
             'left_hand_orientation': LEFT_HAND_STAT,
             'right_hand_orientation': RIGHT_HAND_STAT,
             'left_finger_status': LEFT_FINGER_STAT,
             'right_finger_status': RIGHT_FINGER_STAT
             }
         return result_dict
+
+    async def _arun(self, empty=None):
+        return await get_session().call(self._run, empty)
 ##############################################################################
 
 # Get object position
@@ -139,73 +100,66 @@ class GetObjPosInput(BaseModel):
     """Inputs for get_obj_position"""
     obj_name: str = Field(description="One single object name", examples='obj')
 
-class GetObjPosTool(BaseTool):
+class GetObjPosTool(PlannerTool):
     name = "get_object_position"
     description = """
-        Useful when you want to know the specified object's position."""
+        Useful when you want to know the specified object's position and which hands can reach it."""
     args_schema: Type[BaseModel] = GetObjPosInput
     def _run(self, obj_name):
         try:
-            obj_handle = sim.getObject('/'+obj_name)
-            # objA_handle = sim.getObject('/'+obj_A)
-            obj_pose = np.array(sim.getObjectPosition(obj_handle, sim.handle_world))
-            return [round(pos, 2) for pos in obj_pose]
+            obj_pose = np.array(scene.position(obj_name))
         except Exception as e:
-            return 'There is no such object in the current environment!'
+            return {'error': 'There is no such object in the current environment!'}
+        return {'position': [round(pos, 2) for pos in obj_pose],
+                'reachable_by': [side for side in ('left', 'right') if reachable(side, obj_pose)]}
+
+    async def _arun(self, obj_name):
+        # Served on a thread, so it can answer while the arms move.
+        return await get_session().call(self._run, obj_name)
 #############################################################################
 
 
 ##############################################################################
+SKILL_COMMANDS = Literal['move_to', 'move_and_grasp', 'move_above', 'push_to', 'pour_out', 'hold_up', 'release', 'reset', 'wait']
+
 class LABORControlInput(BaseModel):
     """Inputs for labor_control"""
-    param_des: str = """
-Description of parameter inputs for each command
-- 'obj_name': some points names from the task description.
-"""
-    left_command: str = Field(description=
-        """Command chosed for the LEFT hand. 
-        Avaliable choices for 'left_command' are chosed from the following commands set: [move_to, move_and_grasp, move_above, push_to, pour_out, hold_up, release, reset, wait]. """)
-    left_para: Dict[str, str] = Field(description=
-        param_des+ """
-        Parameters of commands chosed for the LEFT hand in terms of the Dict. 
-        parameters of move_to: 'obj_name'
-        parameters of move_and_grasp: 'obj_name'
-        parameters of move_above: 'obj_name'
-        parameters of hold_up: 'obj_name'
-        parameters of push_to: 'source_obj_name', 'target_obj_name'
-        parameters of pour_out: {}
-        parameters of release: {}
-        parameters of wait: {}
-        parameters of reset: {}
-        Generate the list of required parameters with appropriate fields (Dict).""")
-    right_command: str = Field(description=
-        """Command chosed for the RIGHT hand. 
-        Avaliable choices for 'left_command' are chosed from the following commands set: [move_to, move_and_grasp, move_above, push_to, pour_out, hold_up, release, reset, wait]. """)
-    right_para: Dict[str, str] = Field(description=
-        param_des+ """
-        Parameters of commands chosed for the RIGHT hand in terms of the Dict. 
-        parameters of move_to: 'obj_name'
-        parameters of move_and_grasp: 'obj_name'
-        parameters of move_above: 'obj_name'
-        parameters of hold_up: 'obj_name'
-        parameters of push_to: 'source_obj_name', 'target_obj_name'
-        parameters of pour_out: {}
-        parameters of release: {}
-        parameters of wait: {}
-        parameters of reset: {}
-        Generate the list of required parameters with appropriate fields (Dict).""")
+    left_command: SKILL_COMMANDS = Field(description="Command for the LEFT hand.")
+    left_para: Dict[str, str] = Field(description="Parameters of the LEFT command.")
+    right_command: SKILL_COMMANDS = Field(description="Command for the RIGHT hand.")
+    right_para: Dict[str, str] = Field(description="Parameters of the RIGHT command.")
+    stage: Literal['sync', 'async_left', 'async_right'] = Field(default='sync', description=
+        "sync: both hands start at the same time. async_left / async_right: the left / right hand's command finishes before the other hand's starts.")
 
 ##############################################################################
-global LEFT_COMMANDS, RIGHT_COMMANDS, LEFT_PARA, RIGHT_PARA, TASK_SUCCESS, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK
+global LEFT_COMMANDS, RIGHT_COMMANDS, LEFT_PARA, RIGHT_PARA, TASK_SUCCESS, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK, LEFT_SKILL_RESULTS, RIGHT_SKILL_RESULTS
 LEFT_COMMANDS = []
 LEFT_PARA = []
 RIGHT_COMMANDS = []
 RIGHT_PARA = []
 LEFT_ACTION_FEEDBACK = []
 RIGHT_ACTION_FEEDBACK = []
+LEFT_SKILL_RESULTS = []
+RIGHT_SKILL_RESULTS = []
+
+def unreachable_message(side, command, para, hand_stat):
+    # The skill's own out-of-area feedback if the target is outside the arm's reachability map, else None.
+    obj_name = para.get('obj_name')
+    skill = command_reach(command, obj_name)
+    if skill is None or not obj_name:
+        return None
+    try:
+        position = list(handles.position(obj_name))
+    except Exception:
+        return None
+    return out_of_reach(skill, side, obj_name, position, hand_stat)
+
+def skill_feedback(record):
+    # The part of a skill record that the model needs to plan the next step.
+    return {key: record[key] for key in ('message', 'hand', 'finger', 'grasped')}
 
 ##############################################################################
-class LABORControlTool(BaseTool):
+class LABORControlTool(PlannerTool):
     name = "labor_control"
     description = """
 Applicable robot skills to control the hand are: 
@@ -218,39 +172,102 @@ Applicable robot skills to control the hand are:
 - pour_out: to turn one wrist to flip down grasped object to pour its content out (must above some container)
 - reset: to reset one hand to its original status
 - wait: the hand, including any possible grasped objects, holds on its present states
+Parameters: move_to, move_and_grasp, move_above and hold_up take {'obj_name': <point name from the task description>}; push_to takes {'source_obj_name', 'target_obj_name'}; pour_out, release, reset and wait take {}.
+Returns the feedback, hand orientation, finger state and grasped object of each hand.
 """
     args_schema: Type[BaseModel] = LABORControlInput
-    def _run(self, left_command, left_para, right_command, right_para):
-        head.set_pose_target(NicolPose([0.8, 0.0, 1], [0, 0, 0, 0]))
-        global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT, LEFT_COMMANDS, LEFT_PARA, RIGHT_COMMANDS, RIGHT_PARA, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK
+    # TaskMonitor of the running episode, evaluated after every step.
+    monitor = None
+
+    def _run(self, left_command, left_para, right_command, right_para, stage='sync'):
+        return asyncio.run(self._arun(left_command, left_para, right_command, right_para, stage))
+
+    async def _arun(self, left_command, left_para, right_command, right_para, stage='sync'):
+        # Everything that talks to the simulator from this process runs through the session lock;
+        # the skills themselves are awaited on the arm threads.
+        session = get_session()
+        await session.call(head.set_pose_target, NicolPose([0.8, 0.0, 1], [0, 0, 0, 0]))
+        global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT, LEFT_COMMANDS, LEFT_PARA, RIGHT_COMMANDS, RIGHT_PARA, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK, LEFT_SKILL_RESULTS, RIGHT_SKILL_RESULTS
         LEFT_COMMANDS.append(left_command)
         LEFT_PARA.append(left_para)
         RIGHT_COMMANDS.append(right_command)
         RIGHT_PARA.append(right_para)
         if (left_command == right_command == 'move_to' and left_para == right_para and left_para['obj_name'] == 'serve_point'):
             if LEFT_HAND_STAT == RIGHT_HAND_STAT == 'Horizontally_Slanted_Up':
-                left_result = right_result = move_both_to_poses(left_para['obj_name'])
+                start_time = time.time()
+                left_result = right_result = await session.call(move_both_to_poses, left_para['obj_name'])
+                duration = round(time.time() - start_time, 3)
             else:
                 left_result = right_result = []
+                duration = 0.0
+            left_record = {'side': 'left', 'message': left_result, 'hand': LEFT_HAND_STAT,
+                           'finger': LEFT_FINGER_STAT, 'grasped': None, 'duration': duration, 'settle_steps': 0, 'settle_time': 0.0, 'sim_calls': 0, 'sim_time': 0.0}
+            right_record = {'side': 'right', 'message': right_result, 'hand': RIGHT_HAND_STAT,
+                            'finger': RIGHT_FINGER_STAT, 'grasped': None, 'duration': duration, 'settle_steps': 0, 'settle_time': 0.0, 'sim_calls': 0, 'sim_time': 0.0}
         else:
-            left_proc = subprocess.Popen(['python', 'nicol_controller.py', "--side=left", f"--command={left_command}", f"--para={json.dumps(left_para)}", f"--hand_state={LEFT_HAND_STAT}", f"--finger_state={LEFT_FINGER_STAT}"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            time.sleep(1)
-            right_proc = subprocess.Popen(['python', 'nicol_controller.py', "--side=right", f"--command={right_command}", f"--para={json.dumps(right_para)}", f"--hand_state={RIGHT_HAND_STAT}", f"--finger_state={RIGHT_FINGER_STAT}"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            l_stdout, _ = left_proc.communicate()
-            r_stdout, _ = right_proc.communicate()
-            left_result, left_hand, left_finger = extract_parts("left", l_stdout)
-            right_result, right_hand, right_finger = extract_parts("right", r_stdout)
-            if left_result is None:
-                print(l_stdout)
-            if right_result is None:
-                print(r_stdout)
-            LEFT_HAND_STAT, LEFT_FINGER_STAT = left_hand, left_finger
-            RIGHT_HAND_STAT, RIGHT_FINGER_STAT = right_hand, right_finger
+            # Out-of-reach commands are answered here; that arm only waits instead of starting the skill.
+            left_rejected = await session.call(unreachable_message, 'left', left_command, left_para, LEFT_HAND_STAT)
+            right_rejected = await session.call(unreachable_message, 'right', right_command, right_para, RIGHT_HAND_STAT)
+            left_record, right_record = await dispatch_both_async(('wait', {}, LEFT_HAND_STAT, LEFT_FINGER_STAT) if left_rejected else (left_command, left_para, LEFT_HAND_STAT, LEFT_FINGER_STAT),
+                                                                  ('wait', {}, RIGHT_HAND_STAT, RIGHT_FINGER_STAT) if right_rejected else (right_command, right_para, RIGHT_HAND_STAT, RIGHT_FINGER_STAT),
+                                                                  stage, handles.state())
+            if left_rejected:
+                left_record['message'] = left_rejected
+            if right_rejected:
+                right_record['message'] = right_rejected
+            left_result, right_result = left_record['message'], right_record['message']
+            LEFT_HAND_STAT, LEFT_FINGER_STAT = left_record['hand'], left_record['finger']
+            RIGHT_HAND_STAT, RIGHT_FINGER_STAT = right_record['hand'], right_record['finger']
         # print('left_result: ', left_result)
         # print('right_result: ', right_result)
+        metrics.add_skill(left_command, left_record)
+        metrics.add_skill(right_command, right_record)
+        # The arms have acted, so the next query needs a fresh snapshot.
+        scene.invalidate()
         LEFT_ACTION_FEEDBACK.append(left_result)
         RIGHT_ACTION_FEEDBACK.append(right_result)
-        return left_result, right_result
+        LEFT_SKILL_RESULTS.append(left_record)
+        RIGHT_SKILL_RESULTS.append(right_record)
+        result = {'left': skill_feedback(left_record), 'right': skill_feedback(right_record)}
+        if self.monitor is not None:
+            with metrics.span('monitor'):
+                outcome = await session.call(self.monitor.update)
+            if outcome is not None:
+                # The episode is decided, the planner stops after this step.
+                result['episode'] = {'outcome': outcome, 'reason': self.monitor.reason}
+        return result
+##############################################################################
+
+# Multi-step plans
+##############################################################################
+MAX_PLAN_STEPS = 8
+
+class LABORPlanInput(BaseModel):
+    """Inputs for labor_plan"""
+    steps: List[LABORControlInput] = Field(min_length=1, max_length=MAX_PLAN_STEPS, description=
+        "Bimanual steps executed in order, each one labor_control call.")
+
+class LABORPlanTool(PlannerTool):
+    name = "labor_plan"
+    description = """
+Executes several labor_control steps in order with one call. Execution stops at the first step in which a hand fails or the episode ends.
+Returns the feedback of every executed step and whether the plan was aborted.
+"""
+    args_schema: Type[BaseModel] = LABORPlanInput
+    def __init__(self, control_tool=None):
+        self.control_tool = control_tool or LABORControlTool()
+
+    def _run(self, steps):
+        return asyncio.run(self._arun(steps))
+
+    async def _arun(self, steps):
+        feedback = []
+        for step in steps:
+            result = await self.control_tool._arun(**step)
+            feedback.append(result)
+            if 'episode' in result or any('failed' in str(result[hand]['message']) for hand in ('left', 'right')):
+                return {'aborted': True, 'executed_steps': len(feedback), 'planned_steps': len(steps), 'feedback': feedback}
+        return {'aborted': False, 'executed_steps': len(feedback), 'planned_steps': len(steps), 'feedback': feedback}
 ##############################################################################
 
 system_prompt = """ \n
@@ -289,40 +306,60 @@ Spatial temporal pre-conditions need to be strictly met at all stages, e.g. pour
 You must decompose the task into an updated list of appropriate stages above, and then generate an appropriate action plan for the next step. Update the list based on the feedback from the environment. Make the plan short with least action steps.
 """
 
+plan_prompt = """
+Send the steps you are confident about together with labor_plan instead of one labor_control call per step, and re-plan from its feedback if it is aborted.
+"""
+
 class GPT_Controller():
-    def __init__(self, model_name, use_labor=False):
-        self.llm = ChatOpenAI(model=model_name, temperature=0.1)
+    def __init__(self, model_name, use_labor=False, cache=None, base_url=None, stream=False, plan_steps=False):
         self.use_labor = use_labor
+        self.plan_steps = plan_steps
         self.tools = [LABORControlTool(), GetArmStateTool(), GetObjPosTool()]
-        self.agent = initialize_agent(
-            tools = self.tools, 
-            llm = self.llm, 
-            agent = AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION, 
-            verbose = True)
+        if plan_steps:
+            # Several steps per LLM round-trip, executed until the first failure.
+            self.tools.append(LABORPlanTool(self.tools[0]))
+        # Native tool calling; repeated prompts are answered from the cache if one is given.
+        # When streaming, skills start as soon as their call is parsed and the scene is read while the model thinks.
+        self.planner = ToolPlanner(model_name, self.tools, temperature=0.1, cache=cache, base_url=base_url,
+                                   stream=stream, prefetch=scene.snapshot if stream else None, callbacks=[metrics])
+        self.cache = cache
         self.records = {'left_command':LEFT_COMMANDS, 
                         'left_para':LEFT_PARA, 
                         'right_command':RIGHT_COMMANDS, 
                         'right_para':RIGHT_PARA, 
-                        'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK}
+                        'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK,
+                        'left_result':LEFT_SKILL_RESULTS, 'right_result':RIGHT_SKILL_RESULTS}
         self.guided_prompt = guided_prompt
 
-    def run(self, task):
+    def run(self, task, attempt=0):
+        asyncio.run(self.arun(task, attempt))
+
+    async def arun(self, task, attempt=0):
         if self.use_labor:
             self.user_input = system_prompt + task.task_des + self.guided_prompt
         else:
             self.user_input = system_prompt + task.task_des
-        self.agent.invoke(self.user_input)
+        if self.plan_steps:
+            self.user_input += plan_prompt
+        # Accomplished or irrecoverably failed episodes end after the step that decides them.
+        task.monitor.reset()
+        self.tools[0].monitor = task.monitor
+        self.planner.stop = task.monitor.stop
+        await self.planner.arun(self.user_input, attempt)
         self.records = {'left_command':LEFT_COMMANDS, 
                         'left_para':LEFT_PARA, 
                         'right_command':RIGHT_COMMANDS, 
                         'right_para':RIGHT_PARA, 
-                        'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK}
+                        'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK,
+                        'left_result':LEFT_SKILL_RESULTS, 'right_result':RIGHT_SKILL_RESULTS}
     def reset(self):
-        global RIGHT_COMMANDS, LEFT_COMMANDS, RIGHT_PARA, LEFT_PARA, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK
+        global RIGHT_COMMANDS, LEFT_COMMANDS, RIGHT_PARA, LEFT_PARA, LEFT_ACTION_FEEDBACK, RIGHT_ACTION_FEEDBACK, LEFT_SKILL_RESULTS, RIGHT_SKILL_RESULTS
         RIGHT_COMMANDS = []
         LEFT_COMMANDS = []
         RIGHT_PARA = []
         LEFT_PARA = []
         LEFT_ACTION_FEEDBACK = []
         RIGHT_ACTION_FEEDBACK = []
-        self.records = {'left_command':LEFT_COMMANDS, 'left_para':LEFT_PARA, 'right_command':RIGHT_COMMANDS, 'right_para':RIGHT_PARA, 'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK}
\ No newline at end of file
+        LEFT_SKILL_RESULTS = []
+        RIGHT_SKILL_RESULTS = []
+        self.records = {'left_command':LEFT_COMMANDS, 'left_para':LEFT_PARA, 'right_command':RIGHT_COMMANDS, 'right_para':RIGHT_PARA, 'left_feedback':LEFT_ACTION_FEEDBACK, 'right_feedback':RIGHT_ACTION_FEEDBACK, 'left_result':LEFT_SKILL_RESULTS, 'right_result':RIGHT_SKILL_RESULTS}
\ No newline at end of file
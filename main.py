@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from tasks import create_task
+from tasks import create_task, TASKS
 from llm_coordinator import *
 import sys
 import time
@@ -17,48 +17,47 @@ class Logger(object):
 
     def flush(self):
         pass
-import os
-import pandas as pd
+from recorder import EpisodeRecorder, record_name
+from robot_session import configure_session
+from llm_cache import CACHE_MODES, ResponseCache
+from episode_metrics import metrics, metrics_table
+from scenarios import Scenarios
+from skill_worker import configure_timeouts
+from reachability import get_reachability
 
-specified_columns = ['task_type', 'task_index', 'success', 'left_command', 'left_para', 'right_command', 'right_para', 'left_feedback', 'right_feedback']
-def write_record_line(data, record_file):
-    if os.path.exists(record_file):
-        df = pd.read_csv(record_file)
-        df_udpate = pd.concat([df, pd.DataFrame(data, columns=df.columns)]).reset_index(drop=True)
-    else:
-        df_udpate = pd.DataFrame(data, columns=specified_columns)
-    df_udpate.to_csv(record_file, index=False, header=True)
-    return
-
-cup_task_types = ['left_blue_right_yellow', 'left_yellow_right_blue', 'both_left', 'both_right']
-bowl_task_types = ['same_fruits_same_bowl', 'same_fruits_diff_bowl', 'diff_fruit_left_bowl', 'diff_fruit_right_bowl']
+specified_columns = ['task_type', 'task_index', 'success', 'left_command', 'left_para', 'right_command', 'right_para', 'left_feedback', 'right_feedback', 'left_result', 'right_result', 'metrics']
 
-def reset_task(task_name, task, task_index):
-    if task_name == 'ServeWater':
-        task.reset(task_type=cup_task_types[task_index])
-    elif task_name == 'ServeFruit':
-        task.reset(task_type=bowl_task_types[task_index])
+def reset_task(task_name, task, task_index, episode_index=None):
+    if task_name in TASKS:
+        task.reset(index=episode_index, task_type=TASKS[task_name].task_types[task_index])
     else:
         task.reset()
 
 def main(args):
-    task = create_task(args.task_name)
+    configure_session(port=args.port, scene=args.scene, backend=args.backend)
+    configure_timeouts(args.skill_timeout)
+    scenarios = Scenarios(args.scenario_file) if args.scenario_file else None
+    task = create_task(args.task_name, scenarios)
+    # The coordinator's reachability checks run under the session lock, so their maps are loaded up front.
+    get_reachability('left')
+    get_reachability('right')
     print(task.task_des)
-    llm_controller = GPT_Controller(args.model_name, use_labor=args.use_labor)
+    llm_cache = ResponseCache(args.llm_cache_file, args.llm_cache, args.llm_cache_size) if args.llm_cache != 'off' else None
+    llm_controller = GPT_Controller(args.model_name, use_labor=args.use_labor, cache=llm_cache, base_url=args.llm_base_url, stream=args.llm_stream, plan_steps=args.plan_steps)
     
     if args.use_labor:
-        method = 'LABOR'
         print('Guided prompt ', llm_controller.guided_prompt)
-    else:
-        method = 'Baseline'
-    if 'gpt-3.5' in args.model_name:
-        file_name = './logs/' + args.task_name + '_gpt-3.5_' + method + '1-' + str(args.num_tasks)
-        sys.stdout = Logger(file_name + '.txt', sys.stdout)
-    elif 'gpt-4' in args.model_name:
-        file_name = './logs/' + args.task_name + '_gpt-4_' + method + '1-' + str(args.num_tasks) 
-        sys.stdout = Logger(file_name + '.txt', sys.stdout)
+    shard = args.shard if args.num_shards > 1 else None
+    file_name = record_name(args.task_name, args.model_name, args.use_labor, args.num_tasks, shard)
+    sys.stdout = Logger(file_name + '.txt', sys.stdout)
+    if args.use_llm:
+        recorder = EpisodeRecorder(file_name + '.' + args.record_format, specified_columns, args.record_format)
     total_num = 0
     success_num = 0
+    episode_num = 0
+    episode_metrics = []
+    # Episodes skipped on --resume whose records have no metrics.
+    unmeasured_num = 0
     print("\n","#" * 114)
     print(f"The task {args.task_name} starts!")
     if 'True' == args.use_labor or args.use_labor == True:
@@ -66,25 +65,46 @@ def main(args):
     else:
         print(f"The Baseline Agent with {args.model_name} is used for the task.")
 
-    if args.task_name == 'ServeWater': 
-        task_types = cup_task_types
-        task_var_num = len(cup_task_types)
-    elif args.task_name == 'ServeFruit': 
-        task_types = bowl_task_types
-        task_var_num = len(bowl_task_types)
+    if args.task_name in TASKS:
+        task_types = TASKS[args.task_name].task_types
+        task_var_num = len(task_types)
     else:
         return "The task is not supported yet!"
 
     for i in range(args.num_tasks):
         for j in range(task_var_num):
             total_num += 1
-            reset_task(args.task_name, task, j)
+            if scenarios is not None and (total_num - 1) % args.num_shards != args.shard:
+                # Layouts from a scenario file are taken by index, so other shards' episodes need no reset.
+                continue
+            metrics.reset()
+            with metrics.span('reset'):
+                reset_task(args.task_name, task, j, i if scenarios is not None else None)
+            if (total_num - 1) % args.num_shards != args.shard:
+                # Episodes of other shards are still reset so the random layouts stay in sequence.
+                continue
+            episode_num += 1
+            if args.use_llm and args.resume and recorder.is_done(total_num):
+                # The reset above still runs so the random layouts stay in sequence.
+                success_num += recorder.completed[total_num]
+                # Their stored metrics keep the metrics table on the same episodes as the success rate.
+                if total_num in recorder.metrics:
+                    episode_metrics.append(recorder.metrics[total_num])
+                else:
+                    unmeasured_num += 1
+                print('Task:  ', total_num, 'already recorded, skipped.')
+                continue
             print("\n", "#" * 20)
             print('Task:  ', total_num, task.short_des)
+            episode_start = time.perf_counter()
             try:
                 if args.use_llm == True:
-                    while llm_controller.records['left_command'] == []:
-                        llm_controller.run(task)
+                    for attempt in range(args.planner_attempts):
+                        # planner_run_calls - 1 is the number of retries of this loop.
+                        with metrics.span('planner_run'):
+                            llm_controller.run(task, attempt)
+                        if llm_controller.records['left_command'] != []:
+                            break
                 else:
                     task.self_run()
             except Exception as e:
@@ -92,6 +112,9 @@ def main(args):
                 pass
             
             success = task.check_success()
+            metrics.add('episode', time.perf_counter() - episode_start)
+            episode_metrics.append(metrics.summary())
+            print('Episode metrics:', episode_metrics[-1])
             reset_global()
             if success:
                 success_num += 1
@@ -102,13 +125,23 @@ def main(args):
                 llm_controller.records['task_index'] = total_num
                 llm_controller.records['task_type'] = task_types[j]
                 llm_controller.records['success'] = success
-                write_record_line(llm_controller.records, file_name + '.csv')
+                llm_controller.records['metrics'] = episode_metrics[-1]
+                recorder.write_episode(llm_controller.records)
                 llm_controller.reset()
-            sim.stopSimulation()
-            time.sleep(1)
-            sim.startSimulation()
-    total_success_rate = success_num / (args.num_tasks * task_var_num)
+    if args.use_llm:
+        recorder.close()
+        if args.parquet:
+            print('Records exported to', recorder.export_parquet())
+    total_success_rate = success_num / max(episode_num, 1)
     print(f"The total success rate is {total_success_rate}!")
+    print(f"Handle cache: {handles.stats()}")
+    print(f"Metrics over {len(episode_metrics)} episodes:")
+    if unmeasured_num:
+        print(f"({unmeasured_num} resumed episodes have no stored metrics and are left out.)")
+    print(metrics_table(episode_metrics))
+    if llm_cache is not None:
+        print(f"LLM cache: {llm_cache.stats()}")
+        llm_cache.close()
     time.sleep(2)
     sim.stopSimulation()
     print('The simulation ends!')
@@ -122,5 +155,22 @@ if __name__ == "__main__":
     parser.add_argument('--task_name', type=str, default="ServeFruit", help="Which task to run")
     parser.add_argument('--num_tasks', type=int, default=10, help="How many tasks to run")
     parser.add_argument('--model_name', type=str, default="gpt-4o", help="Which model to use")
+    parser.add_argument('--record_format', type=str, default="csv", choices=['csv', 'jsonl'], help="File format of the episode records")
+    parser.add_argument('--resume', action='store_true', default=False, help="Skip episodes already in the record file")
+    parser.add_argument('--parquet', action='store_true', default=False, help="Export the records to Parquet at the end")
+    parser.add_argument('--shard', type=int, default=0, help="Which shard of the episodes this process runs")
+    parser.add_argument('--num_shards', type=int, default=1, help="Into how many shards the episodes are split")
+    parser.add_argument('--port', type=int, default=None, help="ZMQ port of the simulator (default: LABOR_SIM_PORT or the API default)")
+    parser.add_argument('--scene', type=str, default=None, help="Scene file of the simulator (default: LABOR_SCENE or ./nicol.ttt)")
+    parser.add_argument('--backend', type=str, default=None, choices=['coppelia', 'offline'], help="Simulator backend (default: LABOR_BACKEND or coppelia)")
+    parser.add_argument('--llm_base_url', type=str, default=None, help="OpenAI-compatible chat endpoint, e.g. a local mock server")
+    parser.add_argument('--llm_stream', action='store_true', default=False, help="Start skills while the LLM reply is still streaming")
+    parser.add_argument('--plan_steps', action='store_true', default=False, help="Let the LLM send several bimanual steps per call")
+    parser.add_argument('--llm_cache', type=str, default='off', choices=CACHE_MODES, help="Record LLM responses to, or replay them from, the cache file")
+    parser.add_argument('--llm_cache_file', type=str, default='./logs/llm_cache.sqlite', help="SQLite file of the LLM response cache")
+    parser.add_argument('--scenario_file', type=str, default=None, help="Take the object layouts from this scenario file (see scenarios.py) instead of sampling them")
+    parser.add_argument('--llm_cache_size', type=int, default=10000, help="How many LLM responses the cache keeps at most")
+    parser.add_argument('--planner_attempts', type=int, default=3, help="How often the planner is run for an episode in which it sent no labor_control step")
+    parser.add_argument('--skill_timeout', type=str, nargs='*', default=[], help="Skill deadlines in seconds as command=seconds (or all=seconds, 0 disables), e.g. move_and_grasp=120")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
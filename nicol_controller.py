@@ -6,26 +6,28 @@ Copyright 2024, Planet Earth
 """
 import numpy as np
 from transforms3d.euler import euler2quat, quat2euler
+import argparse, json, sys, time
 
-from nicol_api.nicol_env import NicolFactory
-from nicol_api.base import NicolPose
-from coppeliasim_zmqremoteapi_client import *
+from robot_session import LazySession, SessionAttribute, get_session
+from episode_metrics import metrics
+from ik_service import get_ik
+from reachability import TOP_GRASP_OBJECTS, get_reachability, out_of_reach
 
-import argparse, json, time
+from dataclasses import asdict, dataclass
+from typing import Optional
 import scipy.spatial.distance as dist
 
 ############################ Initialize ######################################
-nicol = NicolFactory().create_nicol('coppelia', scene="./nicol.ttt", start_scene=False, talker=False)
-head  = nicol.head()    # 3D-Printed head structure
-left  = nicol.left()    # Left  OpenManipulator + RH8D
-right = nicol.right()   # Right OpenManipulator + RH8D
-sim = nicol.nicol_adapter.sim
-left_sensor = sim.getObject('/l_sensor')
-left_attachpoint = sim.getObject('/l_palm_attachPoint')
-right_sensor = sim.getObject('/r_sensor')
-right_attachpoint = sim.getObject('/r_palm_attachPoint')
-client = nicol.nicol_adapter.client
-# print("\n"*30, "#"*114, '\n', "#"*114, '\n', 'The simulation starts!')
+# The simulator connects on first use; see robot_session.py for port, scene and backend.
+robot = LazySession()
+nicol = SessionAttribute('nicol')
+head  = SessionAttribute('head')     # 3D-Printed head structure
+left  = SessionAttribute('left')     # Left  OpenManipulator + RH8D
+right = SessionAttribute('right')    # Right OpenManipulator + RH8D
+sim = SessionAttribute('sim')
+client = SessionAttribute('client')
+handles = SessionAttribute('handles')
+NicolPose = SessionAttribute('NicolPose')
 
 # Set up useful dicts and global varibles.
 ##############################################################################
@@ -57,58 +59,81 @@ def reset_global():
     global RIGHT_HAND_STAT
     LEFT_HAND_STAT = RIGHT_HAND_STAT = 'Vertical'
 
+# Skill result record
+##############################################################################
+@dataclass
+class SkillResult:
+    side: str
+    message: str
+    hand: str
+    finger: str
+    grasped: Optional[str] = None
+    duration: float = 0.0
+    settle_steps: int = 0
+    settle_time: float = 0.0
+    sim_calls: int = 0
+    sim_time: float = 0.0
+
+    def failed(self):
+        return 'failed' in self.message
+
+def skill_result(side: str, message: str, grasped: Optional[str] = None):
+    if side == 'left':
+        return SkillResult(side, message, LEFT_HAND_STAT, LEFT_FINGER_STAT, grasped)
+    else:
+        return SkillResult(side, message, RIGHT_HAND_STAT, RIGHT_FINGER_STAT, grasped)
+##############################################################################
+
 # NICOL Skill Functions 
 ##############################################################################
 
 def side_grasp(side: str, obj_name: str):
     global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT
-    if side == 'left':
-        hand_finger_info = ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        hand_finger_info = ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
     if "Bowl" in obj_name:
-        return f"The robot's {side} hand failed to grasp the bowl." + hand_finger_info
+        return skill_result(side, f"The robot's {side} hand failed to grasp the bowl.")
     elif "overlap_area" in obj_name:
-        return f"Overlap area is not grasable! You should choose specific object." + hand_finger_info
-    handle = sim.getObject('/'+obj_name)
+        return skill_result(side, f"Overlap area is not grasable! You should choose specific object.")
+    handle = handles.get(obj_name)
     new_pose = sim.getObjectPosition(handle, sim.handle_world)
     # head.set_pose_target(NicolPose(new_pose, [0, 0, 0, 0]))
     if side == 'left':
-        detected = sim.checkProximitySensor(left_sensor, sim.handle_all)[0]
+        detected = sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]
         # grasped
         if LEFT_FINGER_STAT == 'Closed' and detected:
-            return f"The {side} hand failed to grasp {obj_name}, as it is already occupied." + hand_finger_info
+            return skill_result(side, f"The {side} hand failed to grasp {obj_name}, as it is already occupied.")
         # out of area
-        if new_pose[1]<-0.2: 
-            return f"The {side} hand failed to grasp {obj_name}, out of its area." + hand_finger_info
+        unreachable = out_of_reach('side_grasp', side, obj_name, new_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         # move
         result = move_single_to_pose(side, obj_name, 'Vertical', off_set=None)
-        if 'failed' in result:
-            return result + hand_finger_info
+        if result.failed():
+            return result
     elif side == 'right':
-        detected = sim.checkProximitySensor(right_sensor, sim.handle_all)[0]
+        detected = sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]
         if RIGHT_FINGER_STAT == 'Closed' and detected:
-            return f"The {side} hand failed to grasp {obj_name}, as it is already occupied." + hand_finger_info
-        if new_pose[1]>0.2: 
-            return f"The {side} hand failed to grasp {obj_name}, out of its area." + hand_finger_info
+            return skill_result(side, f"The {side} hand failed to grasp {obj_name}, as it is already occupied.")
+        unreachable = out_of_reach('side_grasp', side, obj_name, new_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         result = move_single_to_pose(side, obj_name, 'Vertical', off_set=None)
-        if 'failed' in result:
-            return result + hand_finger_info
+        if result.failed():
+            return result
     else:    
-        return "the grasp is failed, as you didn't choose the correct side for NICOL."
+        return skill_result(side, "the grasp is failed, as you didn't choose the correct side for NICOL.")
     quat = [[np.pi, - np.pi, - np.pi, - np.pi, - np.pi], 
             [np.pi, - np.pi, - np.pi, - np.pi, - np.pi], 
             [np.pi, -2.9, -1.8, -1.8, -1.8]]
             # [np.pi, - 2.8, - 1.4, - 1.4, - 1.4]]
     if side == 'left':
-        Sensor = left_sensor
-        AttachPoint = left_attachpoint
+        Sensor = robot.left_sensor
+        AttachPoint = robot.left_attachpoint
         Controller = left
         LEFT_HAND_STAT = 'Vertical'
         LEFT_FINGER_STAT = 'Closed'
     else:
-        Sensor = right_sensor
-        AttachPoint = right_attachpoint
+        Sensor = robot.right_sensor
+        AttachPoint = robot.right_attachpoint
         Controller = right
     detected = sim.checkProximitySensor(Sensor, sim.handle_all)[0]
     if detected:
@@ -116,9 +141,7 @@ def side_grasp(side: str, obj_name: str):
         detected_handle = read_result[3]
         sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
         sim.setObjectParent(detected_handle, AttachPoint, True)
-        obj_name_grasped = sim.getObjectAlias(read_result[3], -1)
-        if '_respondable' in obj_name_grasped:
-            obj_name_grasped = obj_name_grasped.replace('_respondable', '')
+        obj_name_grasped = handles.alias(read_result[3])
         for sub_quat in quat:
             Controller.set_joint_position_for_hand(sub_quat, block=True)
         if side == 'left':
@@ -127,56 +150,51 @@ def side_grasp(side: str, obj_name: str):
             RIGHT_HAND_STAT, RIGHT_FINGER_STAT = 'Vertical', 'Closed'
         result = f"The robot's {side} hand has grasped {obj_name_grasped}, and is holding the {obj_name_grasped}."
     else:
+        obj_name_grasped = None
         result = f"The robot's {side} hand failed to grasp anything, as there is no object detected."
-    if side == 'left':
-        hand_finger_info = ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        hand_finger_info = ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
-    return result + hand_finger_info
+    return skill_result(side, result, obj_name_grasped)
 
 def top_grasp(side: str, obj_name: str):
     global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT
-    if side == 'left':
-        hand_finger_info = ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        hand_finger_info = ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
     if "Bowl" in obj_name:
-        return f"The robot's {side} hand failed to grasp the bowl." + hand_finger_info
-    handle = sim.getObject('/'+obj_name)
+        return skill_result(side, f"The robot's {side} hand failed to grasp the bowl.")
+    handle = handles.get(obj_name)
     new_pose = sim.getObjectPosition(handle, sim.handle_world)
     # head.set_pose_target(NicolPose(new_pose, [0, 0, 0, 0]))
     if side == 'left':
-        if sim.checkProximitySensor(right_sensor, handle)[0]:
-            return f"The {side} hand failed to grasp {obj_name}, as the {obj_name} is grasped by the other hand." + hand_finger_info
-        detected = sim.checkProximitySensor(left_sensor, sim.handle_all)[0]
+        if sim.checkProximitySensor(robot.right_sensor, handle)[0]:
+            return skill_result(side, f"The {side} hand failed to grasp {obj_name}, as the {obj_name} is grasped by the other hand.")
+        detected = sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]
         if LEFT_FINGER_STAT == 'Closed' and detected:
-            return f"The {side} hand failed to grasp {obj_name}, as the left hand is already occupied." + hand_finger_info
+            return skill_result(side, f"The {side} hand failed to grasp {obj_name}, as the left hand is already occupied.")
         if LEFT_FINGER_STAT == 'Hold_Up':
             release('left')
-        if new_pose[1]<-0.2: 
-            return f"The {side} hand failed to grasp {obj_name}, out of its area." + hand_finger_info
+        unreachable = out_of_reach('top_grasp', side, obj_name, new_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         result = move_single_to_pose(side, obj_name, 'Horizontally_Down', off_set=None)
-        if 'failed' in result: return result + hand_finger_info
+        if result.failed(): return result
     elif side == 'right':
-        if sim.checkProximitySensor(left_sensor, handle)[0]:
-            return f"The {side} hand failed to grasp {obj_name}, as the {obj_name} is grasped by the other hand." + hand_finger_info
-        detected = sim.checkProximitySensor(right_sensor, sim.handle_all)[0]
+        if sim.checkProximitySensor(robot.left_sensor, handle)[0]:
+            return skill_result(side, f"The {side} hand failed to grasp {obj_name}, as the {obj_name} is grasped by the other hand.")
+        detected = sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]
         if RIGHT_FINGER_STAT == 'Closed' and detected:
-            return "the grasp is failed, as the right hand is already occupied." + hand_finger_info
+            return skill_result(side, "the grasp is failed, as the right hand is already occupied.")
         if RIGHT_FINGER_STAT == 'Hold_Up':
             release('right')
-        if new_pose[1]>0.2: 
-            return f"The {side} hand failed to grasp {obj_name}, out of its area." + hand_finger_info
+        unreachable = out_of_reach('top_grasp', side, obj_name, new_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         result = move_single_to_pose(side, obj_name, 'Horizontally_Down', off_set=None)
-        if 'failed' in result: return result + hand_finger_info
+        if result.failed(): return result
 
     quat = [[np.pi, - np.pi, - np.pi, - np.pi, - np.pi],
             [np.pi, - np.pi/2, - 0.3, 0, 0],
             [np.pi, - 2, - 0.3, 0, 0]]
     if side == 'left':
-        Sensor, AttachPoint, Controller = left_sensor, left_attachpoint, left
+        Sensor, AttachPoint, Controller = robot.left_sensor, robot.left_attachpoint, left
     else:
-        Sensor, AttachPoint, Controller = right_sensor, right_attachpoint, right
+        Sensor, AttachPoint, Controller = robot.right_sensor, robot.right_attachpoint, right
     detected = sim.checkProximitySensor(Sensor, sim.handle_all)[0]
     # attach the graspable object
     if detected:
@@ -184,9 +202,7 @@ def top_grasp(side: str, obj_name: str):
         detected_handle = read_result[3]
         sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
         sim.setObjectParent(detected_handle, AttachPoint, True)
-        obj_name_grasped = sim.getObjectAlias(read_result[3], -1)
-        if '_respondable' in obj_name_grasped:
-            obj_name_grasped = obj_name_grasped.replace('_respondable', '')
+        obj_name_grasped = handles.alias(read_result[3])
         if obj_name_grasped != 'Bowl':
             for sub_quat in quat:
                 Controller.set_joint_position_for_hand(sub_quat)
@@ -196,42 +212,38 @@ def top_grasp(side: str, obj_name: str):
         else:
             RIGHT_HAND_STAT, RIGHT_FINGER_STAT = 'Horizontally_Down', 'Closed'
     else:
+        obj_name_grasped = None
         result = f"The robot's {side} hand failed to grasp anything from the top, as there is no appropriate object detected."
     # return result
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+    return skill_result(side, result, obj_name_grasped)
 
 def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None):
     global LEFT_FINGER_STAT, LEFT_HAND_STAT, RIGHT_FINGER_STAT, RIGHT_HAND_STAT
-    hand_finger_info = ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT if side == 'left' else ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
     try:
-        handle = sim.getObject('/'+obj_name)
-        new_pose = sim.getObjectPosition(handle, sim.handle_world)
+        new_pose = handles.position(obj_name)
     except Exception as e:
-        return f"The robot's {side} hand failed to move to {obj_name} as the {obj_name} is not detected in the scene." + hand_finger_info
+        return skill_result(side, f"The robot's {side} hand failed to move to {obj_name} as the {obj_name} is not detected in the scene.")
     grasped_object = ' '
+    detected_object = None
     if side == 'left':
         NICOL_Dict = ORIENTATION_DICT_LEFT
         CONTROLLER, CONTROLLER_Offset, CONTROLLER_HAND_STAT, CONTROLLER_FINGER_STAT = left, '_left', LEFT_HAND_STAT, LEFT_FINGER_STAT
-        detected = sim.checkProximitySensor(left_sensor, sim.handle_all)[0]
+        detected = sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]
         # out of area
-        if new_pose[1]<-0.2: 
-            return f"The robot's {side} hand failed to move to {obj_name}, out of its area." + hand_finger_info
+        unreachable = out_of_reach('move_to', side, obj_name, new_pose, ori_angle or CONTROLLER_HAND_STAT)
+        if unreachable:
+            return skill_result(side, unreachable)
         if LEFT_FINGER_STAT == 'PointAt':
             new_pose = [new_pose[0]-0.03, new_pose[1]+0.05, new_pose[2]+0.09]
         elif LEFT_FINGER_STAT == 'Closed':
             if detected:
-                read_result = sim.readProximitySensor(left_sensor)
+                read_result = sim.readProximitySensor(robot.left_sensor)
                 detected_handle = read_result[3]
-                detected_object = sim.getObjectAlias(detected_handle, -1)
-                if '_respondable' in detected_object:
-                    detected_object = detected_object.replace('_respondable', '')
+                detected_object = handles.alias(detected_handle)
                 grasped_object = ' with ' + detected_object + ' grasped in the hand'
                 if obj_name in ('blue_cup', 'yellow_cup'):
                     if off_set == None or off_set == 'None':
-                        return f"The robot's {side} hand failed to move to {obj_name}, as the {side} hand is holding {detected_object}." + hand_finger_info
+                        return skill_result(side, f"The robot's {side} hand failed to move to {obj_name}, as the {side} hand is holding {detected_object}.")
             else:
                 grasped_object = ''
             # move above bowl
@@ -251,32 +263,31 @@ def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None
                 new_pose = [new_pose[0], new_pose[1]+0.05, new_pose[2]]
         elif detected and LEFT_FINGER_STAT == 'Hold_Up':
             if obj_name == 'overlap_area':
-                read_result = sim.readProximitySensor(left_sensor)
-                detected_object = sim.getObjectAlias(read_result[3], -1)
+                read_result = sim.readProximitySensor(robot.left_sensor)
+                detected_object = handles.alias(read_result[3])
                 return push_to(side, detected_object, obj_name)
             else:
-                return f"The robot's {side} hand failed to move to {obj_name}, as it is holding up some object." + hand_finger_info
+                return skill_result(side, f"The robot's {side} hand failed to move to {obj_name}, as it is holding up some object.")
         if LEFT_HAND_STAT == 'Horizontally_Down' and obj_name == 'Bowl':
             off_set= 'up'
     elif side == 'right':
         NICOL_Dict = ORIENTATION_DICT_RIGHT
         CONTROLLER, CONTROLLER_Offset, CONTROLLER_HAND_STAT, CONTROLLER_FINGER_STAT = right, '_right', RIGHT_HAND_STAT, RIGHT_FINGER_STAT
-        detected = sim.checkProximitySensor(right_sensor, sim.handle_all)[0]
-        if new_pose[1]>0.2: 
-            return f"The robot's {side} hand failed to move to {obj_name}, out of its area." + hand_finger_info
+        detected = sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]
+        unreachable = out_of_reach('move_to', side, obj_name, new_pose, ori_angle or CONTROLLER_HAND_STAT)
+        if unreachable:
+            return skill_result(side, unreachable)
         if RIGHT_FINGER_STAT == 'PointAt':
             new_pose = [new_pose[0]-0.03, new_pose[1]-0.05, new_pose[2]+0.09]
         elif RIGHT_FINGER_STAT == 'Closed':
             if detected:
-                read_result = sim.readProximitySensor(right_sensor)
+                read_result = sim.readProximitySensor(robot.right_sensor)
                 detected_handle = read_result[3]
-                detected_object = sim.getObjectAlias(detected_handle, -1)
-                if '_respondable' in detected_object:
-                    detected_object = detected_object.replace('_respondable', '')
+                detected_object = handles.alias(detected_handle)
                 grasped_object = ' with ' + detected_object + ' grasped in the hand'
                 if obj_name in ('blue_cup', 'yellow_cup'):
                     if off_set == None or off_set == 'None':
-                        return f"The robot's {side} hand failed to move to {obj_name}, as the {side} hand is holding {detected_object}." + hand_finger_info
+                        return skill_result(side, f"The robot's {side} hand failed to move to {obj_name}, as the {side} hand is holding {detected_object}.")
             else:
                 grasped_object = ''
             if obj_name == 'overlap_area':
@@ -293,11 +304,11 @@ def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None
                 new_pose = [new_pose[0], new_pose[1]-0.05, new_pose[2]]
         elif detected and RIGHT_FINGER_STAT == 'Hold_Up':
             if obj_name == 'overlap_area':
-                read_result = sim.readProximitySensor(right_sensor)
-                detected_object = sim.getObjectAlias(read_result[3], -1)
+                read_result = sim.readProximitySensor(robot.right_sensor)
+                detected_object = handles.alias(read_result[3])
                 return push_to(side, detected_object, obj_name)
             else:
-                return f"The robot's {side} hand failed to move to {obj_name}, as it is holding up some object." + hand_finger_info
+                return skill_result(side, f"The robot's {side} hand failed to move to {obj_name}, as it is holding up some object.")
         if RIGHT_HAND_STAT == 'Horizontally_Down' and obj_name == 'Bowl':
             off_set= 'up'
     else:
@@ -306,31 +317,27 @@ def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None
     if ori_angle:
         new_quat = NICOL_Dict[ori_angle]
         if ori_angle=='Vertical':
-            try: 
-                handle = sim.getObject('/'+obj_name + CONTROLLER_Offset)
+            handle = handles.find(obj_name + CONTROLLER_Offset)
+            if handle is not None:
                 new_pose = sim.getObjectPosition(handle, sim.handle_world)
-            except Exception as e:
-                pass
         elif ori_angle=='Horizontally_Down':
-            try: 
-                handle = sim.getObject('/'+obj_name+'_top')
+            handle = handles.find(obj_name + '_top')
+            if handle is not None:
                 new_pose = sim.getObjectPosition(handle, sim.handle_world)
-            except Exception as e: 
+            else:
                 new_pose = [new_pose[0], new_pose[1], new_pose[2]+0.015]
     else:
         new_quat = CONTROLLER.get_eef_pose().orientation
         new_quat = [new_quat.x, new_quat.y, new_quat.z, new_quat.w]
         if CONTROLLER_HAND_STAT == 'Vertical':
-            try: 
-                handle = sim.getObject('/' + obj_name + CONTROLLER_Offset)
+            handle = handles.find(obj_name + CONTROLLER_Offset)
+            if handle is not None:
                 new_pose = sim.getObjectPosition(handle, sim.handle_world)
-            except Exception as e:
-                pass
         elif CONTROLLER_HAND_STAT=='Horizontally_Down':
-            try: 
-                handle = sim.getObject('/' + obj_name + '_top')
+            handle = handles.find(obj_name + '_top')
+            if handle is not None:
                 new_pose = sim.getObjectPosition(handle, sim.handle_world)
-            except Exception as e: 
+            else:
                 new_pose = [new_pose[0], new_pose[1], new_pose[2]+0.015]
 
     if off_set in ('up', 'above'):
@@ -353,8 +360,7 @@ def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None
                 new_pose_offset = [new_pose_offset[0], new_pose_offset[1]+0.03, new_pose_offset[2]]
             elif side == 'right':
                 new_pose_offset = [new_pose_offset[0], new_pose_offset[1]-0.03, new_pose_offset[2]]
-            CONTROLLER.set_pose_target(NicolPose(new_pose_offset, new_quat))
-            CONTROLLER.set_pose_target(NicolPose(new_pose, new_quat))
+            move_through(side, [new_pose_offset, new_pose], new_quat)
         if obj_name == 'serve_point':
             head.set_pose_target(NicolPose([new_pose[0], new_pose[1], new_pose[2]+0.1], [0, 0, 0, 0]))
         if off_set == 'up':
@@ -363,14 +369,11 @@ def move_single_to_pose(side: str, obj_name: str, ori_angle = None, off_set=None
             result = f"The robot's {side} hand has moved below the {obj_name}{grasped_object}."
         else:
             result = f"The robot's {side} hand has moved to {obj_name}{grasped_object}."
-        if side == 'left':
-            return result + hand_finger_info
-        else:
-            return result + hand_finger_info
+        return skill_result(side, result, detected_object)
         # return result
     except Exception as e:
         print("You didn't choose the correct orientation for the robot!")
-        return e
+        return skill_result(side, f"The robot's {side} hand failed to move to {obj_name}: {e}")
     
 def delta_move(side, direction, distance=None):
     if side == 'left':
@@ -400,22 +403,19 @@ def delta_move(side, direction, distance=None):
     else: new_pose = [EE_POSE[0], EE_POSE[1], EE_POSE[2]]
     CONTROLLER.set_pose_target(NicolPose(new_pose, ori))
     result = f"The robot's {side} hand has moved {direction} for {distance} meters."
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+    return skill_result(side, result)
     # return result
 
 def release(side:str):
     global LEFT_FINGER_STAT, LEFT_HAND_STAT, RIGHT_FINGER_STAT, RIGHT_HAND_STAT
     if side == 'left':
-        CONTROLLER, CONTROLLER_Sensor = left, left_sensor
+        CONTROLLER, CONTROLLER_Sensor = left, robot.left_sensor
         CONTROLLER_DICT = ORIENTATION_DICT_LEFT
         LEFT_FINGER_STAT = "Open"
         CONTROLLER_Ori = LEFT_HAND_STAT
         delta_move('left', 'right', 0.02)
     elif side == 'right':
-        CONTROLLER, CONTROLLER_Sensor = right, right_sensor
+        CONTROLLER, CONTROLLER_Sensor = right, robot.right_sensor
         CONTROLLER_DICT = ORIENTATION_DICT_RIGHT
         RIGHT_FINGER_STAT = "Open"
         CONTROLLER_Ori = RIGHT_HAND_STAT
@@ -429,23 +429,13 @@ def release(side:str):
         sim.setObjectParent(detected_handle, -1, True)
         if CONTROLLER_Ori == 'Horizontally_Down':
             sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 0)
-            time.sleep(1)
-            sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 0)
-            time.sleep(1)
-            sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 0)
-        obj_name = sim.getObjectAlias(detected_handle, -1)
-        if '_respondable' in obj_name:
-            obj_name = obj_name.replace('_respondable', '')
+        obj_name = handles.alias(detected_handle)
         # sim.step()
     quat = [-np.pi, - np.pi, - np.pi, - np.pi, - np.pi]
-    CONTROLLER.set_joint_position_for_hand(quat)
-    # set up simulated step to enable the object fall down
-    time.sleep(1)
-    client.setStepping(True)
-    client.step()
-    time.sleep(1)
-    client.step()
-    client.setStepping(False)
+    # wait for the hand to be open, otherwise the object is still held and settles at once
+    CONTROLLER.set_joint_position_for_hand(quat, block=True)
+    # step the simulation until the released object has come to rest
+    settle_steps = settle([detected_handle] if detected else [])
     if side == 'left' and LEFT_HAND_STAT == 'Vertical':
         delta_move('left', 'up', 0.06)
         delta_move('left', 'left', 0.03)
@@ -465,10 +455,30 @@ def release(side:str):
         result = f"The robot's {side} hand has been opened, and the grasped {obj_name} has been released."
     else:
         result = f"The robot's {side} hand has been opened."
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+    record = skill_result(side, result)
+    record.settle_steps = settle_steps
+    return record
+
+def settle(objects, threshold=0.01, quiet_steps=3, min_steps=3, timeout=60):
+    """
+    Step the simulation until every object has moved slower than `threshold`
+    (m/s) for `quiet_steps` consecutive steps, or `timeout` steps have passed.
+    Returns the number of simulation steps taken.
+    """
+    client.setStepping(True)
+    steps, quiet = 0, 0
+    try:
+        with metrics.span('settle'):
+            while steps < timeout:
+                client.step()
+                steps += 1
+                speeds = [np.linalg.norm(sim.getObjectVelocity(obj)[0]) for obj in objects]
+                quiet = quiet + 1 if max(speeds, default=0.0) < threshold else 0
+                if steps >= min_steps and quiet >= quiet_steps:
+                    break
+    finally:
+        client.setStepping(False)
+    return steps
 
 
 def reset(side:str):
@@ -487,23 +497,20 @@ def reset(side:str):
         RIGHT_FINGER_STAT, RIGHT_HAND_STAT = 'Open', 'Vertical'
         result = f"The robot's {side} hand has been reset to its original position."
     else:
-        return "You didn't choose the correct side for NICOL!"
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+        return skill_result(side, "You didn't choose the correct side for NICOL!")
+    return skill_result(side, result)
     # return result
 
 def flip_down(side:str):
     try:
-        ball = sim.getObject("/big_ball")
+        ball = handles.get("big_ball")
     except Exception as e:
-        return 'There is no water inside the container!'
+        return skill_result(side, 'There is no water inside the container!')
     if side == 'left':
         CONTROLLER = left
         global LEFT_HAND_STAT
         # LEFT_HAND_STAT = 'Horizontally_Down'
-        CONTROLLER_sensor = left_sensor
+        CONTROLLER_sensor = robot.left_sensor
         CONTROLLER_DICT = ORIENTATION_DICT_LEFT
         EE_POSE = CONTROLLER.get_eef_pose().position.as_list()
         new_pose_1 = [EE_POSE[0]+0.01, EE_POSE[1]+0.01, EE_POSE[2]]
@@ -515,7 +522,7 @@ def flip_down(side:str):
         global RIGHT_HAND_STAT
         # RIGHT_HAND_STAT = 'Horizontally_Down'
         CONTROLLER_DICT = ORIENTATION_DICT_RIGHT
-        CONTROLLER_sensor = right_sensor
+        CONTROLLER_sensor = robot.right_sensor
         EE_POSE = CONTROLLER.get_eef_pose().position.as_list()
         new_pose_1 = [EE_POSE[0]+0.01, EE_POSE[1]-0.02, EE_POSE[2]]
         # if  sim.checkProximitySensor(CONTROLLER_sensor, ball)[0]:
@@ -532,28 +539,36 @@ def flip_down(side:str):
     # return [[new_pose_1, ori_1], [new_pose_2, ori_2]]
     CONTROLLER.set_pose_target(NicolPose(new_pose_2, ori_2))
     result = f"The robot's {side} hand's is fliped down for once for pouring out water."
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+    return skill_result(side, result)
     # return result
 
 
+def move_through(side:str, poses, orientation):
+    # The waypoints are solved as one path from the arm's current joints; unless the whole
+    # path stays on one IK branch, all of them are sent as pose targets.
+    arm = left if side == 'left' else right
+    path = get_ik(side).solve_path(poses, orientation)
+    for i, pose in enumerate(poses):
+        if path is None:
+            arm.set_pose_target(NicolPose(pose, orientation))
+        else:
+            arm.set_joint_position(path[i], block=True)
+
 def hold_up_single(side:str, obj_name:str):
     global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT
     quat = [-np.pi, -np.pi, -np.pi*0.75, -np.pi*0.75, -np.pi*0.75]
-    obj_pose = sim.getObjectPosition(sim.getObject('/'+obj_name), sim.handle_world)
-    obj_pose = [obj_pose[0], obj_pose[1], obj_pose[2]+0.18]
+    obj_pose = handles.position(obj_name)
     # head.set_pose_target(obj_pose)
     if side == 'left':
-        detected = sim.checkProximitySensor(left_sensor, sim.handle_all)[0]
+        detected = sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]
         if 'cup' in obj_name:
-            return "hold_up is failed, as the chosed object is not suitable to hold up." + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-        left_target_pose = sim.getObjectPosition(sim.getObject('/'+obj_name +'_left'), sim.handle_world)
-        if obj_pose[1]<-0.25:
-            return "hold_up is failed, out of its area." + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
+            return skill_result(side, "hold_up is failed, as the chosed object is not suitable to hold up.")
+        left_target_pose = handles.position(obj_name + '_left')
+        unreachable = out_of_reach('hold_up', side, obj_name, obj_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         if LEFT_FINGER_STAT == 'Closed' and detected:
-            return "The left hand is already occupied for grasping and holding some object." + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
+            return skill_result(side, "The left hand is already occupied for grasping and holding some object.")
         else:
             release('left')
         if LEFT_HAND_STAT != 'Horizontally_Slanted_Up':
@@ -561,8 +576,7 @@ def hold_up_single(side:str, obj_name:str):
                     [left_target_pose[0], left_target_pose[1]+0.01, left_target_pose[2]+0.18],
                     [left_target_pose[0], left_target_pose[1]+0.04, left_target_pose[2]],
                     [left_target_pose[0]-0.02, left_target_pose[1]-0.06, left_target_pose[2]]]
-            for i in range(3):
-                left.set_pose_target(NicolPose(left_poses[i], ORIENTATION_DICT_LEFT['Horizontally_Slanted_Up']))
+            move_through('left', left_poses[:3], ORIENTATION_DICT_LEFT['Horizontally_Slanted_Up'])
             LEFT_EE_POSE = left.get_eef_pose().position.as_list()
             LEFT_EE_POSE = [LEFT_EE_POSE[0]-0.03, LEFT_EE_POSE[1]-0.07, LEFT_EE_POSE[2]+0.01]
             left.set_pose_target(NicolPose(LEFT_EE_POSE, ORIENTATION_DICT_LEFT['Horizontally_Slanted_Up']))
@@ -572,14 +586,15 @@ def hold_up_single(side:str, obj_name:str):
         # CONTROLLER_attach = left_attachpoint
         # CONTROLLER_sensor = left_sensor
     else:
-        detected = sim.checkProximitySensor(right_sensor, sim.handle_all)[0]
-        right_target_pose = sim.getObjectPosition(sim.getObject('/'+obj_name+'_right'), sim.handle_world)
+        detected = sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]
+        right_target_pose = handles.position(obj_name + '_right')
         if 'cup' in obj_name:
-            return "hold_up is failed, as the chosed object is not suitable to hold up." + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
-        if obj_pose[1]>0.25:
-            return "hold_up is failed, out of its area." + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+            return skill_result(side, "hold_up is failed, as the chosed object is not suitable to hold up.")
+        unreachable = out_of_reach('hold_up', side, obj_name, obj_pose)
+        if unreachable:
+            return skill_result(side, unreachable)
         if RIGHT_FINGER_STAT == 'Closed' and detected:
-            return "the right hand is already occupied for grasping and holding some object." + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+            return skill_result(side, "the right hand is already occupied for grasping and holding some object.")
         else:
             release('right')
         if RIGHT_HAND_STAT != 'Horizontally_Slanted_Up':
@@ -587,80 +602,70 @@ def hold_up_single(side:str, obj_name:str):
                     [right_target_pose[0], right_target_pose[1]-0.01, right_target_pose[2]+0.18],
                     [right_target_pose[0], right_target_pose[1]-0.04, right_target_pose[2]],
                     [right_target_pose[0]-0.02, right_target_pose[1]+0.06, right_target_pose[2]]]
-            for i in range(3):
-                right.set_pose_target(NicolPose(right_poses[i], ORIENTATION_DICT_RIGHT['Horizontally_Slanted_Up']))
+            move_through('right', right_poses[:3], ORIENTATION_DICT_RIGHT['Horizontally_Slanted_Up'])
             RIGHT_EE_POSE = right.get_eef_pose().position.as_list()
             RIGHT_EE_POSE = [RIGHT_EE_POSE[0]-0.03, RIGHT_EE_POSE[1]+0.06, RIGHT_EE_POSE[2]+0.01]
             right.set_pose_target(NicolPose(RIGHT_EE_POSE, ORIENTATION_DICT_RIGHT['Horizontally_Slanted_Up']))
             right.set_joint_position_for_hand(quat)
             RIGHT_HAND_STAT = 'Horizontally_Slanted_Up'
             RIGHT_FINGER_STAT = 'Hold_Up'
-    left_detected = sim.checkProximitySensor(left_sensor, sim.handle_all)[0]
-    right_detected = sim.checkProximitySensor(right_sensor, sim.handle_all)[0]
+    obj_name_grasped = None
+    left_detected = sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]
+    right_detected = sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]
     # attach the graspable object
     if left_detected and side == 'left':
-        read_result = sim.readProximitySensor(left_sensor)
+        read_result = sim.readProximitySensor(robot.left_sensor)
         detected_handle = read_result[3]
         sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
-        sim.setObjectParent(detected_handle, left_attachpoint, True)
-        obj_name_grasped = sim.getObjectAlias(read_result[3], -1)
-        if '_respondable' in obj_name_grasped:
-            obj_name_grasped = obj_name_grasped.replace('_respondable', '')
+        sim.setObjectParent(detected_handle, robot.left_attachpoint, True)
+        obj_name_grasped = handles.alias(read_result[3])
         # result = f"The robot's {side} hand is prepared to hold the {obj_name} from the side."
         # result = f"The robot's hands are now holding the {obj_name_grasped} together."
     elif right_detected and side == 'right':
-        read_result = sim.readProximitySensor(right_sensor)
+        read_result = sim.readProximitySensor(robot.right_sensor)
         detected_handle = read_result[3]
         sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
-        sim.setObjectParent(detected_handle, right_attachpoint, True)
-        obj_name_grasped = sim.getObjectAlias(read_result[3], -1)
-        if '_respondable' in obj_name_grasped:
-            obj_name_grasped = obj_name_grasped.replace('_respondable', '')
+        sim.setObjectParent(detected_handle, robot.right_attachpoint, True)
+        obj_name_grasped = handles.alias(read_result[3])
     result = f"The robot's {side} hand is prepared to hold the {obj_name} from the side."
-    if side == 'left':
-        return result + ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT
-    else:
-        return result + ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
+    return skill_result(side, result, obj_name_grasped)
 
 def push_to(side:str, source_obj_name:str, target_obj_name:str):
     global LEFT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_HAND_STAT, RIGHT_FINGER_STAT
-    hand_finger_info = ' LEFT_HAND: ' + LEFT_HAND_STAT + ' LEFT_FINGER: ' + LEFT_FINGER_STAT if side == 'left' else ' RIGHT_HAND: ' + RIGHT_HAND_STAT + ' RIGHT_FINGER: ' + RIGHT_FINGER_STAT
     if side == 'left' and LEFT_FINGER_STAT == 'Closed' or side == 'right' and RIGHT_FINGER_STAT == 'Closed':
-        return f"The robot's {side} hand is already occupied for grasping some object." + hand_finger_info
+        return skill_result(side, f"The robot's {side} hand is already occupied for grasping some object.")
     if 'Origin' in source_obj_name:
-        return f"You can not push such object." + hand_finger_info
-    try:
-        source_obj = sim.getObject('/'+source_obj_name+'_respondable')
-    except Exception as e:
-        try:
-            source_obj = sim.getObject('/'+source_obj_name)
-        except Exception as e:
-            return f"The object {source_obj_name} is not in the scene." + hand_finger_info
+        return skill_result(side, f"You can not push such object.")
+    source_obj = handles.find(source_obj_name + '_respondable')
+    if source_obj is None:
+        source_obj = handles.find(source_obj_name)
+    if source_obj is None:
+        return skill_result(side, f"The object {source_obj_name} is not in the scene.")
     source_pose = np.array(sim.getObjectPosition(source_obj, sim.handle_world))
     sim.setObjectInt32Parameter(source_obj, sim.shapeintparam_static, 1)
     try:
-        target_pose = np.array(sim.getObjectPosition(sim.getObject('/'+target_obj_name), sim.handle_world))
+        target_pose = np.array(handles.position(target_obj_name))
     except Exception as e:
-        return f"The object {target_obj_name} is not in the scene." + hand_finger_info
+        return skill_result(side, f"The object {target_obj_name} is not in the scene.")
     if (target_obj_name != "overlap_area" and target_pose[2] - source_pose[2] > 0.2) or target_obj_name == "serve_point":
-        return f"You can not push the object to {target_obj_name}." + hand_finger_info
+        return skill_result(side, f"You can not push the object to {target_obj_name}.")
     if side == 'left':
         release('left')
         delta_move('left', 'left', 0.06)
         LEFT_HAND_STAT = 'Vertical'
         result = move_single_to_pose('left', source_obj_name, 'Vertical')
-        if 'failed' in result: return result + hand_finger_info
+        if result.failed(): return result
         LEFT_HAND_STAT = 'Vertical'
-        if sim.checkProximitySensor(left_sensor, sim.handle_all)[0]:
-            read_result = sim.readProximitySensor(left_sensor)
+        if sim.checkProximitySensor(robot.left_sensor, sim.handle_all)[0]:
+            read_result = sim.readProximitySensor(robot.left_sensor)
             detected_handle = read_result[3]
             sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
-            sim.setObjectParent(detected_handle, left_attachpoint, True)
+            sim.setObjectParent(detected_handle, robot.left_attachpoint, True)
         distance, i = 0.5, 0
         while distance > 0.12:
             i+=1
-            source_pose = np.array(sim.getObjectPosition(sim.getObject('/'+source_obj_name), sim.handle_world))
-            target_pose = np.array(sim.getObjectPosition(sim.getObject('/'+target_obj_name), sim.handle_world))
+            source_pose = np.array(handles.position(source_obj_name))
+            target_pose = np.array(handles.position(target_obj_name))
             distance = dist.euclidean(source_pose, target_pose)
             # distance = abs(target_pose[1] - source_pose[1])
             if i<6:
@@ -671,24 +676,24 @@ def push_to(side:str, source_obj_name:str, target_obj_name:str):
         sim.setObjectParent(detected_handle, -1, True)
         delta_move(side, 'left', 0.06)
         sim.setObjectOrientation(source_obj, sim.handle_world, [-0.00010142725493734526, -0.00012479866544761421, 1.6243816263293211])
-        return f"The robot's left hand has pushed the {source_obj_name} to the {target_obj_name}. LEFT_HAND: {LEFT_HAND_STAT} LEFT_FINGER: {LEFT_FINGER_STAT}"
+        return skill_result(side, f"The robot's left hand has pushed the {source_obj_name} to the {target_obj_name}.")
     else:
         release('right')
         delta_move('right', 'right', 0.06)
         RIGHT_HAND_STAT = 'Vertical'
         result = move_single_to_pose('right', source_obj_name, 'Vertical')
-        if 'failed' in result: return result + hand_finger_info
+        if result.failed(): return result
         RIGHT_HAND_STAT = 'Vertical'
-        if sim.checkProximitySensor(right_sensor, sim.handle_all)[0]:
-            read_result = sim.readProximitySensor(right_sensor)
+        if sim.checkProximitySensor(robot.right_sensor, sim.handle_all)[0]:
+            read_result = sim.readProximitySensor(robot.right_sensor)
             detected_handle = read_result[3]
             sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 1)
-            sim.setObjectParent(detected_handle, right_attachpoint, True)
+            sim.setObjectParent(detected_handle, robot.right_attachpoint, True)
         distance, i = 0.5, 0
         while distance > 0.12:
             i+=1
-            source_pose = np.array(sim.getObjectPosition(sim.getObject('/'+source_obj_name), sim.handle_world))
-            target_pose = np.array(sim.getObjectPosition(sim.getObject('/'+target_obj_name), sim.handle_world))
+            source_pose = np.array(handles.position(source_obj_name))
+            target_pose = np.array(handles.position(target_obj_name))
             distance = dist.euclidean(source_pose, target_pose)
             # delta_move(side, 'left', 0.06)
             if i<6:
@@ -700,22 +705,30 @@ def push_to(side:str, source_obj_name:str, target_obj_name:str):
         delta_move(side, 'right', 0.06)
         if source_obj_name == "Bowl":
             sim.setObjectOrientation(source_obj, sim.handle_world, [-0.00010142725493734526, -0.00012479866544761421, 1.6243816263293211])
-        return f"The robot's right hand has pushed the {source_obj_name} to the {target_obj_name}. RIGHT_HAND: {LEFT_HAND_STAT} RIGHT_FINGER: {LEFT_FINGER_STAT}"
+        return skill_result(side, f"The robot's right hand has pushed the {source_obj_name} to the {target_obj_name}.")
 
-def main(args):
-    command = args.command
-    para = json.loads(args.para)
+def run_command(side, command, para, hand_state, finger_state):
+    start_time = time.time()
+    sim_calls, sim_time, settle_time = metrics.counts['sim'], metrics.times['sim'], metrics.times['settle']
+    result = execute_command(side, command, para, hand_state, finger_state)
+    result.duration = round(time.time() - start_time, 3)
+    result.sim_calls = metrics.counts['sim'] - sim_calls
+    result.sim_time = round(metrics.times['sim'] - sim_time, 3)
+    result.settle_time = round(metrics.times['settle'] - settle_time, 3)
+    return result
+
+def execute_command(side, command, para, hand_state, finger_state):
     global LEFT_HAND_STAT, RIGHT_HAND_STAT, LEFT_FINGER_STAT, RIGHT_FINGER_STAT
-    if args.side == 'left': LEFT_HAND_STAT, LEFT_FINGER_STAT = args.hand_state, args.finger_state
-    elif args.side == 'right': RIGHT_HAND_STAT, RIGHT_FINGER_STAT = args.hand_state, args.finger_state
+    if side == 'left': LEFT_HAND_STAT, LEFT_FINGER_STAT = hand_state, finger_state
+    elif side == 'right': RIGHT_HAND_STAT, RIGHT_FINGER_STAT = hand_state, finger_state
     if command == 'move_and_grasp': 
-        if para['obj_name'] == 'Apple' or para['obj_name'] == 'Banana':
-            return top_grasp(args.side, **para)
+        if para['obj_name'] in TOP_GRASP_OBJECTS:
+            return top_grasp(side, **para)
         else:
-            return side_grasp(args.side, **para)
+            return side_grasp(side, **para)
     elif command == 'release': 
-        controller_ori = LEFT_HAND_STAT if args.side == 'left' else RIGHT_HAND_STAT
-        controller_sensor = left_sensor if args.side == 'left' else right_sensor
+        controller_ori = LEFT_HAND_STAT if side == 'left' else RIGHT_HAND_STAT
+        controller_sensor = robot.left_sensor if side == 'left' else robot.right_sensor
         detected = sim.checkProximitySensor(controller_sensor, sim.handle_all)[0]
         if detected:
             read_result = sim.readProximitySensor(controller_sensor)
@@ -724,34 +737,66 @@ def main(args):
             if controller_ori == 'Horizontally_Down':
                 sim.setObjectInt32Parameter(detected_handle, sim.shapeintparam_static, 0)
             # sim.step()
-        return release(args.side)
+        return release(side)
     elif command == 'move_above': 
         if para['obj_name'] == "serve_point":
-            return f'You can not move above the serve point!'
+            return skill_result(side, f'You can not move above the serve point!')
         else:
-            return move_single_to_pose(args.side, para['obj_name'], off_set = 'up')
+            return move_single_to_pose(side, para['obj_name'], off_set = 'up')
     elif command == 'pour_out': 
         try:
-            ball = sim.getObject("/big_ball")
+            ball = handles.get("big_ball")
             sim.setObjectInt32Parameter(ball, sim.shapeintparam_static, 0)
         except Exception as e:
-            return 'There is no water inside the container!'
-        return flip_down(args.side, **para)
-    elif command == 'hold_up': return hold_up_single(args.side, **para)
+            return skill_result(side, 'There is no water inside the container!')
+        return flip_down(side, **para)
+    elif command == 'hold_up': return hold_up_single(side, **para)
     elif command == 'move_to': 
-        return move_single_to_pose(args.side, **para)
+        return move_single_to_pose(side, **para)
     elif command in ('wait', 'support_grasped'): 
-        side = args.side
-        if side == 'left':
-            hand_stat = f'LEFT_HAND: {LEFT_HAND_STAT}'
-            finger_stat = f'LEFT_FINGER: {LEFT_FINGER_STAT}'
-        else:
-            hand_stat = f'RIGHT_HAND: {RIGHT_HAND_STAT}'
-            finger_stat = f'RIGHT_FINGER: {RIGHT_FINGER_STAT}'
-        return f"The robot's {side} hand is keeping the current status. {hand_stat} {finger_stat}" 
-    elif command == 'reset': return reset(args.side)
-    elif command == 'push_to': return push_to(args.side, **para)
-    else: return f'You chosed the unknown command for the chosed hand.'
+        return skill_result(side, f"The robot's {side} hand is keeping the current status.")
+    elif command == 'reset': return reset(side)
+    elif command == 'push_to': return push_to(side, **para)
+    else: return skill_result(side, f'You chosed the unknown command for the chosed hand.')
+
+def main(args):
+    return run_command(args.side, args.command, json.loads(args.para), args.hand_state, args.finger_state)
+
+# Long-lived skill worker
+##############################################################################
+def serve(side):
+    """
+    Keep one arm's controller alive and execute commands sent by the coordinator.
+    Requests and SkillResult responses are single JSON lines on stdin/stdout; everything the
+    skills print is redirected to stderr so it never corrupts the channel.
+    """
+    channel = sys.stdout
+    sys.stdout = sys.stderr
+    def respond(message):
+        channel.write(json.dumps(message) + '\n')
+        channel.flush()
+    # Connect and load the reachability map before announcing readiness, so the coordinator's
+    # start covers both costs and no skill deadline does.
+    get_session().connect()
+    get_reachability(side)
+    respond({'ready': True, 'side': side})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request['command'] == 'shutdown':
+            break
+        handles.sync(request['scene'])
+        if request.get('barrier'):
+            # Wait at the start barrier until the coordinator releases both arms.
+            respond({'id': request['id'], 'armed': True})
+            sys.stdin.readline()
+        try:
+            result = run_command(side, request['command'], request['para'], request['hand_state'], request['finger_state'])
+            respond({'id': request['id'], 'ok': True, 'result': asdict(result)})
+        except Exception as e:
+            respond({'id': request['id'], 'ok': False, 'error': f'{type(e).__name__}: {e}'})
+##############################################################################
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Subprocess Controller Parameters")
@@ -760,10 +805,9 @@ if __name__ == "__main__":
     parser.add_argument('--para', type=str, help="The parameters for the command")
     parser.add_argument('--hand_state', type=str, help="The hand state for the side controller")
     parser.add_argument('--finger_state', type=str, help="The finger state for the side controller")
+    parser.add_argument('--serve', action='store_true', default=False, help="Run as a long-lived skill worker for the side")
     args = parser.parse_args()
-    result = main(args)
-    if args.side == 'left':
-        result = 'LEFT_RESULT: ' + result
+    if args.serve:
+        serve(args.side)
     else:
-        result = 'RIGHT_RESULT: ' + result
-    print(result)
\ No newline at end of file
+        print(json.dumps(asdict(main(args))))
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Offline kinematic stand-in for CoppeliaSim and the NICOL API
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import os
+
+import numpy as np
+
+"""
+Stand-in structure:
+scene -- objects with a world position, a parent, a static flag and a detection radius
+scene -- children follow their parent by a fixed offset (no rotation)
+scene -- dynamic objects without a parent drop at once into a container below them or onto the table
+arms  -- set_pose_target moves the end effector, the palm sensor and the attach point to the target
+"""
+
+HANDLE_WORLD = -1
+HANDLE_ALL = -2
+HANDLE_PARENT = -11
+HANDLE_SCENE = -12
+OBJECT_SHAPE_TYPE = 0
+OBJECT_JOINT_TYPE = 1
+
+# name: (parent, position or offset to the parent, detection radius of a graspable shape or None)
+ROBOT_OBJECTS = {
+    'l_palm_attachPoint': (None, [0.35, 0.35, 1.05], None),
+    'r_palm_attachPoint': (None, [0.35, -0.35, 1.05], None),
+    'l_sensor': (None, [0.35, 0.35, 1.05], None),
+    'r_sensor': (None, [0.35, -0.35, 1.05], None),
+}
+MODELS = {
+    'ServeWater': ('cups_with_balls', {
+        'Origin_blue_cup': ('cups_with_balls', [0.4, 0.3, 0.86], None),
+        'blue_cup_respondable': ('Origin_blue_cup', [0, 0, 0], 0.04),
+        'blue_cup': ('blue_cup_respondable', [0, 0, 0], None),
+        'blue_cup_left': ('blue_cup_respondable', [0, 0.045, 0.03], None),
+        'blue_cup_right': ('blue_cup_respondable', [0, -0.045, 0.03], None),
+        'blue_cup_top': ('blue_cup_respondable', [0, 0, 0.1], None),
+        'big_ball': ('blue_cup_respondable', [0, 0, 0.01], None),
+        'Origin_yellow_cup': ('cups_with_balls', [0.6, -0.3, 0.86], None),
+        'yellow_cup_respondable': ('Origin_yellow_cup', [0, 0, 0], 0.04),
+        'yellow_cup': ('yellow_cup_respondable', [0, 0, 0], None),
+        'yellow_cup_left': ('yellow_cup_respondable', [0, 0.045, 0.03], None),
+        'yellow_cup_right': ('yellow_cup_respondable', [0, -0.045, 0.03], None),
+        'yellow_cup_top': ('yellow_cup_respondable', [0, 0, 0.1], None),
+        'yellow_cup_sensor': ('yellow_cup_respondable', [0, 0, 0.02], None),
+        'serve_point': ('cups_with_balls', [0.8, 0.0, 1.2], None),
+        'serve_point_sensor': ('serve_point', [0, 0, 0], None),
+        'overlap_area': ('cups_with_balls', [0.5, 0.0, 0.95], None),
+    }),
+    'ServeFruit': ('Bowl_Apple_Banana', {
+        'Origin_bowl': ('Bowl_Apple_Banana', [0.6, 0.3, 0.81], None),
+        'Bowl_respondable': ('Origin_bowl', [0, 0, 0], 0.1),
+        'Bowl': ('Bowl_respondable', [0, 0, 0], None),
+        'Bowl_left': ('Bowl_respondable', [0, 0.12, 0.02], None),
+        'Bowl_right': ('Bowl_respondable', [0, -0.12, 0.02], None),
+        'Apple': ('Bowl_Apple_Banana', [0.25, 0.5, 0.82], 0.03),
+        'Apple_top': ('Apple', [0, 0, 0.04], None),
+        'Banana': ('Bowl_Apple_Banana', [0.45, -0.6, 0.81], 0.03),
+        'Banana_top': ('Banana', [0, 0, 0.03], None),
+        'serve_point': ('Bowl_Apple_Banana', [0.6, 0.0, 1.0], None),
+        'serve_point_sensor': ('serve_point', [0, 0, 0], None),
+        'overlap_area': ('Bowl_Apple_Banana', [0.5, 0.0, 0.9], None),
+        'Origin_left_hand': ('Bowl_Apple_Banana', [0.35, 0.35, 1.0], None),
+        'Origin_right_hand': ('Bowl_Apple_Banana', [0.35, -0.35, 1.0], None),
+    }),
+}
+# sensor name: detection range
+SENSOR_RANGES = {'l_sensor': 0.05, 'r_sensor': 0.05, 'yellow_cup_sensor': 0.05, 'serve_point_sensor': 0.15}
+# container name: radius in which dropped objects land inside it
+CONTAINERS = {'yellow_cup_respondable': 0.05, 'blue_cup_respondable': 0.05, 'Bowl_respondable': 0.12}
+
+
+class OfflineObject():
+    def __init__(self, handle, name, parent, offset, radius=None, model=None):
+        self.handle = handle
+        self.name = name
+        self.parent = parent
+        self.offset = list(offset)
+        self.radius = radius
+        self.model = model
+        self.static = 1
+        self.model_property = 0
+        self.rest_z = None
+        self.default = (parent, list(offset))
+
+    def restore(self):
+        self.parent, self.offset = self.default[0], list(self.default[1])
+        self.static = 1
+
+
+class OfflineSim():
+    """The subset of the CoppeliaSim `sim` API used by this project."""
+    handle_world = HANDLE_WORLD
+    handle_all = HANDLE_ALL
+    handle_parent = HANDLE_PARENT
+    handle_scene = HANDLE_SCENE
+    object_shape_type = OBJECT_SHAPE_TYPE
+    object_joint_type = OBJECT_JOINT_TYPE
+    modelproperty_not_collidable = 0x0001
+    modelproperty_not_measurable = 0x0002
+    modelproperty_not_renderable = 0x0004
+    modelproperty_not_detectable = 0x0008
+    modelproperty_not_dynamic = 0x0020
+    modelproperty_not_respondable = 0x0040
+    modelproperty_not_visible = 0x0200
+    shapeintparam_static = 3003
+    scripttype_sandboxscript = 8
+
+    def __init__(self):
+        self.objects = {}
+        self.names = {}
+        self.next_handle = 100
+        self.last_detection = {}
+        self.arms = {}
+        for name, (parent, position, radius) in ROBOT_OBJECTS.items():
+            self._add(name, parent, position, radius)
+
+    # Scene bookkeeping
+    def _add(self, name, parent, offset, radius=None, model=None):
+        handle = self.next_handle
+        self.next_handle += 1
+        parent_handle = self.names[parent] if parent else HANDLE_WORLD
+        self.objects[handle] = OfflineObject(handle, name, parent_handle, offset, radius, model)
+        self.names[name] = handle
+        return handle
+
+    def _world(self, handle):
+        obj = self.objects[handle]
+        if obj.parent == HANDLE_WORLD:
+            return list(obj.offset)
+        parent = self._world(obj.parent)
+        return [parent[i] + obj.offset[i] for i in range(3)]
+
+    def _place(self, handle, position):
+        obj = self.objects[handle]
+        if obj.parent == HANDLE_WORLD:
+            obj.offset = list(position)
+        else:
+            parent = self._world(obj.parent)
+            obj.offset = [position[i] - parent[i] for i in range(3)]
+
+    def _drop(self, handle):
+        """Let a free dynamic object fall into a container below it or back onto the table."""
+        obj = self.objects[handle]
+        if obj.static or obj.parent != HANDLE_WORLD:
+            return
+        position = self._world(handle)
+        for name, radius in CONTAINERS.items():
+            container = self.names.get(name)
+            if container is None or container == handle:
+                continue
+            container_position = self._world(container)
+            # A container at the object's own height is the one it is being poured out of.
+            if np.linalg.norm(np.array(position[:2]) - np.array(container_position[:2])) < radius and position[2] > container_position[2] + 0.05:
+                self.setObjectParent(handle, container, True)
+                self._place(handle, [container_position[0], container_position[1], container_position[2] + 0.03])
+                return
+        rest_z = obj.rest_z if obj.rest_z is not None else 0.81
+        self._place(handle, [position[0], position[1], rest_z])
+
+    def _descendants(self, handle):
+        children = [h for h, obj in self.objects.items() if obj.parent == handle]
+        return children + [d for child in children for d in self._descendants(child)]
+
+    # sim API
+    def getObject(self, path):
+        # As in CoppeliaSim, '/a/b' finds an object b anywhere below an object a.
+        parts = [part for part in path.split('/') if part]
+        for handle, obj in self.objects.items():
+            if obj.name == parts[-1] and self._below(handle, parts[:-1]):
+                return handle
+        raise Exception(f"object does not exist: {path}")
+
+    def _below(self, handle, ancestors):
+        parent = self.objects[handle].parent
+        for name in reversed(ancestors):
+            while parent != HANDLE_WORLD and self.objects[parent].name != name:
+                parent = self.objects[parent].parent
+            if parent == HANDLE_WORLD:
+                return False
+            parent = self.objects[parent].parent
+        return True
+
+    def getModelProperty(self, handle):
+        return self.objects[handle].model_property
+
+    def setModelProperty(self, handle, model_property):
+        self.objects[handle].model_property = model_property
+
+    def getObjectAlias(self, handle, options=-1):
+        return self.objects[handle].name
+
+    def getObjectPosition(self, handle, relative_to=HANDLE_WORLD):
+        return self._world(handle)
+
+    def getObjectVelocity(self, handle):
+        return [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+
+    def getObjectPose(self, handle, relative_to=HANDLE_WORLD):
+        if relative_to == HANDLE_PARENT:
+            return list(self.objects[handle].offset) + [0.0, 0.0, 0.0, 1.0]
+        return self._world(handle) + [0.0, 0.0, 0.0, 1.0]
+
+    def getObjectParent(self, handle):
+        return self.objects[handle].parent
+
+    def getObjectType(self, handle):
+        # Every object can carry a static flag here, so all count as shapes; the stand-in has no joints.
+        return OBJECT_SHAPE_TYPE
+
+    def getObjectsInTree(self, handle, object_type=HANDLE_ALL, options=0):
+        if object_type not in (HANDLE_ALL, OBJECT_SHAPE_TYPE):
+            return []
+        if handle == HANDLE_SCENE:
+            return list(self.objects)
+        return [handle] + self._descendants(handle)
+
+    def setObjectPose(self, handle, relative_to, pose):
+        if relative_to == HANDLE_PARENT:
+            self.objects[handle].offset = list(pose[:3])
+            return
+        self._place(handle, pose[:3])
+        if self.objects[handle].rest_z is None:
+            self.objects[handle].rest_z = pose[2]
+
+    def setObjectPosition(self, handle, relative_to, position):
+        self._place(handle, position)
+
+    def setObjectOrientation(self, handle, relative_to, euler):
+        pass
+
+    def setObjectParent(self, handle, parent, keep_in_place=True):
+        position = self._world(handle)
+        self.objects[handle].parent = parent
+        if keep_in_place:
+            self._place(handle, position)
+        self._drop(handle)
+
+    def setObjectInt32Parameter(self, handle, parameter, value):
+        if parameter == self.shapeintparam_static:
+            self.objects[handle].static = value
+            self._drop(handle)
+
+    setObjectInt32Param = setObjectInt32Parameter
+
+    def getObjectInt32Param(self, handle, parameter):
+        if parameter == self.shapeintparam_static:
+            return self.objects[handle].static
+        return 0
+
+    def resetDynamicObject(self, handle):
+        pass
+
+    def checkProximitySensor(self, sensor, entity):
+        sensor_name = self.objects[sensor].name
+        sensor_range = SENSOR_RANGES.get(sensor_name, 0.05)
+        sensor_position = np.array(self._world(sensor))
+        if entity == HANDLE_ALL:
+            candidates = [h for h, obj in self.objects.items() if obj.radius is not None]
+        else:
+            candidates = [h for h in [entity] + self._descendants(entity) if h in self.objects]
+        best = None
+        for handle in candidates:
+            radius = self.objects[handle].radius or 0.0
+            distance = np.linalg.norm(np.array(self._world(handle)) - sensor_position) - radius
+            if distance < sensor_range and (best is None or distance < best[1]):
+                best = (handle, distance)
+        if best is None:
+            result = (0, 0.0, [0.0, 0.0, 0.0], -1, [0.0, 0.0, 0.0])
+        else:
+            result = (1, max(best[1], 0.0), self._world(best[0]), best[0], [0.0, 0.0, 1.0])
+        self.last_detection[sensor] = result
+        return result
+
+    def readProximitySensor(self, sensor):
+        return self.last_detection.get(sensor, (0, 0.0, [0.0, 0.0, 0.0], -1, [0.0, 0.0, 0.0]))
+
+    def loadModel(self, model_path):
+        model_name = os.path.splitext(os.path.basename(model_path))[0]
+        root, objects = MODELS[model_name]
+        root_handle = self._add(root, None, [0, 0, 0], model=root)
+        for name, (parent, offset, radius) in objects.items():
+            handle = self._add(name, parent, offset, radius, model=root)
+            if radius is not None:
+                self.objects[handle].rest_z = self._world(handle)[2]
+        return root_handle
+
+    def removeModel(self, handle):
+        for removed in [handle] + self._descendants(handle):
+            if self.names.get(self.objects[removed].name) == removed:
+                del self.names[self.objects[removed].name]
+            del self.objects[removed]
+
+    def executeScriptString(self, script, script_type):
+        raise NotImplementedError("The offline simulator does not run scripts.")
+
+    def startSimulation(self):
+        pass
+
+    def stopSimulation(self):
+        # Like CoppeliaSim, stopping undoes attachments and dynamics; poses are set again by the task reset.
+        for obj in self.objects.values():
+            obj.restore()
+        self.last_detection = {}
+        for arm in self.arms.values():
+            arm.set_joint_position(None)
+
+
+class OfflineClient():
+    def setStepping(self, enable):
+        pass
+
+    def step(self):
+        pass
+
+
+class Position():
+    def __init__(self, position):
+        self.x, self.y, self.z = [float(v) for v in position[:3]]
+
+    def as_list(self):
+        return [self.x, self.y, self.z]
+
+
+class Orientation():
+    def __init__(self, orientation):
+        self.x, self.y, self.z, self.w = [float(v) for v in list(orientation)[:4]]
+
+
+class NicolPose():
+    def __init__(self, position, orientation):
+        self.position = Position(position)
+        self.orientation = Orientation(orientation)
+
+
+class OfflineArm():
+    """An arm whose end effector, palm sensor and attach point jump to the target pose."""
+    def __init__(self, sim, side, home):
+        self.sim = sim
+        self.side = side
+        self.home = home
+        self.pose = NicolPose(home, [0, 0, 0, 1])
+        self.hand = [-np.pi] * 5
+        prefix = 'l' if side == 'left' else 'r'
+        self.sensor = sim.names[prefix + '_sensor']
+        self.attachpoint = sim.names[prefix + '_palm_attachPoint']
+
+    def get_eef_pose(self):
+        return self.pose
+
+    def set_pose_target(self, pose, block=True):
+        self.pose = NicolPose(pose.position.as_list(), [pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w])
+        self.sim._place(self.sensor, self.pose.position.as_list())
+        self.sim._place(self.attachpoint, self.pose.position.as_list())
+
+    def set_joint_position(self, joints, block=True):
+        self.set_pose_target(NicolPose(self.home, [0, 0, 0, 1]))
+
+    def set_joint_position_for_hand(self, joints, block=False):
+        self.hand = list(joints)
+
+
+class OfflineHead():
+    def set_pose_target(self, pose, block=True):
+        pass
+
+
+class OfflineAdapter():
+    def __init__(self):
+        self.sim = OfflineSim()
+        self.client = OfflineClient()
+
+
+class OfflineNicol():
+    def __init__(self):
+        self.nicol_adapter = OfflineAdapter()
+        sim = self.nicol_adapter.sim
+        self._head = OfflineHead()
+        self._left = OfflineArm(sim, 'left', ROBOT_OBJECTS['l_sensor'][1])
+        self._right = OfflineArm(sim, 'right', ROBOT_OBJECTS['r_sensor'][1])
+        sim.arms = {'left': self._left, 'right': self._right}
+
+    def head(self):
+        return self._head
+
+    def left(self):
+        return self._left
+
+    def right(self):
+        return self._right
+
+    def set_pose_target_for_both_arms(self, left_pose, right_pose, block=True):
+        self._left.set_pose_target(left_pose)
+        self._right.set_pose_target(right_pose)
+
+
+class NicolFactory():
+    """
+    Same entry point as nicol_api.nicol_env.NicolFactory. All modules of one
+    process share a single offline robot, so their `sim` handles agree.
+    """
+    nicol = None
+
+    def create_nicol(self, backend='offline', **kwargs):
+        if NicolFactory.nicol is None:
+            NicolFactory.nicol = OfflineNicol()
+        return NicolFactory.nicol
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Native tool-calling planner loop for the LABOR Agent
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import abc
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import ValidationError
+
+
+def compact_schema(schema):
+    """Drop the pydantic titles, which only cost prompt tokens."""
+    if isinstance(schema, dict):
+        return {key: compact_schema(value) for key, value in schema.items() if key != 'title'}
+    if isinstance(schema, list):
+        return [compact_schema(value) for value in schema]
+    return schema
+
+
+def arguments_complete(tool_call):
+    """Whether the streamed arguments of a tool call already form a JSON object."""
+    if not tool_call['id'] or not tool_call['function']['name']:
+        return False
+    try:
+        return isinstance(json.loads(tool_call['function']['arguments']), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+class PlannerTool(abc.ABC):
+    """
+    A tool the planner can call. args_schema is a pydantic model of the
+    arguments (None for tools without arguments); _run returns a JSON-able
+    result that is sent back to the model as is, and must be defined, so an
+    incomplete tool fails when it is created. Tools may also define a
+    coroutine _arun, which arun() awaits instead of running _run on a thread.
+    """
+    name = ''
+    description = ''
+    args_schema = None
+
+    def spec(self):
+        if self.args_schema is None:
+            parameters = {'type': 'object', 'properties': {}}
+        else:
+            parameters = compact_schema(self.args_schema.model_json_schema())
+        return {'type': 'function', 'function': {'name': self.name, 'description': self.description.strip(), 'parameters': parameters}}
+
+    def parse(self, arguments):
+        if self.args_schema is None:
+            return {}
+        return self.args_schema(**arguments).model_dump()
+
+    def run(self, arguments):
+        return self._run(**self.parse(arguments))
+
+    async def arun(self, arguments):
+        kwargs = self.parse(arguments)
+        if hasattr(self, '_arun'):
+            return await self._arun(**kwargs)
+        return await asyncio.to_thread(self._run, **kwargs)
+
+    @abc.abstractmethod
+    def _run(self, **kwargs):
+        pass
+
+
+class ToolPlanner():
+    """
+    Chat loop with native function calling: the model answers with tool calls,
+    their structured results are appended to the message history and the model
+    is asked again, until it answers without a tool call or max_turns is hit.
+
+    Works against any OpenAI-compatible endpoint (base_url, or OPENAI_BASE_URL),
+    e.g. a local mock server. With a ResponseCache, completions are looked up
+    by model, temperature, messages and tool schemas before calling the API.
+
+    With stream=True the reply is read as a token stream and each tool call is
+    started as soon as its arguments are complete, while the model is still
+    generating; prefetch (e.g. a scene snapshot) is started on the first token
+    of reasoning text. Tools run one at a time on a single worker thread, in
+    the order the model called them, and each is only started once the one
+    before has passed the stop check.
+
+    arun() is the asyncio version of run(): completions are requested on a
+    thread and tools are awaited through their arun(), so other coroutines,
+    e.g. further episodes, go on during LLM I/O and arm motion. run() runs
+    arun() in its own event loop.
+
+    callbacks get on_llm_end(latency, usage, cached) after every completion
+    and on_tool_end(name, latency) after every tool call. stop, if set, is
+    asked after every tool call and ends the run when it returns a reason,
+    e.g. when the task monitor already knows the outcome of the episode.
+    """
+    def __init__(self, model_name, tools, temperature=0.1, max_turns=20, cache=None, base_url=None, client=None, verbose=True, stream=False, prefetch=None, callbacks=(), stop=None):
+        self.model_name = model_name
+        self.tools = {tool.name: tool for tool in tools}
+        self.specs = [tool.spec() for tool in tools]
+        self.temperature = temperature
+        self.max_turns = max_turns
+        self.cache = cache
+        self.verbose = verbose
+        self.stream = stream
+        self.prefetch = prefetch
+        self.callbacks = list(callbacks)
+        self.stop = stop
+        # Retry number of the current run, part of the cache key (see ResponseCache).
+        self.attempt = 0
+        if client is None:
+            from openai import OpenAI
+            api_key = os.environ.get('OPENAI_API_KEY')
+            if api_key is None and (base_url or (cache is not None and cache.mode == 'replay')):
+                # Neither a mock endpoint nor a replayed cache checks the key.
+                api_key = 'unused'
+            client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = client
+        self.messages = []
+
+    def complete(self, messages, executor=None):
+        """
+        One assistant message as a dict, from the cache or the API, and the
+        futures of the tool calls already started while streaming, by index.
+        """
+        key, start = None, time.perf_counter()
+        if self.cache is not None:
+            key = self.cache.key(self.model_name, self.temperature, messages, self.specs, self.attempt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                for callback in self.callbacks:
+                    callback.on_llm_end(time.perf_counter() - start, None, True)
+                return json.loads(cached), {}
+        if self.stream and executor is not None:
+            reply, started, usage = self.complete_streaming(messages, executor)
+        else:
+            response = self.client.chat.completions.create(model=self.model_name, messages=messages, tools=self.specs, temperature=self.temperature)
+            message = response.choices[0].message
+            reply, started = {'role': 'assistant', 'content': message.content}, {}
+            usage = response.usage.model_dump() if response.usage else None
+            if message.tool_calls:
+                reply['tool_calls'] = [{'id': call.id, 'type': 'function',
+                                        'function': {'name': call.function.name, 'arguments': call.function.arguments}}
+                                       for call in message.tool_calls]
+        for callback in self.callbacks:
+            callback.on_llm_end(time.perf_counter() - start, usage, False)
+        if key is not None:
+            self.cache.put(key, self.model_name, json.dumps(reply))
+        return reply, started
+
+    def complete_streaming(self, messages, executor):
+        stream = self.client.chat.completions.create(model=self.model_name, messages=messages, tools=self.specs,
+                                                     temperature=self.temperature, stream=True, stream_options={'include_usage': True})
+        content, calls, started, usage = [], {}, {}, None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage.model_dump()
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                if not content and self.prefetch is not None:
+                    executor.submit(self.prefetch)
+                content.append(delta.content)
+            for part in delta.tool_calls or []:
+                call = calls.setdefault(part.index, {'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''}})
+                if part.id:
+                    call['id'] = part.id
+                if part.function is not None:
+                    call['function']['name'] += part.function.name or ''
+                    call['function']['arguments'] += part.function.arguments or ''
+            self.start_next(calls, started, executor)
+        reply = {'role': 'assistant', 'content': ''.join(content) or None}
+        if calls:
+            reply['tool_calls'] = [calls[index] for index in sorted(calls)]
+            started = {position: started[index] for position, index in enumerate(sorted(calls)) if index in started}
+        return reply, started, usage
+
+    def start_next(self, calls, started, executor):
+        """
+        Start the next streamed tool call once its arguments are complete, but
+        only after the call before it has finished and passed the stop check,
+        so nothing more runs once the episode has an outcome.
+        """
+        pending = [index for index in sorted(calls) if index not in started]
+        if not pending or not arguments_complete(calls[pending[0]]):
+            return
+        if started:
+            previous = started[max(started)]
+            if not previous.done() or (self.stop is not None and self.stop() is not None):
+                return
+        call = calls[pending[0]]
+        started[pending[0]] = executor.submit(self.call_tool, {**call, 'function': dict(call['function'])})
+
+    def call_tool(self, tool_call):
+        return asyncio.run(self.acall_tool(tool_call))
+
+    async def acall_tool(self, tool_call):
+        name = tool_call['function']['name']
+        if name not in self.tools:
+            return {'error': f"Unknown tool {name}, choose from {list(self.tools)}."}
+        start = time.perf_counter()
+        try:
+            arguments = json.loads(tool_call['function']['arguments'] or '{}')
+            return await self.tools[name].arun(arguments)
+        except (json.JSONDecodeError, ValidationError, TypeError) as e:
+            # Malformed arguments go back to the model instead of ending the episode.
+            return {'error': f"Invalid arguments for {name}: {e}"}
+        finally:
+            for callback in self.callbacks:
+                callback.on_tool_end(name, time.perf_counter() - start)
+
+    def run(self, user_input, attempt=0):
+        return asyncio.run(self.arun(user_input, attempt))
+
+    async def arun(self, user_input, attempt=0):
+        self.attempt = attempt
+        self.messages = [{'role': 'user', 'content': user_input}]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for _ in range(self.max_turns):
+                reply, started = await asyncio.to_thread(self.complete, self.messages, executor)
+                self.messages.append(reply)
+                if self.verbose and reply.get('content'):
+                    print('Thought:', reply['content'])
+                if not reply.get('tool_calls'):
+                    return reply.get('content')
+                for i, tool_call in enumerate(reply['tool_calls']):
+                    result = await asyncio.wrap_future(started[i]) if i in started else await self.acall_tool(tool_call)
+                    if self.verbose:
+                        print('Action:', tool_call['function']['name'], tool_call['function']['arguments'])
+                        print('Observation:', result)
+                    self.messages.append({'role': 'tool', 'tool_call_id': tool_call['id'], 'content': json.dumps(result, default=str)})
+                    reason = self.stop() if self.stop is not None else None
+                    if reason is not None:
+                        # The stream starts no call after one that stopped the run; the calls it did not start are dropped.
+                        print('The planner stopped:', reason)
+                        return None
+        print(f"The planner stopped after {self.max_turns} turns.")
+        return None
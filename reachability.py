@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Precomputed reachability maps of the arms of NICOL Bimanual Robot
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from ik_service import get_ik
+from robot_session import get_session
+
+"""
+Reachability structure:
+map    -- one boolean voxel grid per arm and hand orientation over the table workspace
+map    -- a voxel is reachable if it lies in the arm's area and, with IK available, its center has an IK solution
+lookup -- O(1): the position is turned into a voxel index; outside the workspace only the area rule can hold, and only without IK
+skills -- SKILL_REACH holds each skill's orientation and feedback, for the skills and the check before dispatch
+cache  -- IK-based maps are built by `python reachability.py` against the running simulator, which places the arm bases
+cache  -- they are saved next to this file under a hash of their inputs, the arm's base pose included
+cache  -- at run time they are only loaded (workers load theirs at start); without one the area rule alone is used
+"""
+
+# (min, max) of x, y and z in world coordinates: the table top up to above the serve points.
+# An IK-based map treats everything outside as unreachable; the area rule alone has no box.
+WORKSPACE = ((0.1, 0.9), (-0.75, 0.75), (0.75, 1.35))
+RESOLUTION = 0.025
+# How far each arm reaches across the middle of the table (|y|), per hand orientation, as tuned in the skills.
+AREA_LIMITS = {'Horizontally_Slanted_Up': 0.25}
+DEFAULT_AREA_LIMIT = 0.2
+# Objects that move_and_grasp grasps from the top (top_grasp); all others are grasped from the side.
+TOP_GRASP_OBJECTS = ('Apple', 'Banana')
+# Reach check of each skill, shared by the skills and the coordinator's check before dispatch:
+# (hand orientation, None for the one the hand has; height of the target above the object; out-of-area feedback).
+SKILL_REACH = {
+    'side_grasp': ('Vertical', 0.0, "The {side} hand failed to grasp {obj_name}, out of its area."),
+    'top_grasp': ('Horizontally_Down', 0.0, "The {side} hand failed to grasp {obj_name}, out of its area."),
+    'move_to': (None, 0.0, "The robot's {side} hand failed to move to {obj_name}, out of its area."),
+    'hold_up': ('Horizontally_Slanted_Up', 0.18, "hold_up is failed, out of its area."),
+}
+# The reach check a command makes, by command.
+COMMAND_REACH = {'move_to': 'move_to', 'move_above': 'move_to', 'hold_up': 'hold_up'}
+
+
+def in_area(side, position, orientation=None):
+    """The area rule: how far each arm reaches across the middle of the table with the named orientation."""
+    limit = AREA_LIMITS.get(orientation, DEFAULT_AREA_LIMIT)
+    return position[1] >= -limit if side == 'left' else position[1] <= limit
+
+
+class ReachabilityMap():
+    """
+    Reachable voxels of one arm for each named orientation. The arm's area
+    (left: y >= -limit, right: y <= limit) is always applied; with an IK
+    service, voxels whose center has no IK solution are removed as well,
+    solved as one batch per orientation. Without IK, positions outside the
+    workspace are judged by the area rule alone.
+    """
+    def __init__(self, side, orientations, ik=None, workspace=WORKSPACE, resolution=RESOLUTION):
+        self.side = side
+        self.ik_based = ik is not None and ik.ready()
+        self.resolution = resolution
+        self.lower = np.array([low for low, _ in workspace])
+        self.shape = tuple(np.round((np.array([high for _, high in workspace]) - self.lower) / resolution).astype(int))
+        self.grids = {name: self._build(name, orientation, ik) for name, orientation in orientations.items()}
+
+    def centers(self):
+        axes = [self.lower[i] + (np.arange(self.shape[i]) + 0.5) * self.resolution for i in range(3)]
+        return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    def _build(self, name, orientation, ik):
+        centers = self.centers()
+        grid = in_area(self.side, centers.T, name)
+        if ik is not None and ik.ready():
+            solutions = ik.solve(centers[grid].tolist(), orientation, cache=False)
+            grid[grid] = [solution is not None for solution in solutions]
+        return grid.reshape(self.shape)
+
+    def index(self, position):
+        # The small offset keeps positions on a voxel face (e.g. y = -0.2) in the upper voxel.
+        index = np.floor((np.asarray(position[:3], dtype=float) - self.lower) / self.resolution + 1e-9).astype(int)
+        if (index < 0).any() or (index >= self.shape).any():
+            return None
+        return tuple(index)
+
+    def reachable(self, position, orientation=None):
+        """Whether the arm reaches `position` with the named orientation, or with any of them if None or unknown."""
+        index = self.index(position)
+        if index is None:
+            return not self.ik_based and self.in_area(position, orientation)
+        if orientation in self.grids:
+            return bool(self.grids[orientation][index])
+        return any(bool(grid[index]) for grid in self.grids.values())
+
+    def reachable_points(self, positions, orientation=None):
+        """reachable() for an (n, 3) array of positions at once."""
+        index = np.floor((np.asarray(positions, dtype=float)[:, :3] - self.lower) / self.resolution + 1e-9).astype(int)
+        inside = ((index >= 0) & (index < self.shape)).all(axis=1)
+        index = np.where(inside[:, None], index, 0)
+        grids = [self.grids[orientation]] if orientation in self.grids else list(self.grids.values())
+        reachable = inside & np.any([grid[index[:, 0], index[:, 1], index[:, 2]] for grid in grids], axis=0)
+        if not self.ik_based:
+            reachable |= ~inside & self.in_area(np.asarray(positions, dtype=float).T, orientation)
+        return reachable
+
+    def in_area(self, position, orientation=None):
+        # The area rule with the named orientation, or with any of them if None or unknown.
+        names = [orientation] if orientation in self.grids else list(self.grids)
+        return np.any([in_area(self.side, position, name) for name in names], axis=0)
+
+    def save(self, path):
+        np.savez_compressed(path, lower=self.lower, resolution=self.resolution, **self.grids)
+
+    @classmethod
+    def load(cls, side, path):
+        data = np.load(path)
+        reach = cls.__new__(cls)
+        reach.side = side
+        # Only IK-based maps are saved.
+        reach.ik_based = True
+        reach.lower = data['lower']
+        reach.resolution = float(data['resolution'])
+        reach.grids = {name: data[name] for name in data.files if name not in ('lower', 'resolution')}
+        reach.shape = next(iter(reach.grids.values())).shape
+        return reach
+
+
+_maps = {}
+
+def map_file(side, orientations, ik):
+    """Cache file of an IK-based map, named by a hash of everything the map depends on."""
+    with open(ik.urdf_file, 'rb') as f:
+        urdf = hashlib.sha256(f.read()).hexdigest()
+    inputs = json.dumps([side, WORKSPACE, RESOLUTION, AREA_LIMITS, DEFAULT_AREA_LIMIT,
+                         {name: list(orientation) for name, orientation in orientations.items()}, urdf, ik.base_pose()], sort_keys=True)
+    digest = hashlib.sha256(inputs.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f'reachability_{side}_{digest}.npz')
+
+def orientations_of(side):
+    from nicol_controller import ORIENTATION_DICT_LEFT, ORIENTATION_DICT_RIGHT
+    return ORIENTATION_DICT_LEFT if side == 'left' else ORIENTATION_DICT_RIGHT
+
+def get_reachability(side):
+    """
+    The reachability map of one arm. The precomputed IK map is loaded if it
+    matches the current inputs; it is never built here, since that takes far
+    longer than a skill may. Without it, the map uses the area rule only.
+    """
+    if side not in _maps:
+        orientations = orientations_of(side)
+        ik = get_ik(side)
+        cache_file = map_file(side, orientations, ik) if ik.ready() else None
+        if cache_file is not None and os.path.exists(cache_file):
+            _maps[side] = ReachabilityMap.load(side, cache_file)
+        else:
+            if cache_file is not None:
+                print(f"No reachability map for the {side} arm at {cache_file}, run `python reachability.py` to build it; using the area rule.")
+            _maps[side] = ReachabilityMap(side, orientations)
+    return _maps[side]
+
+def reachable(side, position, orientation=None):
+    return get_reachability(side).reachable(position, orientation)
+
+def out_of_reach(skill, side, obj_name, position, hand_stat=None):
+    """The out-of-area feedback of `skill` (see SKILL_REACH) if the arm cannot reach obj_name at `position`, else None."""
+    orientation, height, message = SKILL_REACH[skill]
+    target = [position[0], position[1], position[2] + height]
+    if reachable(side, target, orientation or hand_stat):
+        return None
+    return message.format(side=side, obj_name=obj_name)
+
+def command_reach(command, obj_name):
+    """The SKILL_REACH entry checked by a command on obj_name, or None for commands without a reach check."""
+    if command == 'move_and_grasp':
+        return 'top_grasp' if obj_name in TOP_GRASP_OBJECTS else 'side_grasp'
+    return COMMAND_REACH.get(command)
+
+def build(side):
+    """Build the IK-based map of one arm and save it atomically, so concurrent readers never see a partial file."""
+    # The IK goals are moved into the arm's base frame, which is read from the scene.
+    get_session().connect()
+    orientations = orientations_of(side)
+    ik = get_ik(side)
+    if not ik.ready():
+        raise RuntimeError(f"IK is not available for the {side} arm, so there is no map to build.")
+    cache_file = map_file(side, orientations, ik)
+    reach = ReachabilityMap(side, orientations, ik)
+    handle, temp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(cache_file))
+    os.close(handle)
+    try:
+        reach.save(temp_file)
+        os.replace(temp_file, cache_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    _maps[side] = reach
+    return cache_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reachability Parameters")
+    parser.add_argument('--sides', type=str, nargs='+', default=['left', 'right'], choices=['left', 'right'], help="Which arms to build the IK-based maps for")
+    args = parser.parse_args()
+    for side in args.sides:
+        print(f"The reachability map of the {side} arm is written to {build(side)}")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Append-only episode recorder for LABOR Agent experiments
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+
+
+def record_name(task_name, model_name, use_labor, num_tasks, shard=None):
+    method = 'LABOR' if use_labor else 'Baseline'
+    if 'gpt-3.5' in model_name:
+        model_tag = 'gpt-3.5'
+    elif 'gpt-4' in model_name:
+        model_tag = 'gpt-4'
+    else:
+        model_tag = model_name
+    file_name = './logs/' + task_name + '_' + model_tag + '_' + method + '1-' + str(num_tasks)
+    if shard is not None:
+        file_name += f'_shard{shard}'
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    return file_name
+
+
+# CSV column with the number of rows of the episode, written on every row of it.
+EPISODE_ROWS = 'episode_rows'
+
+
+class EpisodeRecorder():
+    """
+    Streams episode records to a CSV (one row per step, as before, and a single
+    row with empty step columns for an episode without steps) or JSON Lines
+    (one line per episode) file. Rows of an episode are buffered and written in
+    one go at the episode boundary, then flushed and fsynced. A crash can still
+    cut the write of an episode short: a JSON Lines file then ends in a
+    truncated line, a CSV file in some of the episode's rows. Every CSV row
+    carries the row count of its episode (EPISODE_ROWS), so episodes with
+    missing rows are found and dropped when the file is reopened, and are run
+    again on --resume.
+    """
+    def __init__(self, record_file, columns, record_format='csv'):
+        self.record_file = record_file
+        self.record_format = record_format
+        self.columns = list(columns)
+        if record_format == 'csv' and EPISODE_ROWS not in self.columns:
+            self.columns.append(EPISODE_ROWS)
+        self.completed = {}
+        # Stored metrics of the finished episodes, by task index, for episodes skipped on --resume.
+        self.metrics = {}
+        if os.path.exists(record_file):
+            self._recover()
+        self.file = open(record_file, 'a', newline='')
+        if self.file.tell() == 0 and record_format == 'csv':
+            self._write_rows([self.columns])
+
+    def _recover(self):
+        # Drop a partially written last line and remember the finished episodes.
+        with open(self.record_file, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+        with open(self.record_file, newline='') as f:
+            if self.record_format == 'csv':
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header:
+                    self.columns = header
+                    self._recover_csv(header, list(reader))
+            else:
+                for line in f:
+                    episode = json.loads(line)
+                    self._done(episode, bool(episode['success']))
+
+    def _recover_csv(self, header, rows):
+        # The rows of an episode are consecutive; an episode is complete once it has all of its rows.
+        if EPISODE_ROWS not in header:
+            # Written before the row counts; every episode is taken as complete.
+            for row in rows:
+                self._done(dict(zip(header, row)))
+            return
+        def full(episode, group):
+            return episode[EPISODE_ROWS].isdigit() and len(group) == int(episode[EPISODE_ROWS])
+        episodes = []
+        for row in rows:
+            episode = dict(zip(header, row))
+            if episodes and episodes[-1][0] == episode['task_index'] and not full(*episodes[-1][1:]):
+                episodes[-1][2].append(row)
+            else:
+                episodes.append((episode['task_index'], episode, [row]))
+        complete = [(task_index, episode, group) for task_index, episode, group in episodes if full(episode, group)]
+        for _, episode, _ in complete:
+            self._done(episode)
+        if len(complete) != len(episodes):
+            print(f"Dropping {len(episodes) - len(complete)} incomplete episodes from {self.record_file}.")
+            handle, temp_file = tempfile.mkstemp(suffix='.csv', dir=os.path.dirname(os.path.abspath(self.record_file)))
+            with os.fdopen(handle, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows([row for _, _, group in complete for row in group])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.record_file)
+
+    def _done(self, episode, success=None):
+        # CSV fields are strings, with the metrics as JSON.
+        task_index = int(episode['task_index'])
+        self.completed[task_index] = episode['success'] == 'True' if success is None else success
+        metrics = episode.get('metrics')
+        if isinstance(metrics, str):
+            try:
+                metrics = json.loads(metrics) if metrics else None
+            except json.JSONDecodeError:
+                metrics = None
+        if isinstance(metrics, dict):
+            self.metrics[task_index] = metrics
+
+    def is_done(self, task_index):
+        return task_index in self.completed
+
+    def write_episode(self, data):
+        if self.record_format == 'csv':
+            # An episode without steps still gets one row, with empty step columns, for its outcome and metrics.
+            steps = max([len(value) for value in data.values() if isinstance(value, list)] + [1])
+            rows = []
+            for i in range(steps):
+                row = []
+                for column in self.columns:
+                    value = steps if column == EPISODE_ROWS else data.get(column)
+                    if isinstance(value, list):
+                        value = value[i] if i < len(value) else ''
+                    elif isinstance(value, dict):
+                        # Episode-level dicts such as the metrics are stored as JSON.
+                        value = json.dumps(value)
+                    row.append('' if value is None else value)
+                rows.append(row)
+            self._write_rows(rows)
+        else:
+            self.file.write(json.dumps({column: data.get(column) for column in self.columns}, default=str) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.completed[int(data['task_index'])] = bool(data['success'])
+        if isinstance(data.get('metrics'), dict):
+            self.metrics[int(data['task_index'])] = data['metrics']
+
+    def _write_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        self.file.write(buffer.getvalue())
+
+    def close(self):
+        self.file.close()
+
+    def export_parquet(self, parquet_file=None):
+        import pandas as pd
+        parquet_file = parquet_file or os.path.splitext(self.record_file)[0] + '.parquet'
+        if self.record_format == 'csv':
+            df = pd.read_csv(self.record_file)
+        else:
+            df = pd.read_json(self.record_file, lines=True)
+        df.to_parquet(parquet_file, index=False)
+        return parquet_file
+
+
+def merge_records(shard_files, record_file, record_format='csv'):
+    """Merge shard record files into one, ordered by task_index."""
+    header, episodes = None, []
+    for shard_file in shard_files:
+        if not os.path.exists(shard_file):
+            continue
+        with open(shard_file, newline='') as f:
+            if record_format == 'csv':
+                reader = csv.reader(f)
+                shard_header = next(reader, None)
+                if shard_header is None:
+                    continue
+                header = header or shard_header
+                index = shard_header.index('task_index')
+                episodes += [(int(row[index]), row) for row in reader]
+            else:
+                episodes += [(int(json.loads(line)['task_index']), line) for line in f if line.strip()]
+    # sorted() is stable, so the step rows of an episode keep their order.
+    episodes = sorted(episodes, key=lambda episode: episode[0])
+    with open(record_file, 'w', newline='') as f:
+        if record_format == 'csv':
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(header)
+            writer.writerows([row for _, row in episodes])
+        else:
+            f.writelines([line if line.endswith('\n') else line + '\n' for _, line in episodes])
+    return record_file
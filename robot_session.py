@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Lazily created simulator session shared by the LABOR Agent modules
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import asyncio
+import os
+import threading
+
+from episode_metrics import InstrumentedSim
+from handle_registry import HandleRegistry
+from scene_snapshot import SceneReader
+
+
+class RobotSession():
+    """
+    Owns the connection to one NICOL simulator: the robot parts, the palm
+    sensors, the handle cache and the scene reader. Nothing is connected until
+    one of these is first used, so importing the LABOR modules is cheap and
+    works without a running simulator.
+
+    port and backend default to LABOR_SIM_PORT and LABOR_BACKEND, scene to
+    LABOR_SCENE; env() hands the same settings to the skill worker processes.
+
+    The remote API client is not thread-safe, so code that uses the
+    connection from the asyncio coordinator goes through call(), which runs it
+    on a thread while holding the session lock.
+    """
+    def __init__(self, port=None, scene=None, backend=None):
+        if port is None and os.environ.get('LABOR_SIM_PORT'):
+            port = int(os.environ['LABOR_SIM_PORT'])
+        self.port = port
+        self.scene_file = scene or os.environ.get('LABOR_SCENE', './nicol.ttt')
+        self.backend = backend or os.environ.get('LABOR_BACKEND', 'coppelia')
+        self.lock = threading.RLock()
+        self.connected = False
+
+    def __getattr__(self, name):
+        # Only reached for the robot attributes that connect() has not set yet.
+        if name.startswith('_') or self.__dict__.get('connected', True):
+            raise AttributeError(name)
+        self.connect()
+        return getattr(self, name)
+
+    @property
+    def NicolPose(self):
+        # The pose class does not need a connection.
+        if self.backend == 'offline':
+            from offline_sim import NicolPose
+        else:
+            from nicol_api.base import NicolPose
+        return NicolPose
+
+    def connect(self):
+        if self.connected:
+            return self
+        if self.backend == 'offline':
+            from offline_sim import NicolFactory
+        else:
+            from nicol_api.nicol_env import NicolFactory
+        connect_kwargs = {'port': self.port} if self.port is not None else {}
+        self.nicol = NicolFactory().create_nicol('coppelia', scene=self.scene_file, start_scene=False, talker=False, **connect_kwargs)
+        self.head  = self.nicol.head()    # 3D-Printed head structure
+        self.left  = self.nicol.left()    # Left  OpenManipulator + RH8D
+        self.right = self.nicol.right()   # Right OpenManipulator + RH8D
+        # Every remote call made through the session is counted in the episode metrics.
+        self.sim = InstrumentedSim(self.nicol.nicol_adapter.sim)
+        self.client = self.nicol.nicol_adapter.client
+        self.left_sensor = self.sim.getObject('/l_sensor')
+        self.left_attachpoint = self.sim.getObject('/l_palm_attachPoint')
+        self.right_sensor = self.sim.getObject('/r_sensor')
+        self.right_attachpoint = self.sim.getObject('/r_palm_attachPoint')
+        self.handles = HandleRegistry(self.sim)
+        self.scene = SceneReader(self.sim, self.handles, self.left, self.right, self.left_sensor, self.right_sensor)
+        self.connected = True
+        print('The simulation starts!', f'(backend {self.backend}, scene {self.scene_file}, port {self.port or "default"})')
+        return self
+
+    async def call(self, function, *args):
+        """Await function(*args) on a thread, with the simulator connection to itself."""
+        def locked():
+            with self.lock:
+                return function(*args)
+        return await asyncio.to_thread(locked)
+
+    def env(self):
+        env = {'LABOR_SCENE': self.scene_file, 'LABOR_BACKEND': self.backend}
+        if self.port is not None:
+            env['LABOR_SIM_PORT'] = str(self.port)
+        return env
+
+
+_session = None
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = RobotSession()
+    return _session
+
+def configure_session(port=None, scene=None, backend=None):
+    """Replace the process-wide session; only allowed before it connects."""
+    global _session
+    if _session is not None and _session.connected:
+        raise RuntimeError("The simulator session is already connected.")
+    _session = RobotSession(port=port, scene=scene, backend=backend)
+    return _session
+
+
+class LazySession():
+    """Forwards attribute access to the current session."""
+    def _target(self):
+        return get_session()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._target(), name)
+
+
+class SessionAttribute(LazySession):
+    """
+    Stands in for one session attribute (sim, left, handles, ...) so module
+    code can keep using it as a global; the session connects on first use.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def _target(self):
+        return getattr(get_session(), self._name)
+
+    def __call__(self, *args, **kwargs):
+        return self._target()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<session {self._name}>"
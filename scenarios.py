@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Scenario files: pre-sampled object layouts for the LABOR Agent tasks
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import argparse
+
+import numpy as np
+
+"""
+Scenario structure:
+sample   -- draw the layouts of one task type in one vectorized NumPy pass, with the ranges of the task resets
+validate -- keep layouts whose objects are spaced apart and reachable by at least one arm
+save     -- one float64 array per task and type in a compressed .npz file, together with the seed
+reset    -- a task created with a scenario file takes the layout of episode `index` instead of sampling it
+"""
+
+MIN_SPACING = 0.1
+CUP_Z, APPLE_Z, BANANA_Z, BOWL_Z = 0.86, 0.82, 0.81, 0.81
+
+# ServeWater: ranges of the blue cup's x and y and of the yellow cup's y, as in ServeWaterTask.reset.
+CUP_RANGES = {
+    'both_right':             ((0.3, 0.45), (-0.45, -0.3), (-0.45, -0.2)),
+    'both_left':              ((0.4, 0.45), (0.3, 0.45), (0.2, 0.45)),
+    'left_blue_right_yellow': ((0.4, 0.45), (0.3, 0.45), (-0.45, -0.2)),
+    'left_yellow_right_blue': ((0.3, 0.45), (-0.45, -0.3), (0.2, 0.45)),
+}
+# ServeFruit: candidate (apple x, apple y, banana x, banana y) and the bowl side, as in ServeFruitTask.reset.
+SAME_FRUITS = ((0.25, 0.5, 0.45, 0.6), (0.25, -0.5, 0.45, -0.6))
+DIFF_FRUITS = ((0.45, -0.6, 0.45, 0.6), (0.45, 0.55, 0.45, -0.6))
+FRUIT_LAYOUTS = {
+    'same_fruits_same_bowl': (SAME_FRUITS, 'apple'),
+    'same_fruits_diff_bowl': (SAME_FRUITS, 'opposite'),
+    'diff_fruit_left_bowl':  (DIFF_FRUITS, 'left'),
+    'diff_fruit_right_bowl': (DIFF_FRUITS, 'right'),
+}
+TASK_TYPES = {'ServeWater': list(CUP_RANGES), 'ServeFruit': list(FRUIT_LAYOUTS)}
+# Columns of the layout arrays.
+COLUMNS = {'ServeWater': ('x1', 'y1', 'x2', 'y2'), 'ServeFruit': ('x1', 'y1', 'x2', 'y2', 'x3', 'y3', 'y3_out')}
+
+
+def sample_serve_water(task_type, n, rng):
+    (x_low, x_high), (y1_low, y1_high), (y2_low, y2_high) = CUP_RANGES[task_type]
+    x1 = np.round(rng.uniform(x_low, x_high, n), 2)
+    y1 = np.round(rng.uniform(y1_low, y1_high, n), 2)
+    y2 = np.round(rng.uniform(y2_low, y2_high, n), 2)
+    x2 = np.minimum(0.6, x1 + 0.2)
+    layouts = np.stack([x1, y1, x2, y2], axis=1)
+    # The rejection test of the reset loop.
+    return layouts[np.abs(y1) - np.abs(y2) >= 0.15]
+
+def sample_serve_fruit(task_type, n, rng, jitter=0.0):
+    candidates, bowl = FRUIT_LAYOUTS[task_type]
+    fruits = np.array(candidates)[rng.integers(0, len(candidates), n)]
+    if jitter:
+        fruits = np.round(fruits + rng.uniform(-jitter, jitter, fruits.shape), 2)
+    if bowl == 'apple':
+        side = np.where(fruits[:, 1] > 0, 1.0, -1.0)
+    elif bowl == 'opposite':
+        side = np.where(fruits[:, 1] > 0, -1.0, 1.0)
+    else:
+        side = np.full(n, 1.0 if bowl == 'left' else -1.0)
+    return np.column_stack([fruits, np.full(n, 0.6), 0.3 * side, 0.4 * side])
+
+def object_positions(task_name, layouts):
+    """World positions of the objects of every layout, shape (n, objects, 3)."""
+    n = len(layouts)
+    if task_name == 'ServeWater':
+        x1, y1, x2, y2 = layouts.T
+        return np.stack([np.column_stack([x1, y1, np.full(n, CUP_Z)]), np.column_stack([x2, y2, np.full(n, CUP_Z)])], axis=1)
+    x1, y1, x2, y2, x3, y3, _ = layouts.T
+    return np.stack([np.column_stack([x1, y1, np.full(n, APPLE_Z)]), np.column_stack([x2, y2, np.full(n, BANANA_Z)]),
+                     np.column_stack([x3, y3, np.full(n, BOWL_Z)])], axis=1)
+
+def valid_layouts(task_name, layouts, reach=None):
+    """Mask of the layouts whose objects are at least MIN_SPACING apart and, with reach (left, right maps), reachable."""
+    positions = object_positions(task_name, layouts)
+    valid = np.ones(len(layouts), dtype=bool)
+    for i in range(positions.shape[1]):
+        for j in range(i + 1, positions.shape[1]):
+            valid &= np.linalg.norm(positions[:, i, :2] - positions[:, j, :2], axis=1) >= MIN_SPACING
+        if reach is not None:
+            valid &= reach[0].reachable_points(positions[:, i]) | reach[1].reachable_points(positions[:, i])
+    return valid
+
+def generate(task_name, task_type, n, rng, reach=None, jitter=0.0):
+    """n valid layouts of one task type; rejected layouts are replaced by sampling again."""
+    layouts = np.empty((0, len(COLUMNS[task_name])))
+    while len(layouts) < n:
+        if task_name == 'ServeWater':
+            batch = sample_serve_water(task_type, 2 * n, rng)
+        else:
+            batch = sample_serve_fruit(task_type, 2 * n, rng, jitter)
+        batch = batch[valid_layouts(task_name, batch, reach)]
+        if len(batch) == 0:
+            raise ValueError(f"No valid layout could be sampled for {task_name}/{task_type}.")
+        layouts = np.concatenate([layouts, batch])
+    return layouts[:n]
+
+
+class Scenarios():
+    """The layouts of a scenario file, by task, type and episode index."""
+    def __init__(self, scenario_file):
+        self.scenario_file = scenario_file
+        with np.load(scenario_file) as data:
+            self.seed = int(data['seed'])
+            self.layouts = {name: data[name] for name in data.files if name != 'seed'}
+
+    def layout(self, task_name, task_type, index):
+        layouts = self.layouts.get(f'{task_name}.{task_type}')
+        if layouts is None:
+            raise KeyError(f"The scenario file {self.scenario_file} has no layouts for {task_name}/{task_type}.")
+        if not 0 <= index < len(layouts):
+            raise IndexError(f"The scenario file {self.scenario_file} has {len(layouts)} layouts for {task_name}/{task_type}, not {index + 1}.")
+        return [float(value) for value in layouts[index]]
+
+    def __len__(self):
+        return min(len(layouts) for layouts in self.layouts.values())
+
+
+def main(args):
+    reach = None
+    if args.check_reach:
+        from reachability import get_reachability
+        reach = (get_reachability('left'), get_reachability('right'))
+    rng = np.random.default_rng(args.seed)
+    layouts = {}
+    for task_name in args.tasks:
+        for task_type in TASK_TYPES[task_name]:
+            layouts[f'{task_name}.{task_type}'] = generate(task_name, task_type, args.episodes, rng, reach, args.jitter)
+    np.savez_compressed(args.output, seed=args.seed, **layouts)
+    print(f"{args.episodes} layouts for each of {list(layouts)} written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scenario Parameters")
+    parser.add_argument('--tasks', type=str, nargs='+', default=['ServeWater', 'ServeFruit'], choices=list(TASK_TYPES), help="Which tasks to generate layouts for")
+    parser.add_argument('--episodes', type=int, default=1000, help="How many layouts per task type")
+    parser.add_argument('--seed', type=int, default=1234, help="Seed of the layout sampling")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random offset (m) added to the fruit positions of ServeFruit")
+    parser.add_argument('--check_reach', action='store_true', default=False, help="Also require every object to be in reach of an arm")
+    parser.add_argument('--output', type=str, default='./scenarios.npz', help="Scenario file to write")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Batched scene-state queries for the LABOR Agent on NICOL Bimanual Robot
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import time
+
+SNAPSHOT_SCRIPT = """return (function()
+    local objects, sensors, checks = {%s}, {%s}, {%s}
+    local positions, detections, detected = {}, {}, {}
+    for i = 1, #objects do
+        positions[i] = sim.getObjectPosition(objects[i], sim.handle_world)
+    end
+    for i = 1, #sensors do
+        local result, distance, point, detected = sim.checkProximitySensor(sensors[i], sim.handle_all)
+        detections[i] = {result, detected or -1}
+    end
+    for i = 1, #checks do
+        detected[i] = sim.checkProximitySensor(checks[i][1], checks[i][2])
+    end
+    return {positions, detections, detected}
+end)()"""
+
+
+class SceneReader():
+    """
+    Reads both EEF poses, both palm sensors and all tracked task objects as one
+    snapshot. Object positions and sensor states come back from a single
+    sandbox-script call; if the simulator does not support it, they are read
+    one by one. The snapshot is reused until invalidate() is called, which the
+    coordinator does whenever the arms act.
+
+    The (sensor, object) pairs given as `checks` to track() are tested in the
+    same call; 'checks' in the snapshot holds one bool per pair. The latest
+    snapshot is kept after invalidate() for last_pose().
+    """
+    def __init__(self, sim, handles, left, right, left_sensor, right_sensor):
+        self.sim = sim
+        self.handles = handles
+        self.left = left
+        self.right = right
+        self.sensors = [left_sensor, right_sensor]
+        self.object_names = []
+        self.checks = []
+        self.script = None
+        self.batched = True
+        self.cached = None
+        self.last = None
+        self.last_time = None
+
+    def track(self, object_names, checks=()):
+        self.object_names = [name for name in object_names if self.handles.find(name) is not None]
+        self.checks = [(sensor, name) for sensor, name in checks if self.handles.find(sensor) is not None and self.handles.find(name) is not None]
+        self.script = None
+        self.cached = None
+
+    def invalidate(self):
+        self.cached = None
+
+    def snapshot(self):
+        if self.cached is None:
+            self.cached = self._read()
+            self.last, self.last_time = self.cached, time.perf_counter()
+        return self.cached
+
+    def last_pose(self, side):
+        """EEF position of one hand in the latest snapshot and its age in seconds, or None; reads nothing from the simulator."""
+        if self.last is None:
+            return None
+        return self.last[side + '_eef'][0], time.perf_counter() - self.last_time
+
+    def _read(self):
+        left_pose, right_pose = self.left.get_eef_pose(), self.right.get_eef_pose()
+        object_handles = [self.handles.get(name) for name in self.object_names]
+        check_handles = [(self.handles.get(sensor), self.handles.get(name)) for sensor, name in self.checks]
+        positions, detections, detected = None, None, None
+        if self.batched:
+            if self.script is None:
+                self.script = SNAPSHOT_SCRIPT % (','.join(str(h) for h in object_handles), ','.join(str(h) for h in self.sensors),
+                                                 ','.join('{%d,%d}' % pair for pair in check_handles))
+            try:
+                _, (positions, detections, detected) = self.sim.executeScriptString(self.script, self.sim.scripttype_sandboxscript)
+            except Exception as e:
+                print("Batched scene query is not available, reading the scene one call at a time:", e)
+                self.batched = False
+        if positions is None:
+            positions = [self.sim.getObjectPosition(h, self.sim.handle_world) for h in object_handles]
+            detections = []
+            for sensor in self.sensors:
+                result = self.sim.checkProximitySensor(sensor, self.sim.handle_all)
+                detections.append([result[0], result[3] if result[0] else -1])
+            detected = [self.sim.checkProximitySensor(sensor, handle)[0] for sensor, handle in check_handles]
+        return {
+            'left_eef': (left_pose.position.as_list(), [left_pose.orientation.x, left_pose.orientation.y, left_pose.orientation.z, left_pose.orientation.w]),
+            'right_eef': (right_pose.position.as_list(), [right_pose.orientation.x, right_pose.orientation.y, right_pose.orientation.z, right_pose.orientation.w]),
+            'left_sensor': tuple(detections[0]),
+            'right_sensor': tuple(detections[1]),
+            'objects': dict(zip(self.object_names, [list(p) for p in positions])),
+            'checks': [bool(result) for result in detected],
+        }
+
+    def position(self, name):
+        objects = self.snapshot()['objects']
+        if name in objects:
+            return objects[name]
+        return self.handles.position(name)
+
+
+CAPTURE_SCRIPT = """return (function()
+    local roots = {%s}
+    local objects, parents, poses, statics = {}, {}, {}, {}
+    for r = 1, #roots do
+        local tree = sim.getObjectsInTree(roots[r])
+        for i = 1, #tree do
+            local n = #objects + 1
+            objects[n] = tree[i]
+            parents[n] = sim.getObjectParent(tree[i])
+            poses[n] = sim.getObjectPose(tree[i], sim.handle_parent)
+            statics[n] = -1
+            if sim.getObjectType(tree[i]) == sim.object_shape_type then
+                statics[n] = sim.getObjectInt32Param(tree[i], sim.shapeintparam_static)
+            end
+        end
+    end
+    local joints = sim.getObjectsInTree(sim.handle_scene, sim.object_joint_type)
+    local positions = {}
+    for i = 1, #joints do
+        positions[i] = sim.getJointPosition(joints[i])
+    end
+    return {objects, parents, poses, statics, joints, positions}
+end)()"""
+
+RESTORE_SCRIPT = """return (function()
+    local objects, parents, poses, statics = %s, %s, %s, %s
+    local joints, positions, overrides = %s, %s, %s
+    for i = 1, #objects do
+        sim.setObjectParent(objects[i], parents[i], true)
+    end
+    for i = 1, #objects do
+        sim.setObjectPose(objects[i], sim.handle_parent, poses[i])
+        if statics[i] >= 0 then
+            sim.setObjectInt32Param(objects[i], sim.shapeintparam_static, statics[i])
+        end
+    end
+    for i = 1, #overrides do
+        sim.setObjectPose(overrides[i][1], sim.handle_world, overrides[i][2])
+    end
+    for i = 1, #objects do
+        if statics[i] >= 0 then
+            sim.resetDynamicObject(objects[i])
+        end
+    end
+    for i = 1, #joints do
+        sim.setJointPosition(joints[i], positions[i])
+        pcall(sim.setJointTargetPosition, joints[i], positions[i])
+    end
+    return #objects
+end)()"""
+
+
+def lua_table(values):
+    if isinstance(values, (list, tuple)):
+        return '{' + ','.join(lua_table(value) for value in values) + '}'
+    if float(values).is_integer() and not isinstance(values, float):
+        return str(int(values))
+    return repr(float(values))
+
+
+class SceneState():
+    """
+    The initial state of the task models (every object in their trees with its
+    parent, pose relative to the parent and static flag) and of all robot
+    joints, captured once per task. restore() puts all of it back in a single
+    sandbox-script call, together with the new poses of the episode layout,
+    so an episode reset needs no simulation restart and leaves nothing
+    attached to the palms. Without script support it falls back to one call
+    per object and sends the arms home through `home`.
+    """
+    def __init__(self, sim, roots, home=None):
+        self.sim = sim
+        self.roots = roots
+        self.home = home
+        self.batched = True
+        self.state = None
+
+    def capture(self):
+        state = None
+        if self.batched:
+            try:
+                _, state = self.sim.executeScriptString(CAPTURE_SCRIPT % ','.join(str(root) for root in self.roots), self.sim.scripttype_sandboxscript)
+            except Exception as e:
+                print("Batched scene capture is not available, capturing the scene one call at a time:", e)
+                self.batched = False
+        if state is None:
+            objects = [h for root in self.roots for h in self.sim.getObjectsInTree(root)]
+            statics = [self.sim.getObjectInt32Param(h, self.sim.shapeintparam_static) if self.sim.getObjectType(h) == self.sim.object_shape_type else -1
+                       for h in objects]
+            joints = self.sim.getObjectsInTree(self.sim.handle_scene, self.sim.object_joint_type)
+            state = [objects, [self.sim.getObjectParent(h) for h in objects], [self.sim.getObjectPose(h, self.sim.handle_parent) for h in objects],
+                     statics, joints, [self.sim.getJointPosition(j) for j in joints]]
+        self.state = [list(part) for part in state]
+        return self.state
+
+    def restore(self, poses=()):
+        """Restore the captured state, then place the objects of `poses` ((handle, world pose) pairs)."""
+        objects, parents, local_poses, statics, joints, positions = self.state
+        if self.batched:
+            script = RESTORE_SCRIPT % tuple(lua_table(part) for part in (objects, parents, local_poses, statics, joints, positions, list(poses)))
+            try:
+                self.sim.executeScriptString(script, self.sim.scripttype_sandboxscript)
+                return
+            except Exception as e:
+                print("Batched scene restore is not available, restoring the scene one call at a time:", e)
+                self.batched = False
+        for handle, parent in zip(objects, parents):
+            self.sim.setObjectParent(handle, parent, True)
+        for handle, pose, static in zip(objects, local_poses, statics):
+            self.sim.setObjectPose(handle, self.sim.handle_parent, pose)
+            if static >= 0:
+                self.sim.setObjectInt32Param(handle, self.sim.shapeintparam_static, static)
+        for handle, pose in poses:
+            self.sim.setObjectPose(handle, self.sim.handle_world, pose)
+        for handle, static in zip(objects, statics):
+            if static >= 0:
+                self.sim.resetDynamicObject(handle)
+        for joint, position in zip(joints, positions):
+            self.sim.setJointPosition(joint, position)
+        if not joints and self.home is not None:
+            self.home()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Persistent per-arm skill workers for the LABOR Agent on NICOL Bimanual Robot
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import asyncio
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict
+
+from episode_metrics import metrics
+from robot_session import get_session
+
+path = os.path.dirname(os.path.abspath(__file__))
+CONTROLLER_SCRIPT = os.path.join(path, 'nicol_controller.py')
+
+# Deadline of each skill in seconds, with margin for CoppeliaSim running in real time.
+SKILL_TIMEOUTS = {'move_to': 60, 'move_above': 60, 'move_and_grasp': 90, 'push_to': 90, 'hold_up': 90,
+                  'pour_out': 60, 'release': 30, 'reset': 60, 'wait': 15}
+DEFAULT_SKILL_TIMEOUT = 90
+# How long a worker may take to acknowledge a barrier request.
+ARM_TIMEOUT = 10
+# How long a new worker may take to connect to the simulator and announce itself.
+START_TIMEOUT = 60
+
+
+class SkillWorker():
+    """
+    One long-lived `nicol_controller.py --serve` process per arm. The process
+    connects to the simulator once; every skill is then a single JSON request
+    and response over its stdin/stdout pipes.
+
+    For the asyncio coordinator, run() awaits a blocking call on the arm's own
+    thread. A run that times out or is cancelled cancels the skill: the
+    process is killed, so the arm gets no further targets, and the next
+    request starts a fresh one.
+    """
+    def __init__(self, side):
+        self.side = side
+        self.proc = None
+        self.request_id = 0
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{side}_arm')
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        if self.alive():
+            return
+        with metrics.span('worker_start'):
+            self.proc = subprocess.Popen([sys.executable, CONTROLLER_SCRIPT, f"--side={self.side}", "--serve"],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1, cwd=path,
+                                         env=dict(os.environ, **get_session().env()))
+            # The worker announces itself once the simulator connection is up.
+            self._read()
+
+    def send(self, command, para, hand_state, finger_state, barrier=False, scene=None):
+        self.start()
+        self.request_id += 1
+        request = {'id': self.request_id, 'command': command, 'para': para,
+                   'hand_state': hand_state, 'finger_state': finger_state, 'barrier': barrier, 'scene': scene}
+        self._write(request)
+        self.pending = request
+        return self.request_id
+
+    def wait_armed(self):
+        # A barrier request is acknowledged before the skill starts.
+        response = self._read()
+        if not response.get('armed'):
+            raise RuntimeError(f"The {self.side} skill worker did not arm for command {self.request_id}.")
+
+    def go(self):
+        self._write({'command': 'go', 'id': self.request_id})
+
+    def receive(self):
+        response = self._read()
+        if not response['ok']:
+            raise RuntimeError(f"The {self.side} skill worker failed: {response['error']}")
+        return response['result']
+
+    def call(self, command, para, hand_state, finger_state, scene=None):
+        self.send(command, para, hand_state, finger_state, scene=scene)
+        return self.receive()
+
+    def finish(self):
+        # Release an armed skill and wait for its result.
+        self.go()
+        return self.receive()
+
+    async def run(self, function, *args, timeout=None):
+        """Await function(*args) on this arm's thread; on timeout or cancellation the skill is cancelled."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self.executor, function, *args), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.cancel()
+            raise
+
+    def cancel(self):
+        if self.alive():
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def _write(self, message):
+        self.proc.stdin.write(json.dumps(message) + '\n')
+        self.proc.stdin.flush()
+
+    def _read(self):
+        line = self.proc.stdout.readline()
+        if not line:
+            self.proc = None
+            raise RuntimeError(f"The {self.side} skill worker exited unexpectedly.")
+        return json.loads(line)
+
+    def stop(self):
+        if not self.alive():
+            return
+        try:
+            self._write({'command': 'shutdown'})
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+        self.proc = None
+
+
+class LocalSkillWorker(SkillWorker):
+    """
+    Runs the skills inside the coordinator process. Used with the offline
+    backend, whose simulated scene only exists in this process. Skills hold
+    the session lock while they run; a cancelled skill cannot be interrupted,
+    it runs to its end and its result is dropped.
+    """
+    def alive(self):
+        return True
+
+    def start(self):
+        import nicol_controller
+        self.controller = nicol_controller
+
+    def send(self, command, para, hand_state, finger_state, barrier=False, scene=None):
+        self.start()
+        self.request_id += 1
+        self.pending = {'id': self.request_id, 'command': command, 'para': para,
+                        'hand_state': hand_state, 'finger_state': finger_state, 'scene': scene}
+        self.response = None
+        if not barrier:
+            self.go()
+        return self.request_id
+
+    def wait_armed(self):
+        pass
+
+    def go(self):
+        request = self.pending
+        with get_session().lock:
+            self.controller.handles.sync(request['scene'])
+            try:
+                result = self.controller.run_command(self.side, request['command'], request['para'], request['hand_state'], request['finger_state'])
+                self.response = {'id': request['id'], 'ok': True, 'result': asdict(result)}
+            except Exception as e:
+                self.response = {'id': request['id'], 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    def _read(self):
+        return self.response
+
+    def cancel(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+SKILL_WORKERS = {}
+
+def get_worker(side):
+    if side not in SKILL_WORKERS:
+        if get_session().backend == 'offline':
+            SKILL_WORKERS[side] = LocalSkillWorker(side)
+        else:
+            SKILL_WORKERS[side] = SkillWorker(side)
+    return SKILL_WORKERS[side]
+
+def skill_timeout(command):
+    return SKILL_TIMEOUTS.get(command, DEFAULT_SKILL_TIMEOUT)
+
+def configure_timeouts(overrides):
+    """Set skill deadlines from 'command=seconds' strings; 'all=seconds' sets every skill, 0 disables the deadline."""
+    for override in overrides:
+        command, _, seconds = override.partition('=')
+        if command not in SKILL_TIMEOUTS and command != 'all':
+            raise ValueError(f"Unknown skill {command} in the timeout {override}, choose from {list(SKILL_TIMEOUTS)} or all.")
+        seconds = float(seconds) if float(seconds) > 0 else None
+        for name in (SKILL_TIMEOUTS if command == 'all' else [command]):
+            SKILL_TIMEOUTS[name] = seconds
+
+
+class SkillWatchdog():
+    """
+    Keeps the running skill of each arm with its deadline. report() says
+    which skill stalled and where its hand was last seen, taken from the
+    coordinator's latest scene snapshot, so it needs no simulator call. A
+    daemon thread also reports skills still running `grace` seconds after
+    their deadline, i.e. whose cancellation is stuck as well.
+    """
+    def __init__(self, interval=5.0, grace=30.0):
+        self.interval = interval
+        self.grace = grace
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @contextmanager
+    def watch(self, side, command, para, deadline):
+        entry = {'side': side, 'command': command, 'para': para, 'deadline': deadline, 'start': time.perf_counter(), 'reported': False}
+        with self.lock:
+            self.active[side] = entry
+            if self.thread is None and deadline is not None:
+                self.thread = threading.Thread(target=self._loop, name='skill_watchdog', daemon=True)
+                self.thread.start()
+        try:
+            yield entry
+        finally:
+            with self.lock:
+                if self.active.get(side) is entry:
+                    del self.active[side]
+
+    def report(self, entry):
+        elapsed = time.perf_counter() - entry['start']
+        report = f"The {entry['side']} skill {entry['command']} {entry['para']} failed: it stalled without a result for {elapsed:.1f} s (deadline {entry['deadline']} s)"
+        session = get_session()
+        last = session.scene.last_pose(entry['side']) if session.connected else None
+        if last is None:
+            return report + ", no known hand pose."
+        position, age = last
+        return report + f", the {entry['side']} hand was last seen at {[round(p, 3) for p in position]} {age:.1f} s ago."
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self.lock:
+                stuck = [entry for entry in self.active.values()
+                         if entry['deadline'] is not None and not entry['reported'] and now - entry['start'] > entry['deadline'] + self.grace]
+                for entry in stuck:
+                    entry['reported'] = True
+            for entry in stuck:
+                print('Watchdog:', self.report(entry), 'It could not be cancelled.')
+
+watchdog = SkillWatchdog()
+
+
+def failed_result(side, request, message):
+    # A failed skill leaves the hand in the state it was sent with.
+    return {'side': side, 'message': message, 'hand': request[2], 'finger': request[3], 'grasped': None,
+            'duration': 0.0, 'settle_steps': 0, 'settle_time': 0.0, 'sim_calls': 0, 'sim_time': 0.0}
+
+async def recover(worker, request, scene, report):
+    """After a cancelled skill, bring the arm back to a safe state with the reset skill (home pose, hand open)."""
+    metrics.count('skill_timeouts')
+    print('Watchdog:', report)
+    try:
+        result = await worker.run(worker.call, 'reset', {}, request[2], request[3], scene, timeout=skill_timeout('reset'))
+    except (asyncio.TimeoutError, RuntimeError):
+        return failed_result(worker.side, request, f"{report} It was cancelled, and the arm could not be reset.")
+    return dict(result, message=f"{report} It was cancelled, and the arm was reset to its home pose with the hand open.")
+
+async def run_skill(worker, request, scene, function, *args):
+    """Await one skill under its deadline; a stalled skill is cancelled and its arm recovered."""
+    with watchdog.watch(worker.side, request[0], request[1], skill_timeout(request[0])) as entry:
+        try:
+            return await worker.run(function, *args, timeout=entry['deadline'])
+        except RuntimeError as e:
+            return failed_result(worker.side, request, str(e))
+        except asyncio.TimeoutError:
+            report = watchdog.report(entry)
+    return await recover(worker, request, scene, report)
+
+async def start_worker(worker):
+    """Start the worker of an arm under START_TIMEOUT; returns why it did not come up, or None."""
+    try:
+        await worker.run(worker.start, timeout=START_TIMEOUT)
+    except asyncio.TimeoutError:
+        return f"The {worker.side} skill worker did not come up within {START_TIMEOUT} s."
+    except RuntimeError as e:
+        return str(e)
+    return None
+
+async def dispatch_both_async(left_request, right_request, stage='sync', scene=None):
+    """
+    Run one command on each arm. Both workers are armed first and released
+    together, so the skills start at the same moment. For the async_left and
+    async_right stages the leading hand finishes before the other one starts.
+    Each request is (command, para, hand_state, finger_state); each result is
+    the SkillResult record of nicol_controller.py as a dict. `scene` is the
+    state() of the coordinator's HandleRegistry, so workers drop stale handles
+    and resolve names in the same task model.
+
+    Every skill is awaited on its arm's thread, so the event loop stays free,
+    e.g. for scene queries, while the arms move. A skill without a result
+    within its deadline (SKILL_TIMEOUTS) is cancelled, its arm is reset and
+    the result reports the stall; a worker that does not start within
+    START_TIMEOUT fails both skills. Cancelling this coroutine cancels the
+    skills of both arms.
+    """
+    left_worker, right_worker = get_worker('left'), get_worker('right')
+    errors = await asyncio.gather(start_worker(left_worker), start_worker(right_worker))
+    if any(errors):
+        # Neither arm has moved yet; without both workers neither skill is run.
+        metrics.count('worker_start_failures')
+        report = ' '.join(error for error in errors if error)
+        print('Watchdog:', report)
+        return (failed_result('left', left_request, f"The skills failed: {report}"),
+                failed_result('right', right_request, f"The skills failed: {report}"))
+    if stage == 'async_left':
+        left_result = await run_skill(left_worker, left_request, scene, left_worker.call, *left_request, scene)
+        right_result = await run_skill(right_worker, right_request, scene, right_worker.call, *right_request, scene)
+        return left_result, right_result
+    if stage == 'async_right':
+        right_result = await run_skill(right_worker, right_request, scene, right_worker.call, *right_request, scene)
+        left_result = await run_skill(left_worker, left_request, scene, left_worker.call, *left_request, scene)
+        return left_result, right_result
+    try:
+        await asyncio.gather(left_worker.run(left_worker.send, *left_request, True, scene, timeout=ARM_TIMEOUT),
+                             right_worker.run(right_worker.send, *right_request, True, scene, timeout=ARM_TIMEOUT))
+        await asyncio.gather(left_worker.run(left_worker.wait_armed, timeout=ARM_TIMEOUT),
+                             right_worker.run(right_worker.wait_armed, timeout=ARM_TIMEOUT))
+    except (asyncio.TimeoutError, RuntimeError) as e:
+        # An arm that cannot even take its request is stuck; neither skill is released.
+        left_worker.cancel()
+        right_worker.cancel()
+        report = f"The skills failed: the workers could not be armed ({type(e).__name__}: {e})."
+        return tuple(await asyncio.gather(recover(left_worker, left_request, scene, report),
+                                          recover(right_worker, right_request, scene, report)))
+    return tuple(await asyncio.gather(run_skill(left_worker, left_request, scene, left_worker.finish),
+                                      run_skill(right_worker, right_request, scene, right_worker.finish)))
+
+def dispatch_both(left_request, right_request, stage='sync', scene=None):
+    """dispatch_both_async() for callers without an event loop."""
+    return asyncio.run(dispatch_both_async(left_request, right_request, stage, scene))
+
+def stop_workers():
+    for worker in SKILL_WORKERS.values():
+        worker.stop()
+
+atexit.register(stop_workers)
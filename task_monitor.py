@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Success and failure monitoring of the LABOR Agent tasks during an episode
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import numpy as np
+
+"""
+Monitor structure:
+success -- every success sensor of the task detects its object, read in the scene snapshot
+failure -- a predicate that cannot be undone by the robot holds, e.g. an object fell off the table
+failure -- 'outside' only counts for an object at rest, so e.g. a ball still on its way into a cup is no spill
+update  -- evaluated after each labor_control step from the (batched, cached) scene snapshot
+stop    -- the planner and labor_plan end the episode as soon as there is an outcome
+"""
+
+# Failure predicates of a TaskSpec:
+#   ('below', obj, z, message)                      -- obj is lower than z
+#   ('outside', obj, containers, radius, message)   -- obj is at rest farther than radius from every container
+
+# An object is at rest once it moved less than this (m) since the previous update.
+REST_DISTANCE = 0.005
+
+def failed(predicate, positions, previous=None):
+    """
+    The message of a failure predicate if it holds for the object positions,
+    else None. `previous` are the positions of the update before, which tell
+    whether an object is at rest.
+    """
+    kind, name = predicate[0], predicate[1]
+    if name not in positions:
+        return None
+    if kind == 'below':
+        _, _, z, message = predicate
+        return message if positions[name][2] < z else None
+    if kind == 'outside':
+        _, _, containers, radius, message = predicate
+        if previous is None or name not in previous or np.linalg.norm(np.subtract(positions[name], previous[name])) > REST_DISTANCE:
+            return None
+        containers = [positions[container] for container in containers if container in positions]
+        if containers and min(np.linalg.norm(np.array(positions[name]) - np.array(container)) for container in containers) > radius:
+            return message
+        return None
+    raise ValueError(f"Unknown failure predicate {kind}.")
+
+
+class TaskMonitor():
+    """
+    Decides after every step whether the episode is already over: 'success'
+    once all success sensors detect their objects, 'failure' once a failure
+    predicate holds. Both are read from the scene snapshot, which tracks the
+    objects() and sensor_checks() of the monitor, so an update costs at most
+    one batched scene query, which the next tool call reuses.
+    """
+    def __init__(self, scene, success=(), failures=()):
+        self.scene = scene
+        self.success = list(success)
+        self.failures = list(failures)
+        self.reset()
+
+    def objects(self):
+        names = []
+        for predicate in self.failures:
+            names.append(predicate[1])
+            if predicate[0] == 'outside':
+                names.extend(predicate[2])
+        return list(dict.fromkeys(names))
+
+    def sensor_checks(self):
+        return [(sensor, name) for sensor, name, _ in self.success]
+
+    def reset(self):
+        self.outcome = None
+        self.reason = None
+        self.steps = 0
+        self.previous = None
+
+    def update(self):
+        """Evaluate the predicates on the current scene; returns the outcome ('success', 'failure' or None)."""
+        if self.outcome is not None:
+            return self.outcome
+        self.steps += 1
+        snapshot = self.scene.snapshot()
+        previous, self.previous = self.previous, dict(snapshot['objects'])
+        for predicate in self.failures:
+            reason = failed(predicate, snapshot['objects'], previous)
+            if reason is not None:
+                self.outcome, self.reason = 'failure', reason
+                return self.outcome
+        if self.success and len(snapshot['checks']) == len(self.success) and all(snapshot['checks']):
+            self.outcome, self.reason = 'success', 'The task is accomplished.'
+        return self.outcome
+
+    def stop(self):
+        """The reason to end the episode, or None to go on; used as the planner's stop condition."""
+        return self.reason
@@ -8,45 +8,162 @@ Copyright 2024, Planet Earth
 import random
 import os
 from llm_coordinator import *
+from dataclasses import dataclass, field
+from scene_snapshot import SceneState
+from task_monitor import TaskMonitor
 path = os.path.dirname(os.path.abspath(__file__))
 random.seed(1234)
 
+# Parked models wait below the floor.
+PARK_POSE = [0, 0, -10, 0, 0, 0, 1]
+# The table top is at about 0.8 m; task objects below this height have fallen off it.
+TABLE_DROP_Z = 0.6
+
 """
 Task design structure:
-task -- load model
+task -- registered as a TaskSpec (model, objects, task types, success sensors, description template)
+task -- load model once per session, park the models of the other tasks
 task -- add description
-task -- check success condition
+task -- check success condition, monitored after every step to end failed or accomplished episodes early
 task -- self run (hard-coded skill chains)
 """
 
+def remove_models(model_names):
+    # Drop other tasks' models from the scene, then forget the stale handles.
+    removed = False
+    for model_name in model_names:
+        model = handles.find(model_name)
+        if model is not None:
+            sim.removeModel(model)
+            removed = True
+    if removed:
+        handles.invalidate()
+
+def home_arms():
+    # Same home pose as the reset skill, for simulators whose joints cannot be restored directly.
+    left.set_joint_position_for_hand([-np.pi] * 5, block=True)
+    right.set_joint_position_for_hand([-np.pi] * 5, block=True)
+    left.set_joint_position([-1.57] + [0.] * 7, block=True)
+    right.set_joint_position([1.57] + [0.] * 7, block=True)
+
+# Task registry
+#########################################################################################
+@dataclass
+class TaskSpec:
+    name: str
+    model_file: str                 # .ttm in task_ttms/
+    model_root: str                 # alias of the model base
+    task_types: list
+    objects: dict                   # task attribute -> object name
+    static: list                    # shapes that stay put until grasped
+    preload: list
+    track: list                     # marked points, also listed in the description
+    success: list                   # (sensor, object, message when not detected)
+    failures: list                  # irrecoverable failure predicates, see task_monitor.py
+    description: str
+    short_description: str
+    task_class: type = None
+    remove: list = field(default_factory=list)  # other models that cannot share the scene
+
+
+class TaskModels():
+    """
+    The task models of the simulator session. Each .ttm is loaded once; when
+    another task is created, the models of the other tasks are parked instead
+    of removed: put back to their captured state, made invisible,
+    non-dynamic and undetectable through their model properties, and moved
+    below the floor. Switching back only restores the model properties and
+    the captured state.
+    """
+    def __init__(self):
+        self.states = {}
+        self.parked = {}
+
+    def activate(self, spec):
+        """Make the model of `spec` the only active one and return its SceneState."""
+        remove_models(spec.remove)
+        for other in TASKS.values():
+            if other.model_root == spec.model_root or other.model_root in self.parked:
+                continue
+            root = handles.find(other.model_root)
+            if root is not None:
+                if other.model_root not in self.states:
+                    self.prepare(other, root)
+                self.park(other.model_root, root)
+        if spec.model_root in self.parked:
+            self.unpark(spec.model_root)
+        elif spec.model_root not in self.states:
+            root = handles.find(spec.model_root)
+            if root is None:
+                root = sim.loadModel(path + '/task_ttms/' + spec.model_file)
+            self.prepare(spec, root)
+        handles.set_scope(spec.model_root, self.parked)
+        return self.states[spec.model_root]
+
+    def prepare(self, spec, root):
+        # Static flags first, so that the captured state starts every episode with them.
+        handles.set_scope(spec.model_root, self.parked)
+        for name in spec.static:
+            sim.setObjectInt32Parameter(handles.get(name), sim.shapeintparam_static, 1)
+        self.states[spec.model_root] = SceneState(sim, [root], home=home_arms)
+        self.states[spec.model_root].capture()
+
+    def park(self, model_root, root):
+        self.states[model_root].restore()
+        model_property = sim.getModelProperty(root)
+        sim.setModelProperty(root, model_property | sim.modelproperty_not_visible | sim.modelproperty_not_renderable
+                             | sim.modelproperty_not_collidable | sim.modelproperty_not_measurable | sim.modelproperty_not_detectable
+                             | sim.modelproperty_not_dynamic | sim.modelproperty_not_respondable)
+        sim.setObjectPose(root, sim.handle_world, PARK_POSE)
+        self.parked[model_root] = (root, model_property)
+
+    def unpark(self, model_root):
+        root, model_property = self.parked.pop(model_root)
+        sim.setModelProperty(root, model_property)
+        self.states[model_root].restore()
+
+models = TaskModels()
+
+
+class Task():
+    """A task built from its TaskSpec; subclasses sample the layout in reset() and run the skill chain in self_run()."""
+    def __init__(self, spec, scenarios=None):
+        self.spec = spec
+        self.name = spec.name
+        self.scenarios = scenarios
+        self.scene_state = models.activate(spec)
+        handles.preload(spec.preload)
+        self.monitor = TaskMonitor(scene, spec.success, spec.failures)
+        scene.track(list(dict.fromkeys(spec.track + self.monitor.objects())), self.monitor.sensor_checks())
+        for attribute, name in spec.objects.items():
+            setattr(self, attribute, handles.get(name))
+
+    def describe(self, **poses):
+        self.short_des = self.spec.short_description.format(**poses)
+        self.task_des = self.spec.description.format(marked=self.spec.track, **poses)
+
+    def check_success(self):
+        success = True
+        for sensor, obj, message in self.spec.success:
+            if not sim.checkProximitySensor(handles.get(sensor), handles.get(obj))[0]:
+                if message is not None:
+                    print(message)
+                success = False
+        return success
+
 #########################################################################################
-class ServeWaterTask():
-    def __init__(self) -> None:
-        try: sim.removeModel(sim.getObject('/Bowl_Apple_Banana'))
-        except Exception as e: pass
-        try:
-            self.blue_cup = sim.getObject("/Origin_blue_cup")
-            self.yellow_cup = sim.getObject("/Origin_yellow_cup")
-            self.ball = sim.getObject("/big_ball")
-            self.sensor_1 = sim.getObject("/yellow_cup_sensor")
-            self.sensor_2 = sim.getObject("/serve_point_sensor")
-        except Exception as e:
-            self.model_handle = sim.loadModel(path + '/task_ttms/ServeWater.ttm')
-            self.blue_cup = sim.getObject("/Origin_blue_cup")
-            self.yellow_cup = sim.getObject("/Origin_yellow_cup")
-            self.ball = sim.getObject("/big_ball")
-            self.sensor_1 = sim.getObject("/yellow_cup_sensor")
-            self.sensor_2 = sim.getObject("/serve_point_sensor")
-        self.name = "ServeWater"
-        sim.setObjectInt32Parameter(self.ball, sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/blue_cup_respondable"), sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/yellow_cup_respondable"), sim.shapeintparam_static, 1)
+class ServeWaterTask(Task):
+    def __init__(self, scenarios=None) -> None:
+        super().__init__(TASKS["ServeWater"], scenarios)
         self.reset(index=0, task_type = 'left_blue_right_yellow')
      
     def reset(self, index=None, task_type=None):
         # reset_global()
         z1 = z2 = 0.86
         x1 = x2 = y1 = y2 = 0
+        if self.scenarios is not None and index is not None:
+            # A pre-sampled layout already passes the test of the sampling loops below.
+            x1, y1, x2, y2 = self.scenarios.layout(self.name, task_type, index)
         # x1, y1, x2, y2 = 0.52, 0.43, 0.44, -0.33
         if task_type == 'both_right':
             while abs(y1)-abs(y2) < 0.15:
@@ -72,38 +189,14 @@ class ServeWaterTask():
                 x2, y2 = min(0.6, x1+0.2), round(random.uniform(0.2, 0.45),2)
             self.blue_spatial_relation = 'in the right area'
             self.yellow_spatial_relation = 'in the left area'
-        sim.setObjectPose(self.blue_cup, sim.handle_world, [x1, y1, z1, 0,0,0,1])
-        sim.setObjectPose(self.yellow_cup, sim.handle_world, [x2, y2, z2, 0,0,0,1])
-        sim.setObjectPose(self.ball, sim.handle_world, [x1, y1, z1+0.01, 0,0,0,1])
-        sim.setObjectInt32Parameter(self.ball, sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/blue_cup_respondable"), sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/yellow_cup_respondable"), sim.shapeintparam_static, 1)
+        self.scene_state.restore([(self.blue_cup, [x1, y1, z1, 0,0,0,1]),
+                                  (self.yellow_cup, [x2, y2, z2, 0,0,0,1]),
+                                  (self.ball, [x1, y1, z1+0.01, 0,0,0,1])])
+        scene.invalidate()
         self.blue_cup_pose =  [x1, y1, z1]
         self.yellow_cup_pose = [x2, y2, z2]
-        self.short_des = f"""blue_cup {[x1, y1, z1]} with water, yellow cup {[x2, y2, z2]} without water."""
-        self.task_des = f"""
-##Environment Setting: 
-There are two cups placed on the table:
-- One blue cup is filled with water, with the coordinate as {[x1, y1, z1]}
-- One yellow cup is empty, with the coordinate as {[x2, y2, z2]}
-
-- Marked points names are listed as: ['Origin_blue_cup', 'Origin_yellow_cup', 'yellow_cup', 'blue_cup', 'serve_point', 'overlap_area'], in which the name entity starts with "Origin_" indicates its initial position (not used for grasping), other names without this prefix are the current/dynamic positions during the task.
-- serve point is at [0.8, 0.0, 1.2], where the human user is waiting for the water.
-
-##Task:
-Pour the water from the blue cup into the yellow cup, put the blue cup back, and serve the water to the human user at the serve point. Do not release the cup at the serving point.
-
-"""
+        self.describe(blue=[x1, y1, z1], yellow=[x2, y2, z2])
 
-    def check_success(self):
-        cup_respond = sim.getObject("/yellow_cup_respondable")
-        detect_result_1 = sim.checkProximitySensor(self.sensor_1, self.ball)
-        detect_result_2 = sim.checkProximitySensor(self.sensor_2, cup_respond)
-        if detect_result_1[0] and detect_result_2[0]:
-            return True
-        else:
-            return False
-    
     def self_run(self):
         llm_coordinate = LABORControlTool()
         if self.blue_cup_pose[1] <0 and self.yellow_cup_pose[1] <0:
@@ -138,36 +231,14 @@ Pour the water from the blue cup into the yellow cup, put the blue cup back, and
 
 
 #########################################################################################
-class ServeFruitTask():
-    def __init__(self) -> None:
-        try: sim.removeModel(sim.getObject('/cups_with_balls'))
-        except Exception as e: pass
-        try: sim.removeModel(sim.getObject('/scissor'))
-        except Exception as e: pass
-        try:
-            self.bowl_object = sim.getObject("/Origin_bowl")
-            self.apple_object = sim.getObject("/Apple")
-            self.banana_object = sim.getObject("/Banana")
-            self.target_sensor = sim.getObject("/serve_point_sensor")
-        except Exception as e:
-            bowl_handle = sim.loadModel(path + '/task_ttms/ServeFruit.ttm')
-            self.bowl_object = sim.getObject("/Origin_bowl")
-            self.apple_object = sim.getObject("/Apple")
-            self.banana_object = sim.getObject("/Banana")
-            self.target_sensor = sim.getObject("/serve_point_sensor")
-        sim.setObjectInt32Parameter(sim.getObject("/Bowl_respondable"), sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/Apple"), sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(sim.getObject("/Banana"), sim.shapeintparam_static, 1)
+class ServeFruitTask(Task):
+    def __init__(self, scenarios=None) -> None:
+        super().__init__(TASKS["ServeFruit"], scenarios)
         reset_global()
-        self.name = "ServeFruit"
         self.reset(index=0, task_type = 'same_fruits_same_bowl')
 
     def reset(self, index=None, task_type=None):
         reset_global()
-        sim.setObjectInt32Parameter(sim.getObject("/Bowl_respondable"), sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(self.apple_object, sim.shapeintparam_static, 1)
-        sim.setObjectInt32Parameter(self.banana_object, sim.shapeintparam_static, 1)
-        # sim.setObjectInt32Parameter(self.bowl_object, sim.shapeintparam_static, 1)
         z1, z2, z3 = 0.82, 0.81, 0.81
         x1 = x2 = y1 = y2 = 0
         range1, range2 = (-0.65, -0.2), (0.2, 0.65)
@@ -178,7 +249,9 @@ class ServeFruitTask():
         chosen_coordinates_1 = random.choice([coordinates1, coordinates2])
         chosen_coordinates_2 = random.choice([coordinates3, coordinates4])
 
-        if task_type == 'same_fruits_same_bowl':
+        if self.scenarios is not None and index is not None:
+            x1, y1, x2, y2, x3, y3, y3_out = self.scenarios.layout(self.name, task_type, index)
+        elif task_type == 'same_fruits_same_bowl':
             x1, y1, x2, y2 = chosen_coordinates_1
             if y1 > 0:
                 x3, y3, y3_out = 0.6, 0.3, 0.4
@@ -198,43 +271,15 @@ class ServeFruitTask():
             x3, y3, y3_out = 0.6, -0.3, -0.4
         else:
             print("You choose the wrong task!")
-        sim.setObjectPose(self.apple_object, sim.handle_world, [x1, y1, z1, 0, 0, 0, 1])
-        sim.setObjectPose(self.banana_object, sim.handle_world, [x2, y2, z2, 0, 0, -4, 1])
-        sim.setObjectPose(self.bowl_object, sim.handle_world, [x3, y3, z3, 0, 0, 0, 1])
+        self.scene_state.restore([(self.apple_object, [x1, y1, z1, 0, 0, 0, 1]),
+                                  (self.banana_object, [x2, y2, z2, 0, 0, -4, 1]),
+                                  (self.bowl_object, [x3, y3, z3, 0, 0, 0, 1])])
         # x3, y3, z3 = sim.getObjectPose(self.bowl_object, -1)[0:3]
+        scene.invalidate()
         self.apple_pose = [x1, y1, z1]
         self.banana_pose = [x2, y2, z2]
         self.bowl_pose = [x3, y3, z3]
-        self.short_des = f" apple is at {[x1, y1, z1]}), banana is at {[x2, y2, z2]}, and bowl is at {[x3, y3, z3]}."
-        self.task_des = f"""\n
-## Environment Setting: 
-There are three objects at the table:
-- an apple is at {self.apple_pose}
-- a banana is at {self.banana_pose}
-- a large bowl is at {[x3, y3_out, z3]} (not graspable with one single hand) \n
-- serve point is at (0.6, 0.0, 1.0) in the middle air. \n
-- Marked points position are listed as: ['Origin_right_hand', 'Origin_left_hand', 'Apple', 'Banana', 'Bowl', 'overlap_area', 'serve_point'], in which the name entity starts with "Origin_" indicates its initial position, other names without this prefix are the current/dynamic positions during the task. 
-
-Task: 
-Grasp the fruits and release them to the bowl, and serve the bowl to the human user at serve point. 
-
-Notes:
-Do not release the bowl at the serve point. 
-Do not release the apple and banana in the overlap area.
-
-"""
-    def check_success(self):
-        apple_detected = sim.checkProximitySensor(self.target_sensor, self.apple_object)[0]
-        banana_detected = sim.checkProximitySensor(self.target_sensor, self.banana_object)[0]
-        if apple_detected == 0:
-            print('The apple is not lifted with the bowl!')
-        if banana_detected == 0:
-            print('The banana is not lifted with the bowl!')
-        if apple_detected>0 and banana_detected>0:
-            return True
-        else:
-            return False
-    
+        self.describe(apple=self.apple_pose, banana=self.banana_pose, bowl=self.bowl_pose, bowl_side=[x3, y3_out, z3])
     def self_run(self):
         llm_coordinate = LABORControlTool()
         if self.bowl_pose[1] < 0:
@@ -272,11 +317,71 @@ Do not release the apple and banana in the overlap area.
         llm_coordinate._run('hold_up', {'obj_name':'Bowl'}, 'hold_up', {'obj_name':'Bowl'})
         llm_coordinate._run('move_to', {'obj_name':'serve_point'}, 'move_to', {'obj_name':'serve_point'})
 
-def create_task(task_name):
-    if task_name == "ServeWater":
-        return ServeWaterTask()
-    elif task_name == "ServeFruit":
-        return ServeFruitTask()
-    else:
+SERVE_WATER_DESCRIPTION = """
+##Environment Setting: 
+There are two cups placed on the table:
+- One blue cup is filled with water, with the coordinate as {blue}
+- One yellow cup is empty, with the coordinate as {yellow}
+
+- Marked points names are listed as: {marked}, in which the name entity starts with "Origin_" indicates its initial position (not used for grasping), other names without this prefix are the current/dynamic positions during the task.
+- serve point is at [0.8, 0.0, 1.2], where the human user is waiting for the water.
+
+##Task:
+Pour the water from the blue cup into the yellow cup, put the blue cup back, and serve the water to the human user at the serve point. Do not release the cup at the serving point.
+
+"""
+SERVE_WATER_SHORT = "blue_cup {blue} with water, yellow cup {yellow} without water."
+
+SERVE_FRUIT_DESCRIPTION = """\n
+## Environment Setting: 
+There are three objects at the table:
+- an apple is at {apple}
+- a banana is at {banana}
+- a large bowl is at {bowl_side} (not graspable with one single hand) \n
+- serve point is at (0.6, 0.0, 1.0) in the middle air. \n
+- Marked points position are listed as: {marked}, in which the name entity starts with "Origin_" indicates its initial position, other names without this prefix are the current/dynamic positions during the task. 
+
+Task: 
+Grasp the fruits and release them to the bowl, and serve the bowl to the human user at serve point. 
+
+Notes:
+Do not release the bowl at the serve point. 
+Do not release the apple and banana in the overlap area.
+
+"""
+SERVE_FRUIT_SHORT = " apple is at {apple}), banana is at {banana}, and bowl is at {bowl}."
+
+TASKS = {spec.name: spec for spec in [
+    TaskSpec(name="ServeWater", model_file="ServeWater.ttm", model_root="cups_with_balls",
+             task_types=['left_blue_right_yellow', 'left_yellow_right_blue', 'both_left', 'both_right'],
+             objects={'blue_cup': "Origin_blue_cup", 'yellow_cup': "Origin_yellow_cup", 'ball': "big_ball",
+                      'sensor_1': "yellow_cup_sensor", 'sensor_2': "serve_point_sensor"},
+             static=["big_ball", "blue_cup_respondable", "yellow_cup_respondable"],
+             preload=['blue_cup', 'yellow_cup', 'big_ball', 'yellow_cup_sensor', 'serve_point_sensor', 'serve_point', 'overlap_area'],
+             track=['Origin_blue_cup', 'Origin_yellow_cup', 'yellow_cup', 'blue_cup', 'serve_point', 'overlap_area'],
+             success=[("yellow_cup_sensor", "big_ball", None), ("serve_point_sensor", "yellow_cup_respondable", None)],
+             failures=[('below', "big_ball", TABLE_DROP_Z, 'The ball fell off the table!'),
+                       ('below', "blue_cup", TABLE_DROP_Z, 'The blue cup fell off the table!'),
+                       ('below', "yellow_cup", TABLE_DROP_Z, 'The yellow cup fell off the table!'),
+                       ('outside', "big_ball", ["blue_cup", "yellow_cup"], 0.1, 'The water is spilled!')],
+             description=SERVE_WATER_DESCRIPTION, short_description=SERVE_WATER_SHORT, task_class=ServeWaterTask),
+    TaskSpec(name="ServeFruit", model_file="ServeFruit.ttm", model_root="Bowl_Apple_Banana",
+             task_types=['same_fruits_same_bowl', 'same_fruits_diff_bowl', 'diff_fruit_left_bowl', 'diff_fruit_right_bowl'],
+             objects={'bowl_object': "Origin_bowl", 'apple_object': "Apple", 'banana_object': "Banana", 'target_sensor': "serve_point_sensor"},
+             static=["Bowl_respondable", "Apple", "Banana"],
+             preload=['Apple', 'Banana', 'Bowl', 'bowl', 'serve_point_sensor', 'serve_point', 'overlap_area', 'left_hand', 'right_hand'],
+             track=['Origin_right_hand', 'Origin_left_hand', 'Apple', 'Banana', 'Bowl', 'overlap_area', 'serve_point'],
+             success=[("serve_point_sensor", "Apple", 'The apple is not lifted with the bowl!'),
+                      ("serve_point_sensor", "Banana", 'The banana is not lifted with the bowl!')],
+             failures=[('below', "Apple", TABLE_DROP_Z, 'The apple fell off the table!'),
+                       ('below', "Banana", TABLE_DROP_Z, 'The banana fell off the table!'),
+                       ('below', "Bowl", TABLE_DROP_Z, 'The bowl fell off the table!')],
+             description=SERVE_FRUIT_DESCRIPTION, short_description=SERVE_FRUIT_SHORT, task_class=ServeFruitTask,
+             remove=['scissor']),
+]}
+
+def create_task(task_name, scenarios=None):
+    if task_name not in TASKS:
         print("The task is not defined yet!")
-        return False
\ No newline at end of file
+        return False
+    return TASKS[task_name].task_class(scenarios)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Checks of the task monitor's failure predicates on scripted scene snapshots
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import unittest
+
+from task_monitor import TaskMonitor
+from tasks import TASKS
+
+
+class ScriptedScene():
+    """Returns one scripted snapshot per update, as the scene reader does after every step."""
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+    def snapshot(self):
+        return {'objects': self.steps.pop(0), 'checks': [False, False]}
+
+
+def serve_water(steps):
+    spec = TASKS['ServeWater']
+    return TaskMonitor(ScriptedScene(steps), spec.success, spec.failures)
+
+
+BLUE_CUP, YELLOW_CUP = [0.45, 0.3, 0.85], [0.45, -0.3, 0.85]
+
+
+class ServeWaterSpillTest(unittest.TestCase):
+    def run_steps(self, balls, blue_cups=None):
+        blue_cups = blue_cups or [BLUE_CUP] * len(balls)
+        monitor = serve_water([{'big_ball': ball, 'blue_cup': blue_cup, 'yellow_cup': YELLOW_CUP}
+                               for ball, blue_cup in zip(balls, blue_cups)])
+        return [monitor.update() for _ in balls], monitor.reason
+
+    def test_pour_is_no_spill(self):
+        # The blue cup is lifted over the yellow one and poured out; right after pour_out the ball
+        # is still falling between the cups, farther than 0.1 m from both, then lands in the yellow cup.
+        blue_cups = [BLUE_CUP, [0.45, 0.3, 1.0], [0.45, -0.2, 1.05], [0.45, -0.2, 1.05], [0.45, -0.2, 1.05]]
+        balls = [[0.45, 0.3, 0.86], [0.45, 0.3, 1.01], [0.45, -0.05, 0.98], [0.45, -0.29, 0.87], [0.45, -0.29, 0.87]]
+        outcomes, _ = self.run_steps(balls, blue_cups)
+        self.assertEqual(outcomes, [None] * len(balls))
+
+    def test_spill_at_rest(self):
+        # The ball rolls off and comes to rest on the table, away from both cups.
+        balls = [[0.45, 0.3, 0.86], [0.6, 0.0, 0.83], [0.65, 0.0, 0.8], [0.65, 0.0, 0.8]]
+        outcomes, reason = self.run_steps(balls)
+        self.assertEqual(outcomes, [None, None, None, 'failure'])
+        self.assertEqual(reason, 'The water is spilled!')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Coordinated dual-arm Cartesian trajectories for NICOL Bimanual Robot
+Author: Kun Chu (kun.chu@uni-hamburg.de)
+Copyright 2024, Planet Earth
+"""
+import math
+import time
+
+import numpy as np
+
+"""
+Trajectory structure:
+path    -- straight Cartesian segment per arm, waypoints at most `max_step` apart along any axis, in either direction
+timing  -- one minimum-jerk time law shared by both arms, so the offset between the hands stays fixed
+execute -- intermediate waypoints are streamed without blocking at their scheduled times, only the goal blocks
+execute -- with an IK service per arm, each arm's path is solved from its current joints and streamed as joint targets
+"""
+
+def minimum_jerk(s):
+    """Progress along the path (0..1) at normalized time s (0..1); zero velocity and acceleration at both ends."""
+    return 10 * s**3 - 15 * s**4 + 6 * s**5
+
+
+class DualArmTrajectory():
+    """
+    Waypoints of both end effectors at common time stamps. Both arms follow the
+    same time law, so a rigid offset between the hands (e.g. around a carried
+    bowl) is kept at every waypoint.
+    """
+    def __init__(self, left_start, left_goal, right_start, right_goal, max_step=0.065, max_speed=0.25):
+        left_start, left_goal = np.asarray(left_start, dtype=float), np.asarray(left_goal, dtype=float)
+        right_start, right_goal = np.asarray(right_start, dtype=float), np.asarray(right_goal, dtype=float)
+        left_delta, right_delta = left_goal - left_start, right_goal - right_start
+        longest = max(np.abs(left_delta).max(), np.abs(right_delta).max())
+        distance = max(np.linalg.norm(left_delta), np.linalg.norm(right_delta))
+        steps = max(1, math.ceil(longest / max_step))
+        # The peak speed of a minimum-jerk profile is 1.875 times its mean speed.
+        self.duration = 1.875 * distance / max_speed
+        self.times = np.linspace(0.0, self.duration, steps + 1)[1:]
+        progress = minimum_jerk(np.linspace(0.0, 1.0, steps + 1)[1:])[:, None]
+        self.left = left_start + progress * left_delta
+        self.right = right_start + progress * right_delta
+
+    def __len__(self):
+        return len(self.times)
+
+    def execute(self, nicol, pose_class, left_ori, right_ori, realtime=True, arms=None, ik=None):
+        """
+        Stream the waypoints to both arms in one pass: every waypoint but the
+        last is sent without blocking at its scheduled time, the goal is sent
+        blocking. With realtime=False the waypoints are sent back to back.
+
+        With arms and ik, (left, right) pairs of arms and IK services, the
+        path of each arm is solved from its current joints (see solve_path) and
+        sent as joint targets; if either arm's path has a missing waypoint or a
+        joint jump, the pose targets are used instead.
+        Returns the number of waypoints sent.
+        """
+        joints = None
+        if arms is not None and ik is not None:
+            joints = (ik[0].solve_path(self.left.tolist(), left_ori), ik[1].solve_path(self.right.tolist(), right_ori))
+            if None in joints:
+                joints = None
+        start = time.perf_counter()
+        for i in range(len(self)):
+            last = i == len(self) - 1
+            if realtime and not last:
+                delay = start + self.times[i] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if joints is None:
+                nicol.set_pose_target_for_both_arms(pose_class(self.left[i].tolist(), left_ori), pose_class(self.right[i].tolist(), right_ori), block=last)
+            else:
+                # The right arm is started first so that it moves while the left one blocks.
+                arms[1].set_joint_position(joints[1][i], block=False)
+                arms[0].set_joint_position(joints[0][i], block=last)
+                if last:
+                    arms[1].set_joint_position(joints[1][i], block=True)
+        return len(self)